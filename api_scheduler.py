@@ -0,0 +1,215 @@
+"""Google Sheets / Drive API 呼び出しの共通スケジューラ
+
+- トークンバケットで1分あたりの呼び出し数をクォータ内に抑える
+- 429 / 5xx と通信エラーは指数バックオフ（ジッター付き）で再試行する
+  （行の追加など再送すると重複する書き込みは、実行されずに断られた 429 だけ）
+- 同じ読み込みが同時に走った場合は1回の呼び出しにまとめる
+- 待たされた・再試行した回数などを記録する
+
+ミラーの同期スレッドからも使うため、Streamlit のキャッシュではなく
+モジュール内のインスタンスをプロセス全体で共有する。
+"""
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import requests
+import streamlit as st
+
+from tracing import span
+
+# API ごとの既定値（secrets.toml の [SCHEDULER] で上書き可）
+# Sheets API の既定クォータはユーザーあたり毎分60リクエスト
+DEFAULT_LIMITS = {
+    "sheets": {"REQUESTS_PER_MINUTE": 60, "BURST": 10},
+    "drive": {"REQUESTS_PER_MINUTE": 600, "BURST": 20},
+}
+MAX_RETRIES = 5
+BASE_DELAY_SECONDS = 1.0
+MAX_DELAY_SECONDS = 32.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _status_code(error):
+    """gspread / googleapiclient の例外から HTTP ステータスを取り出す"""
+    response = getattr(error, "response", None)  # gspread.exceptions.APIError
+    if response is not None and getattr(response, "status_code", None):
+        return response.status_code
+    resp = getattr(error, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None):
+        return int(resp.status)
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout,
+                          ConnectionError, TimeoutError)):
+        return True
+    return _status_code(error) in RETRYABLE_STATUS
+
+
+def is_rejected(error):
+    """実行される前に断られたエラー（再送しても二重に反映されない）か
+
+    5xx やタイムアウトは、サーバー側では反映済みの場合がある。
+    """
+    return _status_code(error) == 429
+
+
+class TokenBucket:
+    """1秒あたり rate 個ずつ補充され、最大 capacity 個まで貯まるバケット"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する（足りなければ待つ）。待った秒数を返す"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate,
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute, burst, max_retries=MAX_RETRIES,
+                 base_delay=BASE_DELAY_SECONDS, max_delay=MAX_DELAY_SECONDS):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.metrics = {
+            "calls": 0,
+            "throttled": 0,
+            "throttle_wait_seconds": 0.0,
+            "retried": 0,
+            "coalesced": 0,
+            "failed": 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.metrics[name] += value
+
+    def call(self, func, *args, coalesce_key=None, idempotent=True,
+             **kwargs):
+        """func(*args, **kwargs) をレート制限・再試行付きで実行する
+
+        coalesce_key を指定した読み込みは、同じキーの呼び出しが実行中なら
+        その結果を共有する（書き込みには指定しないこと）。
+        idempotent=False（行の追加など）は 429 のときだけ再試行する。
+        """
+        if coalesce_key is None:
+            return self._execute(func, args, kwargs, idempotent)
+
+        with self._lock:
+            future = self._inflight.get(coalesce_key)
+            owner = future is None
+            if owner:
+                future = self._inflight[coalesce_key] = Future()
+            else:
+                self.metrics["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._execute(func, args, kwargs, idempotent)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(coalesce_key, None)
+
+    def _execute(self, func, args, kwargs, idempotent=True):
+        retryable = is_retryable if idempotent else is_rejected
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire()
+            if waited:
+                self._count("throttled")
+                self._count("throttle_wait_seconds", waited)
+            self._count("calls")
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not retryable(e):
+                    self._count("failed")
+                    raise
+                # フルジッター: 0〜上限の間でランダムに待つ
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+                self._count("retried")
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.metrics)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_request_scheduler(api="sheets"):
+    """API ごとにプロセス全体で共有するスケジューラを返す"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(api)
+        if scheduler is None:
+            limits = dict(DEFAULT_LIMITS[api])
+            config = st.secrets.get("SCHEDULER", {})
+            limits.update(config.get(api.upper(), {}))
+            scheduler = RequestScheduler(
+                limits["REQUESTS_PER_MINUTE"],
+                limits["BURST"],
+                max_retries=config.get("MAX_RETRIES", MAX_RETRIES),
+            )
+            _schedulers[api] = scheduler
+        return scheduler
+
+
+def scheduled(func, *args, api="sheets", coalesce_key=None, idempotent=True,
+              **kwargs):
+    """共有スケジューラ経由で API を呼び出す
+
+    再送すると重複する書き込みは idempotent=False を指定する。
+    """
+    with span(f"{api}.{getattr(func, '__name__', 'call')}"):
+        return get_request_scheduler(api).call(
+            func, *args, coalesce_key=coalesce_key, idempotent=idempotent,
+            **kwargs
+        )
+
+
+def show_scheduler_metrics():
+    """サイドバーに API 呼び出しの状況を表示する"""
+    with st.sidebar.expander("API呼び出し状況"):
+        for api in sorted(_schedulers):
+            metrics = _schedulers[api].snapshot()
+            st.write(
+                f"**{api}**: 呼び出し {metrics['calls']} / "
+                f"待機 {metrics['throttled']}"
+                f"（{metrics['throttle_wait_seconds']:.1f}秒） / "
+                f"再試行 {metrics['retried']} / "
+                f"共有 {metrics['coalesced']} / 失敗 {metrics['failed']}"
+            )
@@ -1,132 +1,163 @@
 import datetime
-import random
 import time
-import requests
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-
-# 認証設定
-AUTH_CONFIG = st.secrets["AUTH"]
-PIN_CODE = AUTH_CONFIG["PIN_CODE"]
-SESSION_TIMEOUT_MINUTES = AUTH_CONFIG.get("SESSION_TIMEOUT_MINUTES", 30)
-
-
-# 認証関数
-def check_authentication():
-    """認証チェック関数"""
-    # セッション状態の初期化
-    if "authenticated" not in st.session_state:
-        st.session_state.authenticated = False
-        st.session_state.auth_time = None
-
-    # セッションタイムアウトチェック
-    if st.session_state.authenticated and st.session_state.auth_time:
-        elapsed_minutes = (time.time() - st.session_state.auth_time) / 60
-        if elapsed_minutes > SESSION_TIMEOUT_MINUTES:
-            st.session_state.authenticated = False
-            st.session_state.auth_time = None
-            st.warning(
-                f"セッションがタイムアウトしました（{SESSION_TIMEOUT_MINUTES}分）"
-            )
-
-    return st.session_state.authenticated
-
-
-def show_login_form():
-    """ログイン画面表示"""
-    st.title("資産管理アプリ")
-    st.markdown("---")
-
-    # PINコード認証のみ
-    st.subheader("PINを入力")
-    pin_input = st.text_input("暗証番号", type="password", placeholder="PINを入力")
-
-    if st.button("ログイン", type="primary"):
-        if pin_input == PIN_CODE:
-            st.session_state.authenticated = True
-            st.session_state.auth_time = time.time()
-            st.success("認証成功！")
-            st.rerun()
-        else:
-            st.error("暗証番号が間違っています")
-
-def get_pokemon(id):
-    url = f"https://pokeapi.co/api/v2/pokemon/{id}"
-    response = requests.get(url)
-    data = response.json()
-    pokemon = {}
-    response_sp = requests.get(data["species"]["url"])
-    pokemon["name"] = response_sp.json()["names"][0]["name"]
-    pokemon["image"] = data["sprites"]["other"]["showdown"]["front_default"]
-
-    return pokemon
-
-
-# Google Sheets API認証
-def authenticate_google_sheets():
-    google_credentials = st.secrets["GOOGLE_CREDENTIALS"]
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-        google_credentials, scope
-    )
-    client = gspread.authorize(credentials)
-    return client
-
-
-# スプレッドシートへの接続
-def get_google_sheet(sheet_name):
-    client = authenticate_google_sheets()
-    sheet = client.open(sheet_name).sheet1  # 最初のシートを取得
-    return sheet
-
-
-def get_google_sheet2(sheet_name):
-    client = authenticate_google_sheets()
-    # 2番目のシートを取得（インデックスは0から始まる）
-    sheet = client.open(sheet_name).get_worksheet(1)
-    return sheet
-
 
-def get_google_sheet_by_name(sheet_name, worksheet_name):
-    client = authenticate_google_sheets()
-    spreadsheet = client.open(sheet_name)
-    try:
-        sheet = spreadsheet.worksheet(worksheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        sheet = spreadsheet.add_worksheet(title=worksheet_name, rows=1000, cols=20)
-    return sheet
-
-
-# スプレッドシートからデータ読み込み
-def load_data(sheet):
-    records = sheet.get_all_records()  # シート全体を取得
-    return pd.DataFrame(records)
+from api_scheduler import show_scheduler_metrics
+from auth import require_login
+from balances import (
+    BALANCE_SHEET, BALANCE_TABLE, get_store_balance_ledger, show_balance_check,
+)
+from pokemon_sprites import get_pokemon_loader
+from sheet_schemas import Column, Schema, SchemaError
+from table_store import STORAGE_ERRORS, get_table_store
+from tracing import (
+    begin_rerun, show_timing_panel, span, traced, traced_fragment,
+)
+
+begin_rerun("app")
+
+# 支出シート・支出履歴の列（スプレッドシート上の列順）
+# 以前の精算で Place が小文字の place になったシートもあるため Place は必須にしない
+EXPENSE_SCHEMA = Schema([
+    Column("Person", "category"),
+    Column("Date", "datetime"),
+    Column("Amount", "Int32"),
+    Column("Content", "category"),
+    Column("Place", "text", required=False),
+])
+EXPENSE_COLUMNS = EXPENSE_SCHEMA.names
+
+# 精算履歴の列（表示するだけなので必須の列はない）
+HISTORY_SCHEMA = Schema([
+    Column("精算日", "datetime", required=False,
+           date_format="%Y-%m-%d %H:%M:%S"),
+    Column("支払者", "category", required=False),
+    Column("金額", "float", required=False),
+    Column("総支出", "Int64", required=False),
+    # 3人以上で精算するようになってから追加した列（以前のシートにはない）
+    Column("受取者", "category", required=False),
+])
+HISTORY_COLUMNS = HISTORY_SCHEMA.names
+
+SCHEMAS = {"expense": EXPENSE_SCHEMA, "history": HISTORY_SCHEMA,
+           "detail": EXPENSE_SCHEMA}
+
+# 日付列は時刻を付けずに表示する
+EXPENSE_COLUMN_CONFIG = {"Date": st.column_config.DateColumn(format="YYYY-MM-DD")}
+
+
+# 保存先の表とワークシートの対応（Sheets では1番目・2番目のシートと
+# 「支出履歴」、支出シートの人ごとの合計・分類ごとの小計は「精算用の合計」）
+TABLES = {"expense": 0, "history": 1, "detail": "支出履歴",
+          BALANCE_TABLE: BALANCE_SHEET}
+
+# 支出シートの合計の列
+BALANCE_COLUMNS = {"person_column": "Person", "amount_column": "Amount",
+                   "category_column": "Content"}
+
+
+# 支出履歴を期間で絞り込み、ページ単位で表示（新しい順）
+@traced()
+def show_detail_history(data_detail):
+    if data_detail.empty:
+        st.info("支出履歴はまだありません。")
+        return
+
+    dates = pd.to_datetime(data_detail["Date"], errors="coerce")
+    # 日付を読み取れない行は期間に関係なく表示する（絞り込みで消さない）
+    undated = dates.isna()
+    col1, col2, col3 = st.columns([2, 1, 1])
+    period = ()
+    if undated.all():
+        col1.caption("日付を読み取れないため、期間では絞り込めません。")
+    else:
+        period = col1.date_input(
+            "期間", value=(dates.min().date(), dates.max().date())
+        )
+    page_size = col2.selectbox("表示件数", [50, 100, 500], index=1)
+
+    filtered = data_detail
+    if len(period) == 2:
+        start, end = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+        filtered = data_detail[undated | ((dates >= start) & (dates <= end))]
+    filtered = filtered.iloc[::-1]
+
+    page_count = max(1, -(-len(filtered) // page_size))
+    page = col3.number_input("ページ", min_value=1, max_value=page_count,
+                             value=1)
+    first = (page - 1) * page_size
+    st.dataframe(filtered.iloc[first:first + page_size],
+                 column_config=EXPENSE_COLUMN_CONFIG)
+    st.caption(
+        f"{len(filtered)}件中 {min(first + 1, len(filtered))}〜"
+        f"{min(first + page_size, len(filtered))}件目"
+        f"（全{len(data_detail)}件）"
+        + (f"。日付を読み取れない{undated.sum()}件を含みます" if undated.any()
+           else "")
+    )
 
 
-# 精算内容保存
-def save_settlement_history(sheet, data):
-    # データを追加（2次元リスト形式）
-    values = data.values.tolist()
-    if values:
-        sheet.append_rows(values)
+# 支出を1行だけ追記し、手元のデータフレームにも反映
+@traced()
+def append_expense(data, new_row):
+    rows = [[new_row[col] for col in EXPENSE_COLUMNS]]
+    # 手元が空のときだけ、ヘッダー行があるかを確認する
+    if data.empty and not store.has_header("expense"):
+        rows.insert(0, EXPENSE_COLUMNS)
+    # ミラー使用時はローカルに書き込み、Sheets へは裏で反映する
+    store.append_rows("expense", rows)
+    # 保存先が保持しているデータフレームには同じ行が追加されている
+    return load_frames("expense")["expense"]
+
+
+# 精算履歴に書き込む操作（行はシートのヘッダーの列順に並べる）
+# 受取者の列がない以前のヘッダーのままでは追加した列が読まれないため、
+# 列を足したヘッダーで精算履歴全体を書き直す
+def history_write(history_data):
+    if not store.has_header("history"):
+        return ("append", "history",
+                [HISTORY_COLUMNS] + HISTORY_SCHEMA.rows(history_data))
+    history = load_frames("history")["history"]
+    header = list(history.columns)
+    missing = [name for name in HISTORY_COLUMNS if name not in header]
+    if not missing:
+        return ("append", "history",
+                HISTORY_SCHEMA.rows(history_data.reindex(columns=header)))
+    header += missing
+    return ("replace", "history",
+            [header]
+            + HISTORY_SCHEMA.rows(history.reindex(columns=header))
+            + HISTORY_SCHEMA.rows(history_data.reindex(columns=header)))
+
+
+# 精算の書き込みをまとめて実行
+# （精算履歴・支出履歴への追記と支出シートのクリア）
+# Sheets では1回の batchUpdate（すべて反映されるか何も反映されないかの
+# どちらか）になるので、履歴への書き込みが確定しないまま支出シートだけが
+# 消えることはない
+@traced()
+def commit_settlement(history_data, detail_data):
+    # 型付きのデータフレームをシートに書く値（日付は文字列）に戻す
+    history_write_op = history_write(history_data)
+    detail_rows = EXPENSE_SCHEMA.rows(detail_data)
+    if not store.has_header("detail"):
+        detail_rows.insert(0, detail_data.columns.tolist())
+
+    writes = [
+        history_write_op,
+        ("append", "detail", detail_rows),
+        ("replace", "expense", [EXPENSE_COLUMNS]),
+    ]
 
+    started = time.perf_counter()
+    # ミラーでは3つの書き込みが1件の送信待ちとしてまとめて反映される
+    store.batch(writes)
+    return time.perf_counter() - started
 
-# データフレームをスプレッドシートに保存
-def save_data(sheet, data):
-    sheet.clear()  # シート内容をクリア
-    sheet.update(
-        [data.columns.values.tolist()] + data.values.tolist()
-    )  # ヘッダーとデータを書き込み
 
 # メインアプリ
-if not check_authentication():
-    show_login_form()
-    st.stop()
+require_login()
 
 # アプリのタイトル
 st.title("家計管理アプリ")
@@ -134,135 +165,163 @@ st.title("家計管理アプリ")
 # スプレッドシート名
 SHEET_NAME = "kakei_seisan"
 
-# スプレッドシートへの接続
-sheet = get_google_sheet(SHEET_NAME)
-history_sheet = get_google_sheet2(SHEET_NAME)
-detail_sheet = get_google_sheet_by_name(SHEET_NAME, "支出履歴")
+# 保存先への接続（[STORAGE] BACKEND で切り替え、既定は Google Sheets）
+# 開いているタブで使う表だけを読み込む。Sheets ではキャッシュにない
+# シートを1回のAPI呼び出しで取得し、支出履歴は差分のみ読む
+# ミラー使用時はローカルの SQLite から読む
+store = get_table_store(SHEET_NAME, TABLES, _schemas=SCHEMAS,
+                        tail_tables=("detail",))
 
-# データ読み込み
-try:
-    data = load_data(sheet)
-except Exception:
-    data = pd.DataFrame(columns=["Person", "Date", "Amount", "Content", "Place"])
 
-name1 = st.secrets.NAME1
-name2 = st.secrets.NAME2
+@traced()
+def load_frames(*names):
+    try:
+        return store.read_frames(names)
+    except SchemaError as e:
+        # 空として扱うと精算で支出シートを消してしまうため、ここで止める
+        st.error(f"シートの列を確認してください（保存・精算はできません）: {e}")
+        st.stop()
+    except STORAGE_ERRORS as e:
+        st.warning(f"データの読み込みに失敗しました: {e}")
+        return {name: SCHEMAS[name].empty() for name in names}
+
+
+# 精算の参加者（[PARTICIPANTS] があればその全員、なければ NAME1 と NAME2）
+if "PARTICIPANTS" in st.secrets:
+    participants = list(st.secrets.PARTICIPANTS)
+else:
+    participants = [st.secrets.NAME1, st.secrets.NAME2]
+
+
+# 1人分の入力フォーム。追加したら手元のデータフレームを返す
+def show_expense_form(column, name, data):
+    with column:
+        st.subheader(name)
+        date = st.date_input(f"日付（{name}）")
+        amount = st.number_input(f"金額（{name}）", min_value=0, step=100, value=None, placeholder="金額を入力")
+        sub_col1, sub_col2 = column.columns(2)
+        content = sub_col1.radio(f"分類({name})", ["食費", "その他"])
+        place = sub_col2.text_input(f"場所({name})")
+        if st.button(f"追加（{name}）"):
+            new_row = {
+                "Person": name,
+                "Date": str(date),
+                "Amount": amount,
+                "Content": content,
+                "Place": place,
+            }
+            data = append_expense(data, new_row)
+            st.success(f"{name} の支出が追加されました！")
+    return data
 
-tabs = st.tabs(["記録", "精算履歴", "支出履歴"])
 
-with tabs[0]:
+# 記録タブ（入力・支出一覧・精算）
+# 操作するとこのフラグメントだけが再実行され、他のタブは読み込まない
+@traced_fragment("app")
+def show_record_tab():
+    data = load_frames("expense")["expense"]
 
-    # 入力フォーム
+    # 入力フォーム（2人ずつ横に並べる）
     st.header("支出の記録")
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.subheader(name1)
-        person_1_date = st.date_input(f"日付（{name1}）")
-        person_1_amount = st.number_input(f"金額（{name1}）", min_value=0, step=100, value=None, placeholder="金額を入力")
-        sub_col1, sub_col2 = col1.columns(2)
-        person_1_content = sub_col1.radio(f"分類({name1})", ["食費", "その他"])
-        person_1_place = sub_col2.text_input(f"場所({name1})")
-        if st.button(f"追加（{name1}）"):
-            new_row = {
-                "Person": name1,
-                "Date": str(person_1_date),
-                "Amount": person_1_amount,
-                "Content": person_1_content,
-                "Place": person_1_place
-            }
-            data = pd.concat([data, pd.DataFrame([new_row])], ignore_index=True)
-            save_data(sheet, data)
-            st.success(f"{name1} の支出が追加されました！")
-
-    with col2:
-        st.subheader(name2)
-        person_2_date = st.date_input(f"日付（{name2}）")
-        person_2_amount = st.number_input(f"金額（{name2}）", min_value=0, step=100, value=None, placeholder="金額を入力")
-        sub_col1, sub_col2 = col2.columns(2)
-        person_2_content = sub_col1.radio(f"分類({name2})", ["食費", "その他"])
-        person_2_place = sub_col2.text_input(f"場所({name2})")
-        if st.button(f"追加（{name2}）"):
-            new_row = {
-                "Person": name2,
-                "Date": str(person_2_date),
-                "Amount": person_2_amount,
-                "Content": person_2_content,
-                "Place": person_2_place,
-            }
-            data = pd.concat([data, pd.DataFrame([new_row])], ignore_index=True)
-            save_data(sheet, data)
-            st.success(f"{name2} の支出が追加されました！")
+    for first in range(0, len(participants), 2):
+        columns = st.columns(2)
+        for column, name in zip(columns, participants[first:first + 2]):
+            data = show_expense_form(column, name, data)
 
     # 表の表示
     st.header("支出一覧")
-    st.dataframe(data)
+    st.dataframe(data, column_config=EXPENSE_COLUMN_CONFIG)
+
+    # Personごとの合計金額（前回から増えた行だけを足す）
+    # 合計は同じ保存先の「精算用の合計」に保存し、支出シートと照合して使う
+    ledger = get_store_balance_ledger(SHEET_NAME, store.name, store)
+    balance_key = "expense"
+    balance = ledger.sync(balance_key, data, **BALANCE_COLUMNS)
+    # 全員で等分した場合の差額を、少ない回数の送金にまとめる
+    transfers, total_spent = balance.settlement(participants)
 
     # 精算機能
     st.header("精算")
+    if transfers:
+        st.caption("現在の精算額: " + " / ".join(
+            f"{payer} → {payee} ¥{amount:.0f}"
+            for payer, payee, amount in transfers
+        ))
+    with st.expander("人ごと・分類ごとの合計"):
+        st.dataframe(balance.subtotal_frame())
+        show_balance_check(ledger, balance_key, data, **BALANCE_COLUMNS)
     if st.button("精算する"):
-        # Personごとの合計金額を計算
-        total_person_1 = data[data["Person"] == name1]["Amount"].sum()
-        total_person_2 = data[data["Person"] == name2]["Amount"].sum()
-
-        # 精算計算
-        total_spent = total_person_1 + total_person_2
-        equal_share = total_spent / 2
-        difference = total_person_1 - total_person_2
-
-        if difference > 0:
-            payer = name2
-            payee = name1
-            amount_to_pay = abs(difference) / 2
-        elif difference < 0:
-            payer = name1
-            payee = name2
-            amount_to_pay = abs(difference) / 2
-        else:
-            payer, payee, amount_to_pay = None, None, None
-
-        # 結果表示
-        if payer and payee:
+        # 結果表示（精算額は表示中の支出一覧と照合済みの合計から求めてある）
+        for payer, payee, amount_to_pay in transfers:
             st.write(f"{payer} が {payee} に ¥{amount_to_pay:.0f} 支払う必要があります。")
-        else:
+        if not transfers:
             st.write("精算する必要はありません。")
 
-        # 精算履歴の記録
+        # 精算履歴の記録（送金ごとに1行、精算が不要なら支払者なしの1行）
+        settled_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         history_data = pd.DataFrame(
             [
                 {
-                    "精算日": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "精算日": settled_at,
                     "支払者": payer,
                     "金額": amount_to_pay,
                     "総支出": total_spent,
+                    "受取者": payee,
                 }
+                for payer, payee, amount_to_pay
+                in transfers or [(None, None, None)]
             ]
         )
-        save_settlement_history(history_sheet, history_data)
 
-        # 支出リストを支出履歴シートに追記
-        detail_data = data.copy()
-        existing = detail_sheet.get_all_values()
-        if not existing:
-            detail_sheet.insert_row(detail_data.columns.tolist(), index=1)
-        save_settlement_history(detail_sheet, detail_data)
+        # 精算履歴・支出履歴への追記と支出シートのクリアをまとめて実行
+        try:
+            elapsed = commit_settlement(history_data, data)
+        except Exception as e:
+            st.error(f"精算の保存に失敗しました（データは変更されていません）: {e}")
+        else:
+            data = EXPENSE_SCHEMA.empty()
+            st.success("精算が完了しました。")
+            st.caption(f"保存処理: {elapsed * 1000:.0f} ms")
 
-        # データクリア
-        data = pd.DataFrame(columns=["Person", "Date", "Amount", "Content", "place"])
-        save_data(sheet, data)
 
-        st.success("精算が完了しました。")
+# 精算履歴タブ
+@traced_fragment("app")
+def show_history_tab():
+    with span("render.history"):
+        data_histry = load_frames("history")["history"]
+        st.write(data_histry)
 
-with tabs[1]:
-    data_histry = load_data(history_sheet)
-    st.write(data_histry)
+        # キャッシュ済みの画像だけを表示し、次の1匹は裏で先読みする
+        pokemon = get_pokemon_loader().random_pokemon()
+        if pokemon is not None:
+            # st.write(f"No.{pokemon['id']} " + pokemon["name"])
+            st.image(pokemon["image"])
 
-    pokemon_id = random.randrange(800)
-    pokemon = get_pokemon(pokemon_id)
-    # st.write(f"No.{pokemon_id} " + pokemon["name"])
-    st.image(pokemon["image"])
 
-with tabs[2]:
+# 支出履歴タブ（期間・ページの操作はこのフラグメント内で完結する）
+@traced_fragment("app")
+def show_detail_tab():
     st.header("支出履歴")
-    data_detail = load_data(detail_sheet)
-    st.dataframe(data_detail)
+    show_detail_history(load_frames("detail")["detail"])
+
+
+# 開いているタブの中身だけを実行する（タブの切り替えで再実行）
+record_tab, history_tab, detail_tab = st.tabs(
+    ["記録", "精算履歴", "支出履歴"], key="main_tab", on_change="rerun"
+)
+
+if record_tab.open:
+    with record_tab:
+        show_record_tab()
+
+if history_tab.open:
+    with history_tab:
+        show_history_tab()
+
+if detail_tab.open:
+    with detail_tab:
+        show_detail_tab()
+
+store.show_status()
+show_scheduler_metrics()
+show_timing_panel()
@@ -1,108 +1,15 @@
 import datetime
 import streamlit as st
 import pandas as pd
-import gspread
 import plotly.graph_objects as go
-# import hashlib
-import time
-from oauth2client.service_account import ServiceAccountCredentials
 
+from api_scheduler import show_scheduler_metrics
+from auth import require_login
+from sheet_schemas import Column, Schema, SchemaError
+from table_store import STORAGE_ERRORS, get_table_store
+from tracing import begin_rerun, show_timing_panel, span, traced
 
-# 認証設定
-AUTH_CONFIG = st.secrets["AUTH"]
-PIN_CODE = AUTH_CONFIG["PIN_CODE"]
-SESSION_TIMEOUT_MINUTES = AUTH_CONFIG.get("SESSION_TIMEOUT_MINUTES", 30)
-
-
-# 認証関数
-def check_authentication():
-    """認証チェック関数"""
-    # セッション状態の初期化
-    if "authenticated" not in st.session_state:
-        st.session_state.authenticated = False
-        st.session_state.auth_time = None
-    
-    # セッションタイムアウトチェック
-    if st.session_state.authenticated and st.session_state.auth_time:
-        elapsed_minutes = (time.time() - st.session_state.auth_time) / 60
-        if elapsed_minutes > SESSION_TIMEOUT_MINUTES:
-            st.session_state.authenticated = False
-            st.session_state.auth_time = None
-            st.warning(f"セッションがタイムアウトしました（{SESSION_TIMEOUT_MINUTES}分）")
-    
-    return st.session_state.authenticated
-
-
-def show_login_form():
-    """ログイン画面表示"""
-    st.title("資産管理アプリ")
-    st.markdown("---")
-    
-    # PINコード認証のみ
-    st.subheader("PINを入力")
-    pin_input = st.text_input(
-        "暗証番号",
-        type="password",
-        placeholder="PINを入力"
-    )
-    
-    if st.button("ログイン", type="primary"):
-        if pin_input == PIN_CODE:
-            st.session_state.authenticated = True
-            st.session_state.auth_time = time.time()
-            st.success("認証成功！")
-            st.rerun()
-        else:
-            st.error("暗証番号が間違っています")
-    
-    # パスフレーズ認証（参考用にコメントアウト）
-    # # 認証方法選択
-    # auth_method = st.radio(
-    #     "認証方法を選択してください：",
-    #     ["4桁暗証番号", "パスフレーズ（推奨）"],
-    #     help="パスフレーズの方がより安全です"
-    # )
-    # 
-    # if auth_method == "4桁暗証番号":
-    #     st.subheader("4桁暗証番号を入力")
-    #     pin_input = st.text_input(
-    #         "暗証番号",
-    #         type="password",
-    #         max_chars=4,
-    #         placeholder="4桁の数字を入力"
-    #     )
-    #     
-    #     if st.button("ログイン", type="primary"):
-    #         if pin_input == PIN_CODE:
-    #             st.session_state.authenticated = True
-    #             st.session_state.auth_time = time.time()
-    #             st.success("認証成功！")
-    #             st.rerun()
-    #         else:
-    #             st.error("暗証番号が間違っています")
-    #             
-    # else:  # パスフレーズ
-    #     st.subheader("パスフレーズを入力")
-    #     st.info("💡 パスフレーズは文字数が多く、より安全です")
-    #     
-    #     passphrase_input = st.text_input(
-    #         "パスフレーズ",
-    #         type="password",
-    #         placeholder="設定したパスフレーズを入力"
-    #     )
-    #     
-    #     if st.button("ログイン", type="primary"):
-    #         # パスフレーズをハッシュ化して比較
-    #         input_hash = hashlib.sha256(passphrase_input.encode()).hexdigest()
-    #         stored_hash = AUTH_CONFIG.get("PASSPHRASE_HASH", "")
-    #         
-    #         if input_hash == stored_hash:
-    #             st.session_state.authenticated = True
-    #             st.session_state.auth_time = time.time()
-    #             st.success("認証成功！")
-    #             st.rerun()
-    #         else:
-    #             st.error("パスフレーズが間違っています")
+begin_rerun("app_assets")
 
 
 # 項目名設定を読み込み
@@ -114,51 +21,40 @@ ITEM_D = ASSET_CATEGORIES["ITEM_D"]
 ITEM_E = ASSET_CATEGORIES["ITEM_E"]
 ITEM_F = ASSET_CATEGORIES["ITEM_F"]
 
+# 資産シートの列（増減は「+1.2%」などの文字列）
+ASSET_SCHEMA = Schema(
+    [Column("日付", "datetime")]
+    + [Column(item, "Int64")
+       for item in [ITEM_A, ITEM_B, ITEM_C, ITEM_D, ITEM_E, ITEM_F, "合計"]]
+    + [Column("増減", "text", required=False)]
+)
 
-# Google Sheets API認証
-def authenticate_google_sheets():
-    google_credentials = st.secrets["GOOGLE_CREDENTIALS"]
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-        google_credentials, scope
-    )
-    client = gspread.authorize(credentials)
-    return client
 
+# 保存先（[STORAGE] BACKEND で切り替え、既定は Google Sheets）
+# スプレッドシートが存在しない場合は新規作成する
+def get_asset_store(sheet_name):
+    return get_table_store(sheet_name, {"assets": 0},
+                           _schemas={"assets": ASSET_SCHEMA},
+                           create_missing=True)
 
-# スプレッドシートへの接続
-def get_google_sheet(sheet_name):
-    client = authenticate_google_sheets()
-    try:
-        # 指定された名前のスプレッドシートを開く
-        sheet = client.open(sheet_name).sheet1
-        return sheet
-    except gspread.SpreadsheetNotFound:
-        # スプレッドシートが存在しない場合は新規作成
-        sheet = client.create(sheet_name).sheet1
-        # ヘッダーを設定
-        headers = ["日付", ITEM_A, ITEM_B, ITEM_C, ITEM_D,
-                   ITEM_E, ITEM_F, "合計", "増減"]
-        sheet.append_row(headers)
-        return sheet
-
-
-# スプレッドシートからデータ読み込み
-def load_data(sheet):
+
+# 保存先からデータ読み込み
+# 値の2次元リストから列ごとに型を付けて作り、変更がなければ読み直さない
+# 列がスキーマと合わない場合は、空として扱って「初回」で保存しないよう止める
+@traced()
+def load_data(store):
     try:
-        records = sheet.get_all_records()
-        if not records:
-            columns = ["日付", ITEM_A, ITEM_B, ITEM_C, ITEM_D,
-                       ITEM_E, ITEM_F, "合計", "増減"]
-            return pd.DataFrame(columns=columns)
-        return pd.DataFrame(records)
-    except Exception:
-        columns = ["日付", ITEM_A, ITEM_B, ITEM_C, ITEM_D,
-                   ITEM_E, ITEM_F, "合計", "増減"]
-        return pd.DataFrame(columns=columns)
+        data = store.read_frame("assets")
+        # 新しく作成した表にはヘッダーを設定
+        if not store.has_header("assets"):
+            store.append_rows("assets", [ASSET_SCHEMA.names])
+        return data
+    except SchemaError as e:
+        st.error(f"資産シートの列を確認してください（保存はできません）: {e}")
+        st.stop()
+    except STORAGE_ERRORS as e:
+        st.warning(f"データの読み込みに失敗しました: {e}")
+        return ASSET_SCHEMA.empty()
 
 
 # 前回の合計金額を取得
@@ -242,7 +138,8 @@ def get_previous_day_data(data):
 
 
 # 新しいデータを追加
-def add_new_data(sheet, new_data):
+@traced()
+def add_new_data(store, new_data):
     # データを行として追加（数値をPythonの標準型に変換）
     row_data = [
         new_data["日付"],
@@ -255,14 +152,13 @@ def add_new_data(sheet, new_data):
         int(new_data["合計"]) if new_data["合計"] != 0 else 0,
         new_data["増減"]
     ]
-    sheet.append_row(row_data)
+    # ミラー使用時はローカルに書き込み、Sheets へは裏で反映される
+    store.append_rows("assets", [row_data])
 
 
 # ===== メインアプリケーション =====
 # 認証チェック
-if not check_authentication():
-    show_login_form()
-    st.stop()
+require_login()
 
 # アプリのタイトル
 st.title("総資産集計アプリ")
@@ -270,11 +166,14 @@ st.title("総資産集計アプリ")
 # スプレッドシート名
 SHEET_NAME = "assets"
 
-# スプレッドシートへの接続
-sheet = get_google_sheet(SHEET_NAME)
+# 保存先への接続
+store = get_asset_store(SHEET_NAME)
 
 # データ読み込み
-data = load_data(sheet)
+data = load_data(store)
+
+store.show_status()
+show_scheduler_metrics()
 
 # 前日のデータを取得
 previous_data = get_previous_day_data(data)
@@ -379,11 +278,11 @@ if st.button("決定", type="primary", use_container_width=True):
     
     # スプレッドシートに追加
     try:
-        add_new_data(sheet, final_data)
+        add_new_data(store, final_data)
         st.success("データが正常に保存されました！")
         
         # データを再読み込み
-        data = load_data(sheet)
+        data = load_data(store)
         
     except Exception as e:
         st.error(f"データの保存に失敗しました: {str(e)}")
@@ -519,8 +418,11 @@ if not data.empty:
             hovermode='x unified'
         )
 
-        st.plotly_chart(fig_area, use_container_width=True)
+        with span("render.chart"):
+            st.plotly_chart(fig_area, use_container_width=True)
     else:
         st.info(f"選択した期間（{selected_period}）にデータがありません。")
 else:
     st.info("まだデータがありません。上記のフォームから入力してください。")
+
+show_timing_panel()
@@ -1,12 +1,19 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
-from datetime import datetime
 import calendar
-from oauth2client.service_account import ServiceAccountCredentials
+import contextlib
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 import io
+import threading
+
+from api_scheduler import scheduled, show_scheduler_metrics
+from csv_cache import get_csv_cache
+from csv_encoding import read_csv_bytes
+from drive_index import get_drive_folder_index
+from kakeibo_data import MAX_WORKERS, get_month_data_store, load_in_parallel
+from sheets_client import load_service_account_credentials
+from tracing import begin_rerun, show_timing_panel, span, traced
 
 
 # 設定を読み込む関数
@@ -36,149 +43,215 @@ def load_config():
     return config
 
 
-# Google Sheets API認証
-def authenticate_google_sheets():
-    """Google Sheets APIの認証"""
-    try:
-        google_credentials = st.secrets["GOOGLE_CREDENTIALS"]
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive",
-        ]
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            google_credentials, scope
+class DriveServicePool:
+    """Drive API サービスを使い回すプール
+
+    googleapiclient のサービスは（内部の httplib2 が）スレッドセーフでない
+    ため、同時に使うスレッドにはそれぞれ別のサービスを貸し出す。返された
+    サービスは次のスレッドや再実行で使い回し、作るのは同時に使う数だけ。
+    """
+
+    def __init__(self, build_service):
+        self._build_service = build_service
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def service(self):
+        with self._lock:
+            service = self._idle.pop() if self._idle else None
+        if service is None:
+            service = self._build_service()
+        try:
+            yield service
+        finally:
+            with self._lock:
+                self._idle.append(service)
+
+
+@st.cache_resource(show_spinner=False)
+def get_drive_service_pool():
+    """プロセス全体で共有する Drive API サービスのプールを返す
+
+    サービスアカウントの読み込みは sheets_client と共通（失敗した場合は
+    例外になり、キャッシュされない）。
+    """
+    # [DRIVE] BACKEND = "fake" でオフライン用の代替を使う
+    drive_config = st.secrets.get("DRIVE", {})
+    if drive_config.get("BACKEND") == "fake":
+        from fake_drive import get_fake_drive_service
+        fake_service = get_fake_drive_service(
+            drive_config.get("FAKE_LATENCY_SECONDS", 0.0)
         )
-        return credentials
+        return DriveServicePool(lambda: fake_service)
+    credentials = load_service_account_credentials()
+    
+    def build_drive_service():
+        with span("drive.build"):
+            return build('drive', 'v3', credentials=credentials)
+    return DriveServicePool(build_drive_service)
+
+
+def get_drive_services():
+    """Drive API サービスのプール（認証できなければ None）"""
+    try:
+        return get_drive_service_pool()
     except Exception as e:
         st.error(f"Google認証エラー: {e}")
         return None
 
 
-def get_drive_service():
-    """Google Drive APIサービスを取得"""
-    credentials = authenticate_google_sheets()
-    if credentials:
-        return build('drive', 'v3', credentials=credentials)
-    return None
+def get_month_index():
+    """家計簿フォルダの一覧（プロセス内で共有し、一定時間ごとに取り直す）"""
+    config = load_config()
+    return get_drive_folder_index(config["target_folder"],
+                                  config["csv_pattern"],
+                                  tuple(config["csv_mime_types"]))
 
 
-def search_csv_file_in_drive(year_month, drive_service):
-    """Google Driveの指定フォルダからrecordyyyyMM.csvファイルを検索"""
-    config = load_config()
-    filename = config["csv_pattern"].format(year_month=year_month)
-    target_folder = config["target_folder"]
+def refresh_month_index(services):
+    """「ファイル一覧を更新」ボタンの処理"""
+    with services.service() as drive_service:
+        get_month_index().refresh(drive_service)
+
+
+@traced()
+def load_month_files(services):
+    """{年月: ファイル情報} を返す（フォルダが見つからなければ None）"""
+    target_folder = load_config()["target_folder"]
     
     try:
-        # 指定フォルダを検索
-        folder_query = (f"name='{target_folder}' and "
-                        f"mimeType='application/vnd.google-apps.folder'")
-        folder_results = drive_service.files().list(
-            q=folder_query,
-            pageSize=config["page_size"],
-            fields="nextPageToken, files(id, name)"
-        ).execute()
-        
-        folders = folder_results.get('files', [])
-        
-        if not folders:
-            st.error(f"「{target_folder}」フォルダが見つかりませんでした")
-            st.warning("以下を確認してください：")
-            st.write(f"1. Google Driveに「{target_folder}」という名前のフォルダが存在するか")
-            account_msg = ("2. サービスアカウント "
-                           "(kakei-seisan@expanded-flame-426112-n8.iam."
-                           "gserviceaccount.com) "
-                           "にフォルダの共有権限があるか")
-            st.write(account_msg)
-            return None
-        
-        folder_id = folders[0]['id']
-        
-        # フォルダ内でCSVファイルを検索
-        # まずmimeTypeを指定せずに名前のみで検索
-        query_name_only = f"name='{filename}' and '{folder_id}' in parents"
-        file_results_name = drive_service.files().list(
-            q=query_name_only,
-            pageSize=config["page_size"],
-            fields="nextPageToken, files(id, name, mimeType)"
-        ).execute()
-        
-        files_by_name = file_results_name.get('files', [])
-        
-        # CSVのmimeTypeで検索（設定から取得）
-        files = []
-        for mime_type in config["csv_mime_types"]:
-            query = (f"name='{filename}' and mimeType='{mime_type}' "
-                     f"and '{folder_id}' in parents")
-            file_results = drive_service.files().list(
-                q=query,
-                pageSize=config["page_size"],
-                fields="nextPageToken, files(id, name, mimeType)"
-            ).execute()
-            
-            found_files = file_results.get('files', [])
-            if found_files:
-                files.extend(found_files)
-        
-        # 名前が一致するファイルがあれば、mimeTypeに関係なく返す
-        if files_by_name:
-            return files_by_name[0]
-        elif files:
-            return files[0]  # 最初に見つかったファイルを返す
-        else:
-            return None
-            
+        with services.service() as drive_service:
+            month_files = get_month_index().files(drive_service)
     except Exception as e:
-        st.error(f"ファイル検索エラー: {e}")
-        st.error(f"エラー詳細: {str(e)}")
+        st.error(f"ファイル一覧の取得エラー: {e}")
         return None
+    
+    if month_files is None:
+        st.error(f"「{target_folder}」フォルダが見つかりませんでした")
+        st.warning("以下を確認してください：")
+        st.write(f"1. Google Driveに「{target_folder}」という名前のフォルダが存在するか")
+        account_msg = ("2. サービスアカウント "
+                       "(kakei-seisan@expanded-flame-426112-n8.iam."
+                       "gserviceaccount.com) "
+                       "にフォルダの共有権限があるか")
+        st.write(account_msg)
+    return month_files
+
+
+@st.cache_resource(show_spinner=False)
+def get_file_encodings():
+    """ファイル ID → 読み込めた文字コード（プロセス内のセッションで共有）"""
+    return {}
+
+
+def download_csv_bytes(file_id, drive_service):
+    """Google DriveからCSVファイルをダウンロードしてバイト列を返す"""
+    request = drive_service.files().get_media(fileId=file_id)
+    file_io = io.BytesIO()
+    downloader = MediaIoBaseDownload(file_io, request)
+    
+    done = False
+    while done is False:
+        status, done = scheduled(downloader.next_chunk, api="drive")
+    return file_io.getvalue()
+
 
+def fetch_csv_file(file_info, services, cache, encodings, file_encodings):
+    """CSVファイルを読み込んで (データフレーム, 欠損あり) を返す
 
-def download_csv_from_drive(file_id, drive_service):
-    """Google DriveからCSVファイルをダウンロード"""
+    ワーカースレッドから呼ぶため st.* は使わず、エラーは例外のまま返す。
+    ファイル ID と md5Checksum / modifiedTime が同じなら、前回読み込んだ
+    結果をディスクのキャッシュから読み、ダウンロードしない。
+    """
+    df = cache.get(file_info)
+    if df is not None:
+        return df, False
+    
+    file_id = file_info['id']
+    with span("drive.download"), services.service() as drive_service:
+        data = download_csv_bytes(file_id, drive_service)
+    # 先頭部分で文字コードを1つに決めて、CSV の読み込みは1回だけ行う
+    # （前回そのファイルで使えた文字コードを最初に試す）
+    with span("csv.parse"):
+        df, encoding, lossy = read_csv_bytes(data, encodings,
+                                             file_encodings.get(file_id))
+    if not lossy:
+        file_encodings[file_id] = encoding
+    cache.put(file_info, df)
+    return df, lossy
+
+
+def format_year_month(year_month):
+    """年月の文字列（"202401"）を表示用（"2024年1月"）にする"""
+    return f"{year_month[:4]}年{int(year_month[4:])}月"
+
+
+@traced()
+def load_months(year_months, month_files, services):
+    """年月ごとのデータ（MonthData）のリストを返す（読み込めた月だけ）
+
+    読み込み済みの月はメモリから返し、残りの月はスレッドプールで並列に
+    ダウンロード・読み込みする。表示（進捗・エラー）はこのスレッドで行う。
+    """
     config = load_config()
+    store = get_month_data_store()
+    months = {}
+    pending = []
+    for year_month in year_months:
+        file_info = month_files.get(year_month)
+        if not file_info:
+            filename = config["csv_pattern"].format(year_month=year_month)
+            st.error(f"ファイル '{filename}' が見つかりませんでした")
+            continue
+        month = store.get(year_month, file_info)
+        if month is not None:
+            months[year_month] = month
+        else:
+            pending.append((year_month, file_info))
     
-    try:
-        request = drive_service.files().get_media(fileId=file_id)
-        file_io = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_io, request)
-        
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
+    if pending:
+        cache = get_csv_cache()
+        file_encodings = get_file_encodings()
+        max_workers = st.secrets.get("DRIVE", {}).get("MAX_WORKERS",
+                                                      MAX_WORKERS)
         
-        file_io.seek(0)
+        def load(file_info):
+            return fetch_csv_file(file_info, services, cache,
+                                  config["encodings"], file_encodings)
         
-        # 設定から複数のエンコードを試す
-        encodings = config["encodings"]
-        
-        for encoding in encodings:
-            try:
-                file_io.seek(0)
-                df = pd.read_csv(file_io, encoding=encoding)
-                return df
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                st.warning(f"エンコード '{encoding}' でエラー: {e}")
+        file_infos = dict(pending)
+        progress = st.progress(
+            0.0, text=f"Google Driveからデータを読み込み中... (0/{len(pending)})"
+        )
+        results = load_in_parallel(pending, load, max_workers)
+        for done, (year_month, result, error) in enumerate(results, 1):
+            label = format_year_month(year_month)
+            progress.progress(
+                done / len(pending),
+                text=f"{label}を読み込みました ({done}/{len(pending)})",
+            )
+            if error is not None:
+                st.error(f"{label}のファイルの読み込みに失敗しました: {error}")
                 continue
-        
-        # すべてのエンコードで失敗した場合、エラーを無視して読み込み
-        try:
-            file_io.seek(0)
-            df = pd.read_csv(file_io, encoding='utf-8', errors='ignore')
-            st.warning("一部の文字が正しく読み込めない可能性があります")
-            return df
-        except Exception as e:
-            st.error(f"ファイルの読み込みに失敗しました: {e}")
-            return None
-        
-    except Exception as e:
-        st.error(f"ファイルダウンロードエラー: {e}")
-        return None
+            df, lossy = result
+            if lossy:
+                st.warning(f"{label}: 一部の文字が正しく読み込めない可能性があります")
+            months[year_month] = store.put(year_month, file_infos[year_month],
+                                           df)
+        progress.empty()
+    
+    return [months[year_month] for year_month in year_months
+            if year_month in months]
+
 
+@traced()
+def create_summary_table_and_chart(month, selected_column):
+    """選択された列でデータを集計し、表とグラフを作成（収入と支出を分けて集計）
 
-def create_summary_table_and_chart(df, selected_column):
-    """選択された列でデータを集計し、表とグラフを作成（収入と支出を分けて集計）"""
+    集計結果は month（MonthData）が列ごとに保持し、2回目からは計算しない。
+    """
+    df = month.frame
     if df is None or df.empty:
         st.warning("データがありません")
         return
@@ -194,16 +267,11 @@ def create_summary_table_and_chart(df, selected_column):
         return
     
     try:
-        # 収入と支出でデータを分ける
-        income_df = df[df['収入/支出'] == '収入']
-        expense_df = df[df['収入/支出'] == '支出']
+        # 収入と支出に分けて集計
+        income_summary, expense_summary = month.summary(selected_column)
         
         # 収入の集計
-        if not income_df.empty:
-            income_summary = (income_df.groupby(selected_column)['金額']
-                              .sum().reset_index())
-            income_summary = income_summary.sort_values('金額', ascending=False)
-            
+        if not income_summary.empty:
             st.subheader(f"収入 - {selected_column}別集計")
             col1, col2 = st.columns(2)
             
@@ -247,12 +315,7 @@ def create_summary_table_and_chart(df, selected_column):
         st.markdown("---")
         
         # 支出の集計
-        if not expense_df.empty:
-            expense_summary = (expense_df.groupby(selected_column)['金額']
-                               .sum().reset_index())
-            expense_summary = (expense_summary.sort_values('金額',
-                                                           ascending=False))
-            
+        if not expense_summary.empty:
             st.subheader(f"支出 - {selected_column}別集計")
             col1, col2 = st.columns(2)
             
@@ -300,9 +363,9 @@ def create_summary_table_and_chart(df, selected_column):
         col1, col2, col3, col4 = st.columns(4)
         
         total_income = (income_summary['金額'].sum() 
-                       if not income_df.empty else 0)
+                       if not income_summary.empty else 0)
         total_expense = (expense_summary['金額'].sum() 
-                        if not expense_df.empty else 0)
+                        if not expense_summary.empty else 0)
         net_amount = total_income - total_expense
         
         with col1:
@@ -324,6 +387,7 @@ def create_summary_table_and_chart(df, selected_column):
 
 
 def main():
+    begin_rerun("app_kakeibo")
     config = load_config()
     
     st.set_page_config(
@@ -337,78 +401,110 @@ def main():
     # サイドバーで年月選択
     st.sidebar.header("設定")
     
-    # 年の選択
-    current_year = datetime.now().year
-    years = list(range(current_year - 5, current_year + 2))
-    selected_year = st.sidebar.selectbox("年を選択", years, index=5)
+    # Drive のフォルダにある CSV の年月だけを選べるようにする
+    # Drive API サービスはプロセス内で共有し、再実行のたびには作らない
+    drive_services = get_drive_services()
+    month_files = (load_month_files(drive_services) if drive_services
+                   else None) or {}
+    available = list(month_files)
+    years = sorted({int(year_month[:4]) for year_month in available})
     
-    # 月の選択
-    months = list(range(1, 13))
-    selected_month = st.sidebar.selectbox(
-        "月を選択",
-        months,
-        format_func=lambda x: f"{x}月 ({calendar.month_name[x]})"
-    )
-    
-    # 年月を6桁の文字列に変換
-    year_month = f"{selected_year}{selected_month:02d}"
+    mode = st.sidebar.radio("期間", ["1か月", "1年", "期間を指定"],
+                            horizontal=True)
+    if mode == "期間を指定":
+        # 初期値は直近の12か月
+        start_month = st.sidebar.selectbox(
+            "開始月", available, index=max(len(available) - 12, 0),
+            format_func=format_year_month
+        )
+        end_month = st.sidebar.selectbox(
+            "終了月", available, index=max(len(available) - 1, 0),
+            format_func=format_year_month
+        )
+        selected = [year_month for year_month in available
+                    if start_month <= year_month <= end_month]
+    else:
+        # 年の選択（新しい年を初期値にする）
+        selected_year = st.sidebar.selectbox("年を選択", years,
+                                             index=max(len(years) - 1, 0))
+        year_months = [year_month for year_month in available
+                       if int(year_month[:4]) == selected_year]
+        if mode == "1年":
+            selected = year_months
+        else:
+            # 月の選択（その年で最も新しい月を初期値にする）
+            months = [int(year_month[4:]) for year_month in year_months]
+            selected_month = st.sidebar.selectbox(
+                "月を選択",
+                months,
+                index=max(len(months) - 1, 0),
+                format_func=lambda x: f"{x}月 ({calendar.month_name[x]})"
+            )
+            selected = ([f"{selected_year}{selected_month:02d}"]
+                        if selected_month is not None else [])
     
     # データ読み込みボタン
-    if st.sidebar.button("データを読み込む", type="primary"):
+    if st.sidebar.button("データを読み込む", type="primary",
+                         disabled=not selected):
         st.session_state.load_data = True
-        st.session_state.year_month = year_month
+        st.session_state.year_months = selected
+    
+    if drive_services:
+        if not month_files:
+            st.sidebar.info("読み込めるCSVファイルがありません")
+        st.sidebar.button("ファイル一覧を更新", on_click=refresh_month_index,
+                          args=(drive_services,))
     
     # メインエリア
     if hasattr(st.session_state, 'load_data') and st.session_state.load_data:
-        st.subheader(f"{selected_year}年{selected_month}月のデータ")
+        loaded = st.session_state.year_months
+        if len(loaded) == 1:
+            st.subheader(f"{format_year_month(loaded[0])}のデータ")
+        else:
+            st.subheader(f"{format_year_month(loaded[0])}〜"
+                         f"{format_year_month(loaded[-1])}のデータ"
+                         f"（{len(loaded)}か月）")
         
-        with st.spinner("Google Driveからデータを読み込み中..."):
-            drive_service = get_drive_service()
+        if drive_services:
+            # 読み込み済みの月はメモリから返す（ダウンロードしない）
+            months = load_months(loaded, month_files, drive_services)
+            month = None
+            if len(months) == 1 and len(loaded) == 1:
+                month = months[0]
+            elif months:
+                # 年月の列を付けて1つにまとめる（同じ組み合わせなら再利用）
+                month = get_month_data_store().combine(months)
             
-            if drive_service:
-                # CSVファイルを検索
-                file_info = search_csv_file_in_drive(
-                    st.session_state.year_month, drive_service
-                )
+            if month is not None:
+                df = month.frame
+                
+                # 列選択
+                st.markdown("---")
+                st.subheader("集計設定")
                 
-                if file_info:
-                    # CSVファイルをダウンロード
-                    df = download_csv_from_drive(
-                        file_info['id'], drive_service
+                # 利用可能な列を表示
+                available_columns = [
+                    col for col in df.columns if col != '金額'
+                ]
+                
+                if available_columns:
+                    selected_column = st.selectbox(
+                        "集計する列を選択してください",
+                        available_columns,
+                        help="選択した列の値ごとに金額を合計します"
                     )
                     
-                    if df is not None:
-                        st.session_state.df = df
-                        
-                        # 列選択
-                        st.markdown("---")
-                        st.subheader("集計設定")
-                        
-                        # 利用可能な列を表示
-                        available_columns = [
-                            col for col in df.columns if col != '金額'
-                        ]
-                        
-                        if available_columns:
-                            selected_column = st.selectbox(
-                                "集計する列を選択してください",
-                                available_columns,
-                                help="選択した列の値ごとに金額を合計します"
-                            )
-                            
-                            if st.button("集計実行", type="primary"):
-                                create_summary_table_and_chart(
-                                    df, selected_column
-                                )
-                        else:
-                            st.warning("集計可能な列がありません")
-                    
+                    if st.button("集計実行", type="primary"):
+                        create_summary_table_and_chart(
+                            month, selected_column
+                        )
                 else:
-                    filename = f"record{st.session_state.year_month}.csv"
-                    error_msg = f"ファイル '{filename}' が見つかりませんでした"
-                    st.error(error_msg)
-            else:
-                st.error("Google Drive APIに接続できませんでした")
+                    st.warning("集計可能な列がありません")
+        else:
+            st.error("Google Drive APIに接続できませんでした")
+
+    show_scheduler_metrics()
+    show_timing_panel()
 
 
 if __name__ == "__main__":
@@ -1,23 +1,47 @@
 import streamlit as st
-import pandas as pd
-import os
 
-# データ保存用ファイル名
-DATA_FILE = "household_data.csv"
-
-# 初期化：データファイルが存在しない場合は作成する
-if not os.path.exists(DATA_FILE):
-    pd.DataFrame(columns=["Person", "Date", "Amount"]).to_csv(DATA_FILE, index=False)
-
-
-# データ読み込み
+from balances import (
+    get_balance_ledger,
+    get_store_balance_ledger,
+    show_balance_check,
+)
+from local_storage import (
+    TABLE_BACKENDS,
+    TABLE_STORE_NAME,
+    get_expense_log,
+    get_parquet_store,
+    get_table_expense_store,
+    load_local_config,
+    load_participants,
+)
+
+# データ保存用ファイル名（1行1イベントの追記専用ログ）
+DATA_FILE = "household_data.jsonl"
+# 以前の保存形式。ログがまだなければ内容を取り込む
+LEGACY_CSV_FILE = "household_data.csv"
+# [LOCAL_STORAGE] BACKEND = "parquet" のときの保存先（月ごとの Parquet）
+PARQUET_DIR = "household_data"
+# 人ごとの合計（精算以降の分）の保存先
+BALANCE_FILE = "household_data.balance.json"
+
+local_config = load_local_config()
+backend = local_config.get("BACKEND", "log")
+use_parquet = backend == "parquet"
+if use_parquet:
+    expense_store = get_parquet_store(local_config.get("PATH", PARQUET_DIR))
+elif backend in TABLE_BACKENDS:
+    # 保存先は [STORAGE] DIR の下（app.py などと共通の保存先の実装）
+    expense_store = get_table_expense_store(backend)
+else:
+    expense_store = get_expense_log(DATA_FILE, legacy_csv=LEGACY_CSV_FILE)
+
+# 精算の参加者（app.py と同じ secrets.toml の設定）
+participants = load_participants()
+
+
+# データ読み込み（前回から増えた分だけを読む）
 def load_data():
-    return pd.read_csv(DATA_FILE)
-
-
-# データ保存
-def save_data(data):
-    data.to_csv(DATA_FILE, index=False)
+    return expense_store.frame()
 
 
 # アプリのタイトル
@@ -26,72 +50,52 @@ st.title("家計管理アプリ")
 # データの読み込み
 data = load_data()
 
-# 入力フォーム
+# 入力フォーム（2人ずつ横に並べる）
 st.header("支出の記録")
-col1, col2 = st.columns(2)
-
-with col1:
-    st.subheader("たく")
-    person_1_date = st.date_input("日付（たく）")
-    person_1_amount = st.number_input("金額（たく）", min_value=0, step=100)
-    if st.button("追加（たく）"):
-        new_row = {
-            "Person": "たく",
-            "Date": str(person_1_date),
-            "Amount": person_1_amount,
-        }
-        data = pd.concat([data, pd.DataFrame([new_row])], ignore_index=True)
-        save_data(data)
-        st.success("たく の支出が追加されました！")
-
-with col2:
-    st.subheader("めい")
-    person_2_date = st.date_input("日付（めい）")
-    person_2_amount = st.number_input("金額（めい）", min_value=0, step=100)
-    if st.button("追加（めい）"):
-        new_row = {
-            "Person": "めい",
-            "Date": str(person_2_date),
-            "Amount": person_2_amount,
-        }
-        data = pd.concat([data, pd.DataFrame([new_row])], ignore_index=True)
-        save_data(data)
-        st.success("めい の支出が追加されました！")
+for first in range(0, len(participants), 2):
+    columns = st.columns(2)
+    for column, name in zip(columns, participants[first:first + 2]):
+        with column:
+            st.subheader(name)
+            date = st.date_input(f"日付（{name}）")
+            amount = st.number_input(f"金額（{name}）", min_value=0, step=100)
+            if st.button(f"追加（{name}）"):
+                expense_store.add_expense(name, date, amount)
+                data = load_data()
+                st.success(f"{name} の支出が追加されました！")
 
 # 表の表示
 st.header("支出一覧")
 st.dataframe(data)
 
+# Parquet では精算済みの分も残っているので、これまでの合計を出せる
+if use_parquet:
+    with st.expander("これまでの合計"):
+        st.dataframe(expense_store.totals(), hide_index=True)
+
+# Personごとの合計金額（前回から増えた行だけを足す）
+# 表の保存先では合計も同じ保存先に、それ以外はデータのファイルの隣に保存する
+if backend in TABLE_BACKENDS:
+    ledger = get_store_balance_ledger(TABLE_STORE_NAME, backend,
+                                      expense_store.store)
+else:
+    ledger = get_balance_ledger(BALANCE_FILE)
+balance = ledger.sync(backend, data)
+transfers, _ = balance.settlement(participants)
+
 # 精算機能
 st.header("精算")
+for payer, payee, amount_to_pay in transfers:
+    st.caption(f"現在の精算額: {payer} → {payee} ¥{amount_to_pay:.0f}")
+show_balance_check(ledger, backend, data)
 if st.button("精算する"):
-    # Personごとの合計金額を計算
-    total_person_1 = data[data["Person"] == "たく"]["Amount"].sum()
-    total_person_2 = data[data["Person"] == "めい"]["Amount"].sum()
-
-    # 精算計算
-    total_spent = total_person_1 + total_person_2
-    equal_share = total_spent / 2
-    difference = total_person_1 - total_person_2
-
-    if difference > 0:
-        payer = "めい"
-        payee = "たく"
-        amount_to_pay = abs(difference) / 2
-    elif difference < 0:
-        payer = "たく"
-        payee = "めい"
-        amount_to_pay = abs(difference) / 2
-    else:
-        payer, payee, amount_to_pay = None, None, None
-
-    # 結果表示
-    if payer and payee:
+    # 結果表示（精算額は表示中の支出一覧と照合済みの合計から求めてある）
+    for payer, payee, amount_to_pay in transfers:
         st.write(f"{payer} が {payee} に ¥{amount_to_pay:.0f} 支払う必要があります。")
-    else:
+    if not transfers:
         st.write("精算する必要はありません。")
 
-    # データクリア
-    data = pd.DataFrame(columns=["Person", "Date", "Amount"])
-    save_data(data)
+    # データクリア（精算の区切りを記録する）
+    expense_store.settle()
+    data = load_data()
     st.success("精算が完了しました！表の内容はクリアされました。")
@@ -0,0 +1,111 @@
+"""PIN コードによるログインとセッションタイムアウト（app.py / app_assets.py で共有）
+
+secrets.toml の [AUTH] PIN_CODE と SESSION_TIMEOUT_MINUTES（既定 30 分）を使う。
+"""
+# import hashlib
+import time
+
+import streamlit as st
+
+# 認証設定
+AUTH_CONFIG = st.secrets["AUTH"]
+PIN_CODE = AUTH_CONFIG["PIN_CODE"]
+SESSION_TIMEOUT_MINUTES = AUTH_CONFIG.get("SESSION_TIMEOUT_MINUTES", 30)
+
+
+# 認証関数
+def check_authentication():
+    """認証チェック関数"""
+    # セッション状態の初期化
+    if "authenticated" not in st.session_state:
+        st.session_state.authenticated = False
+        st.session_state.auth_time = None
+    
+    # セッションタイムアウトチェック
+    if st.session_state.authenticated and st.session_state.auth_time:
+        elapsed_minutes = (time.time() - st.session_state.auth_time) / 60
+        if elapsed_minutes > SESSION_TIMEOUT_MINUTES:
+            st.session_state.authenticated = False
+            st.session_state.auth_time = None
+            st.warning(f"セッションがタイムアウトしました（{SESSION_TIMEOUT_MINUTES}分）")
+    
+    return st.session_state.authenticated
+
+
+def show_login_form():
+    """ログイン画面表示"""
+    st.title("資産管理アプリ")
+    st.markdown("---")
+    
+    # PINコード認証のみ
+    st.subheader("PINを入力")
+    pin_input = st.text_input(
+        "暗証番号",
+        type="password",
+        placeholder="PINを入力"
+    )
+    
+    if st.button("ログイン", type="primary"):
+        if pin_input == PIN_CODE:
+            st.session_state.authenticated = True
+            st.session_state.auth_time = time.time()
+            st.success("認証成功！")
+            st.rerun()
+        else:
+            st.error("暗証番号が間違っています")
+    
+    # パスフレーズ認証（参考用にコメントアウト）
+    # # 認証方法選択
+    # auth_method = st.radio(
+    #     "認証方法を選択してください：",
+    #     ["4桁暗証番号", "パスフレーズ（推奨）"],
+    #     help="パスフレーズの方がより安全です"
+    # )
+    # 
+    # if auth_method == "4桁暗証番号":
+    #     st.subheader("4桁暗証番号を入力")
+    #     pin_input = st.text_input(
+    #         "暗証番号",
+    #         type="password",
+    #         max_chars=4,
+    #         placeholder="4桁の数字を入力"
+    #     )
+    #     
+    #     if st.button("ログイン", type="primary"):
+    #         if pin_input == PIN_CODE:
+    #             st.session_state.authenticated = True
+    #             st.session_state.auth_time = time.time()
+    #             st.success("認証成功！")
+    #             st.rerun()
+    #         else:
+    #             st.error("暗証番号が間違っています")
+    #             
+    # else:  # パスフレーズ
+    #     st.subheader("パスフレーズを入力")
+    #     st.info("💡 パスフレーズは文字数が多く、より安全です")
+    #     
+    #     passphrase_input = st.text_input(
+    #         "パスフレーズ",
+    #         type="password",
+    #         placeholder="設定したパスフレーズを入力"
+    #     )
+    #     
+    #     if st.button("ログイン", type="primary"):
+    #         # パスフレーズをハッシュ化して比較
+    #         input_hash = hashlib.sha256(passphrase_input.encode()).hexdigest()
+    #         stored_hash = AUTH_CONFIG.get("PASSPHRASE_HASH", "")
+    #         
+    #         if input_hash == stored_hash:
+    #             st.session_state.authenticated = True
+    #             st.session_state.auth_time = time.time()
+    #             st.success("認証成功！")
+    #             st.rerun()
+    #         else:
+    #             st.error("パスフレーズが間違っています")
+
+
+def require_login():
+    """未認証ならログイン画面を表示してスクリプトを止める"""
+    if not check_authentication():
+        show_login_form()
+        st.stop()
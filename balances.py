@@ -0,0 +1,359 @@
+"""支出一覧の人ごとの合計・分類ごとの小計を追加のたびに更新して保持する
+
+精算のたびに支出一覧全体を集計し直さないよう、集計済みの行数と合計を
+一覧と同じ保存先の表（app_local_save.py のログ・Parquet では JSON
+ファイル）に保存しておき、一覧が増えていれば増えた行だけを足す。
+集計済みの行数と、その行すべてのハッシュ値の和（順序によらない指紋）も
+一緒に保存し、一覧の先頭の行がこれと合わない場合（途中の行が書き換え
+られた・精算でクリアされた後に追加されたなど）は最初から集計し直す。
+同じデータフレームのままの再実行では何も読み直さない。
+保存した合計は全体の集計し直しと突き合わせて検算できる。
+精算額は参加者全員で等分した場合の差額（円単位）から、少ない回数の送金に
+まとめて求める。
+"""
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from table_store import STORAGE_ERRORS
+
+
+# これより小さい差額（円単位でない合計を渡した場合の誤差）は精算済みとみなす
+TOLERANCE = 1e-6
+# 合計を保存する表の名前と、Sheets でのワークシート名
+BALANCE_TABLE = "balance"
+BALANCE_SHEET = "精算用の合計"
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _amounts(frame, amount_column):
+    amounts = frame[amount_column]
+    if not pd.api.types.is_numeric_dtype(amounts):
+        amounts = pd.to_numeric(amounts, errors="coerce")
+    # 読み込み時の Int32 のままでは合計があふれるため float にする
+    return pd.Series(amounts.to_numpy(dtype=float, na_value=0.0),
+                     index=amounts.index)
+
+
+def person_totals(frame, person_column="Person", amount_column="Amount"):
+    """人ごとの支出の合計（全行を1回たどって集計する）"""
+    amounts = _amounts(frame, amount_column)
+    persons = frame[person_column]
+    if not isinstance(persons.dtype, pd.CategoricalDtype):
+        return amounts.groupby(persons).sum()
+    # 読み込み時の category 型なら、分類のコードごとに足すだけで済む
+    codes = persons.cat.codes.to_numpy()
+    values = amounts.to_numpy()
+    known = codes >= 0
+    if not known.all():
+        codes, values = codes[known], values[known]
+    size = len(persons.cat.categories)
+    sums = np.bincount(codes, weights=values, minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    return pd.Series(sums, index=persons.cat.categories)[counts > 0]
+
+
+def settlement_balances(totals, participants):
+    """参加者全員で等分した場合の円単位の差額（正なら受け取る・負なら支払う）
+
+    totals は人ごとの合計。参加者以外の人の支出があればその人も等分に加える。
+    等分で割り切れない端数は支払いの最も多い人（同じなら先の人）が
+    まとめて負担し、差額の合計はちょうど 0 になる。
+    """
+    names = list(participants)
+    names += [name for name in totals.keys() if name not in names]
+    paid = pd.Series([round(float(totals.get(name, 0))) for name in names],
+                     index=names, dtype="int64")
+    if paid.empty:
+        return paid
+    share, remainder = divmod(int(paid.sum()), len(paid))
+    balances = paid - share
+    if remainder:
+        balances[balances.idxmin()] -= remainder
+    return balances
+
+
+def _hash_sum(hashes):
+    # uint64 の和はあふれた分が切り捨てられ、2**64 を法とした和になる
+    return int(hashes.sum(dtype=np.uint64))
+
+
+def minimal_transfers(balances):
+    """差額を精算する送金の一覧 [(支払う人, 受け取る人, 金額), ...]
+
+    支払いの多い人と受け取りの多い人から順に組み合わせる（貪欲法）。
+    送金は最大でも (人数 - 1) 回で、2人なら1回になる。
+    """
+    creditors = sorted(((amount, name) for name, amount in balances.items()
+                        if amount > TOLERANCE), reverse=True)
+    debtors = sorted(((-amount, name) for name, amount in balances.items()
+                      if amount < -TOLERANCE), reverse=True)
+    transfers = []
+    i = j = 0
+    while i < len(debtors) and j < len(creditors):
+        debt, payer = debtors[i]
+        credit, payee = creditors[j]
+        amount = min(debt, credit)
+        transfers.append((payer, payee, _number(amount)))
+        debtors[i] = (debt - amount, payer)
+        creditors[j] = (credit - amount, payee)
+        if debt - amount <= TOLERANCE:
+            i += 1
+        if credit - amount <= TOLERANCE:
+            j += 1
+    return transfers
+
+
+class RunningBalance:
+    """人ごとの合計と (人, 分類) ごとの小計
+
+    rows は集計済みの行数（一覧の先頭からの行数）、fingerprint は集計済みの
+    行のハッシュ値の和（一覧が書き換えられていないかの確認用）。
+    """
+
+    def __init__(self, person_column="Person", amount_column="Amount",
+                 category_column=None):
+        self.person_column = person_column
+        self.amount_column = amount_column
+        self.category_column = category_column
+        self.rows = 0
+        self.fingerprint = 0
+        self.totals = {}
+        self.subtotals = {}
+
+    def row_hashes(self, frame):
+        """行ごとのハッシュ値（人・金額・分類の列から求める）"""
+        columns = {"person": frame[self.person_column].astype(str),
+                   "amount": _amounts(frame, self.amount_column)}
+        if self.category_column and self.category_column in frame:
+            columns["category"] = frame[self.category_column].astype(str)
+        return pd.util.hash_pandas_object(pd.DataFrame(columns),
+                                          index=False).to_numpy()
+
+    def matches(self, hashes):
+        """先頭 rows 行のハッシュ値が集計済みの一覧と同じか
+
+        hashes は row_hashes の値。和は 2**64 を法とした和（途中の行が
+        1つでも変われば、ほぼ確実に変わる）。
+        """
+        if len(hashes) < self.rows:
+            return False
+        return _hash_sum(hashes[:self.rows]) == self.fingerprint
+
+    def add_frame(self, frame, start=0, hashes=None):
+        """frame の start 行目以降を合計に足す"""
+        if hashes is None:
+            hashes = self.row_hashes(frame)
+        new = frame.iloc[start:]
+        if not new.empty:
+            totals = person_totals(new, self.person_column,
+                                   self.amount_column)
+            for person, amount in totals.items():
+                self.totals[str(person)] = _number(
+                    self.totals.get(str(person), 0) + amount)
+            if self.category_column and self.category_column in new:
+                amounts = _amounts(new, self.amount_column)
+                grouped = amounts.groupby(
+                    [new[self.person_column], new[self.category_column]],
+                    observed=True,
+                ).sum()
+                for (person, category), amount in grouped.items():
+                    subtotals = self.subtotals.setdefault(str(person), {})
+                    subtotals[str(category)] = _number(
+                        subtotals.get(str(category), 0) + amount)
+        self.rows = len(frame)
+        self.fingerprint = (self.fingerprint
+                            + _hash_sum(hashes[start:])) % 2**64
+
+    def recompute(self, frame, hashes=None):
+        """frame 全体から集計し直す"""
+        self.rows = 0
+        self.fingerprint = 0
+        self.totals = {}
+        self.subtotals = {}
+        self.add_frame(frame, hashes=hashes)
+
+    def total(self, person):
+        return self.totals.get(person, 0)
+
+    def settlement(self, participants):
+        """参加者で等分する場合の (送金の一覧, 総支出)"""
+        balances = settlement_balances(self.totals, participants)
+        return minimal_transfers(balances), _number(sum(self.totals.values()))
+
+    def subtotal_frame(self):
+        """人ごと・分類ごとの小計の表"""
+        return pd.DataFrame(self.subtotals).fillna(0).astype(float)
+
+    def to_dict(self):
+        return {"rows": self.rows, "fingerprint": self.fingerprint,
+                "totals": self.totals, "subtotals": self.subtotals}
+
+    def load_dict(self, data):
+        self.rows = data.get("rows", 0)
+        # 指紋のない以前の保存形式は、一覧と合わないものとして集計し直す
+        self.fingerprint = data.get("fingerprint", 0 if not self.rows
+                                    else None)
+        self.totals = dict(data.get("totals", {}))
+        self.subtotals = {person: dict(values) for person, values
+                          in data.get("subtotals", {}).items()}
+
+    def differences(self, other):
+        """合計・小計が食い違う人の一覧"""
+        persons = set(self.totals) | set(other.totals)
+        return sorted(
+            person for person in persons
+            if self.total(person) != other.total(person)
+            or self.subtotals.get(person, {}) != other.subtotals.get(person, {})
+        )
+
+
+class BalanceLedger:
+    """表ごとの RunningBalance を1つの JSON ファイルに保存する
+
+    集計したデータフレームを覚えておき、同じデータフレームのままなら
+    ハッシュ値も求めずにそのまま返す。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._balances = {}
+        # 表の名前 -> 最後に集計したデータフレーム
+        self._frames = {}
+        self._saved = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._saved, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def _balance(self, key, **columns):
+        balance = self._balances.get(key)
+        if balance is None:
+            balance = self._balances[key] = RunningBalance(**columns)
+            if key in self._saved:
+                balance.load_dict(self._saved[key])
+        return balance
+
+    def _store(self, key, balance, frame):
+        self._frames[key] = frame
+        self._saved[key] = balance.to_dict()
+        self._save()
+
+    def sync(self, key, frame, **columns):
+        """frame に合わせて合計を更新して返す（増えた行だけを集計する）
+
+        columns は RunningBalance の列名の指定（person_column など）。
+        """
+        with self._lock:
+            balance = self._balance(key, **columns)
+            if self._frames.get(key) is frame:
+                return balance
+            hashes = balance.row_hashes(frame)
+            if not balance.matches(hashes):
+                balance.recompute(frame, hashes)
+            elif len(frame) > balance.rows:
+                balance.add_frame(frame, start=balance.rows, hashes=hashes)
+            else:
+                self._frames[key] = frame
+                return balance
+            self._store(key, balance, frame)
+            return balance
+
+    def verify(self, key, frame, **columns):
+        """全体を集計し直して保存済みの合計と突き合わせる
+
+        食い違う人の一覧を返し、保存済みの合計は集計し直した値に置き換える。
+        """
+        expected = RunningBalance(**columns)
+        expected.recompute(frame)
+        with self._lock:
+            balance = self._balance(key, **columns)
+            differences = balance.differences(expected)
+            if differences or balance.to_dict() != expected.to_dict():
+                balance.load_dict(expected.to_dict())
+                self._store(key, balance, frame)
+            return differences
+
+
+class StoreBalanceLedger(BalanceLedger):
+    """表ごとの RunningBalance を保存先（TableStore）の表に保存する
+
+    合計は支出一覧と同じ保存先に置くため、再起動した後や別のプロセス・
+    ホストからも同じ値を使える（読み込むのは作成時の1回だけで、一覧と
+    合わなければ集計し直す）。表は1行に1つの合計で、列は HEADER。
+    """
+
+    HEADER = ["表", "集計"]
+
+    def __init__(self, store, table=BALANCE_TABLE):
+        self.store = store
+        self.table = table
+        super().__init__(None)
+
+    def _load(self):
+        try:
+            rows = self.store.read_values([self.table])[self.table]
+        except STORAGE_ERRORS:
+            return {}
+        saved = {}
+        for row in rows[1:]:
+            try:
+                saved[row[0]] = json.loads(row[1])
+            except (IndexError, ValueError):
+                continue
+        return saved
+
+    def _save(self):
+        rows = [[key, json.dumps(data, ensure_ascii=False)]
+                for key, data in sorted(self._saved.items())]
+        try:
+            self.store.replace(self.table, [self.HEADER] + rows)
+        except STORAGE_ERRORS:
+            # 保存できなくても、次に読み込んだときに一覧と照合して集計し直す
+            pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_balance_ledger(path):
+    """プロセス内のセッションで共有する合計の保存先を返す"""
+    return BalanceLedger(path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_store_balance_ledger(spreadsheet_name, backend, _store,
+                             table=BALANCE_TABLE):
+    """保存先（spreadsheet_name と backend の組）ごとに共有する合計を返す"""
+    return StoreBalanceLedger(_store, table)
+
+
+def show_balance_check(ledger, key, frame, **columns):
+    """合計を全体の集計し直しと突き合わせるボタンを表示する"""
+    if st.button("合計を検算する", key=f"verify_balance_{key}"):
+        differences = ledger.verify(key, frame, **columns)
+        if differences:
+            st.warning(
+                f"合計が一致しなかったため集計し直しました: {', '.join(differences)}"
+            )
+        else:
+            st.success("合計は全体の集計と一致しています。")
@@ -0,0 +1,237 @@
+"""アプリの再実行ベンチマーク（テストではなく計測用のスクリプト）
+
+Google には接続せず、fake_sheets / fake_drive のメモリ上の代替に行数を
+変えたデータを投入して、app.py / app_assets.py / app_kakeibo.py を
+Streamlit の AppTest で実行する。操作（ステップ）ごとに再実行の所要時間・
+API 呼び出し回数・ピークメモリ（tracemalloc）を表示する。
+
+    python benchmarks/bench_apps.py
+    python benchmarks/bench_apps.py --rows 100 10000 --apps app --latency 0.05
+    python benchmarks/bench_apps.py --json results.json
+
+ピークメモリの計測中は処理が遅くなるため、所要時間だけを比べたいときは
+--no-memory を付ける。
+"""
+import argparse
+import datetime
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_drive import get_fake_drive_service  # noqa: E402
+from fake_sheets import get_fake_client  # noqa: E402
+
+DEFAULT_ROWS = [100, 10_000, 100_000]
+APPS = ["app", "app_assets", "app_kakeibo"]
+NAMES = ["A", "B"]
+ASSET_CATEGORIES = {
+    "ITEM_A": "投資信託",
+    "ITEM_B": "個別株",
+    "ITEM_C": "米国株",
+    "ITEM_D": "普通預金",
+    "ITEM_E": "定期預金",
+    "ITEM_F": "現金",
+}
+KAKEIBO_FOLDER = "家計簿"
+
+
+def make_secrets(latency):
+    # レート制限で待たされると計測にならないため、上限は十分に大きくする
+    unlimited = {"REQUESTS_PER_MINUTE": 10**9, "BURST": 10**9}
+    return {
+        "AUTH": {"PIN_CODE": "0000"},
+        "NAME1": NAMES[0],
+        "NAME2": NAMES[1],
+        "ASSET_CATEGORIES": ASSET_CATEGORIES,
+        "SHEETS": {"BACKEND": "fake", "FAKE_LATENCY_SECONDS": latency},
+        "DRIVE": {"BACKEND": "fake", "FAKE_LATENCY_SECONDS": latency,
+                  "CSV_CACHE_DIR": tempfile.mkdtemp(prefix="bench_kakeibo_")},
+        "SCHEDULER": {"SHEETS": unlimited, "DRIVE": unlimited},
+        # ポケモン画像は取得できないアドレスにして、通信を発生させない
+        "POKEMON": {"BASE_URL": "http://127.0.0.1:9",
+                    "CACHE_DIR": tempfile.mkdtemp(prefix="bench_pokemon_")},
+    }
+
+
+def dates(count):
+    end = datetime.date.today()
+    return [str(d.date()) for d in
+            pd.date_range(end=end, periods=count, freq="D")]
+
+
+# ---- データの投入 ----
+
+def seed_app(rows, latency):
+    rng = random.Random(0)
+    expense = [["Person", "Date", "Amount", "Content", "Place"]]
+    for day in dates(rows):
+        expense.append([rng.choice(NAMES), day, rng.randrange(100, 10000, 100),
+                        rng.choice(["食費", "その他"]), "店"])
+    history = [["精算日", "支払者", "金額", "総支出"]]
+    for day in dates(max(1, rows // 30)):
+        history.append([f"{day} 12:00:00", rng.choice(NAMES),
+                        rng.randrange(0, 50000), rng.randrange(0, 100000)])
+    get_fake_client(latency).add_spreadsheet("kakei_seisan", {
+        "Sheet1": expense,
+        "Sheet2": history,
+        "支出履歴": expense,
+    })
+
+
+def seed_app_assets(rows, latency):
+    rng = random.Random(0)
+    items = list(ASSET_CATEGORIES.values())
+    values = [["日付", *items, "合計", "増減"]]
+    previous = None
+    for day in dates(rows):
+        amounts = [rng.randrange(0, 1_000_000, 100) for _ in items]
+        total = sum(amounts)
+        values.append([day, *amounts, total,
+                       0 if previous is None else total - previous])
+        previous = total
+    get_fake_client(latency).add_spreadsheet("assets", {"Sheet1": values})
+
+
+def kakeibo_year_month():
+    # app_kakeibo.py の年月の初期値（今年の1月）
+    return f"{datetime.date.today().year}01"
+
+
+def seed_app_kakeibo(rows, latency):
+    rng = random.Random(0)
+    start = datetime.date.today().replace(month=1, day=1)
+    categories = {"収入": ["給与", "賞与", "その他"],
+                  "支出": ["食費", "日用品", "交通費", "住居", "趣味"]}
+    records = []
+    for i in range(rows):
+        kind = "収入" if rng.random() < 0.1 else "支出"
+        records.append({
+            "日付": str(start + datetime.timedelta(days=i % 31)),
+            "収入/支出": kind,
+            "大項目": rng.choice(categories[kind]),
+            "金額": rng.randrange(100, 50000, 10),
+            "メモ": f"メモ{i}",
+        })
+    content = pd.DataFrame(records).to_csv(index=False).encode("cp932")
+    drive = get_fake_drive_service(latency)
+    folder_id = drive.add_folder(KAKEIBO_FOLDER)
+    drive.add_file(f"record{kakeibo_year_month()}.csv", content, folder_id)
+
+
+# ---- 操作 ----
+
+def rerun(at):
+    # 操作なしでそのまま再実行する
+    return None
+
+
+def add_expense(at):
+    at.number_input[0].set_value(500)
+    next(b for b in at.button if b.label.startswith("追加")).click()
+
+
+def load_month(at):
+    at.sidebar.button[0].click()
+
+
+def aggregate(at):
+    next(s for s in at.selectbox
+         if s.label == "集計する列を選択してください").set_value("大項目")
+    next(b for b in at.button if b.label == "集計実行").click()
+
+
+SCENARIOS = {
+    "app": (seed_app, [("cold", rerun), ("warm", rerun),
+                       ("add_expense", add_expense)]),
+    "app_assets": (seed_app_assets, [("cold", rerun), ("warm", rerun)]),
+    "app_kakeibo": (seed_app_kakeibo, [("cold", rerun),
+                                       ("load_month", load_month),
+                                       ("aggregate", aggregate)]),
+}
+
+
+def api_calls(latency):
+    return (get_fake_client(latency).total_calls()
+            + get_fake_drive_service(latency).total_calls())
+
+
+def run_scenario(app, rows, latency, secrets, timeout, memory):
+    # キャッシュ・接続をすべて捨てて、起動直後と同じ状態から始める
+    st.cache_resource.clear()
+    seed, steps = SCENARIOS[app]
+    seed(rows, latency)
+
+    at = AppTest.from_file(os.path.join(ROOT, f"{app}.py"),
+                           default_timeout=timeout)
+    for key, value in secrets.items():
+        at.secrets[key] = value
+    at.session_state["authenticated"] = True
+    at.session_state["auth_time"] = time.time()
+
+    results = []
+    for step, action in steps:
+        gc.collect()
+        if memory:
+            tracemalloc.reset_peak()
+        calls = api_calls(latency)
+        action(at)
+        started = time.perf_counter()
+        at.run()
+        wall = time.perf_counter() - started
+        results.append({
+            "app": app,
+            "rows": rows,
+            "step": step,
+            "wall_ms": round(wall * 1000, 1),
+            "api_calls": api_calls(latency) - calls,
+            "peak_mb": (round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+                        if memory else None),
+            "error": str(at.exception[0].message) if at.exception else "",
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="API 呼び出し1回ごとの遅延（秒）")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="1回の再実行の制限時間（秒）")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="ピークメモリを計測しない")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    memory = not args.no_memory
+    if memory:
+        tracemalloc.start()
+    secrets = make_secrets(args.latency)
+    results = []
+    for app in args.apps:
+        for rows in args.rows:
+            print(f"{app}: {rows} 行 ...", file=sys.stderr)
+            results.extend(run_scenario(app, rows, args.latency, secrets,
+                                        args.timeout, memory))
+
+    frame = pd.DataFrame(results)
+    print(frame.to_string(index=False))
+    if args.json:
+        frame.to_json(args.json, orient="records", force_ascii=False,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""CSV の文字コード判定のベンチマーク（テストではなく計測用のスクリプト）
+
+家計簿アプリの書き出しと同じ形式の CP932 の CSV を行数を変えて作り、
+以前の読み込み（文字コードの候補ごとに CSV 全体の読み込みを試す）と
+csv_encoding.read_csv_bytes（先頭部分で判定して1回だけ読み込む）の
+所要時間と読み込み回数を比べる。remembered は前回使えた文字コードを
+渡した場合（アプリでは2回目以降に同じファイルを読むとき）の時間。
+
+    python benchmarks/bench_encoding.py
+    python benchmarks/bench_encoding.py --rows 100000 1000000 --json results.json
+
+CP932 にしかない文字（①・髙 など）がファイルのどこにあるかで、以前の
+読み込みで shift_jis が失敗するまでの時間が変わる。--position で
+"head"（先頭付近）/ "tail"（末尾付近）/ "none"（含めない）を選べる。
+"""
+import argparse
+import datetime
+import gc
+import io
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from csv_encoding import DEFAULT_ENCODINGS, read_csv_bytes  # noqa: E402
+
+DEFAULT_ROWS = [10_000, 100_000, 500_000]
+POSITIONS = ["head", "tail", "none"]
+REPEAT = 5
+
+
+def kakeibo_csv(rows, position):
+    """CP932 で書き出した家計簿の CSV のバイト列"""
+    rng = random.Random(0)
+    start = datetime.date(2024, 1, 1)
+    categories = {"収入": ["給与", "賞与", "その他"],
+                  "支出": ["食費", "日用品", "交通費", "住居", "趣味"]}
+    records = []
+    for i in range(rows):
+        kind = "収入" if rng.random() < 0.1 else "支出"
+        records.append({
+            "日付": str(start + datetime.timedelta(days=i % 31)),
+            "収入/支出": kind,
+            "大項目": rng.choice(categories[kind]),
+            "金額": rng.randrange(100, 50000, 10),
+            "メモ": f"メモ{i}",
+        })
+    # CP932 にしかない文字（Shift_JIS としては読めない）を1行だけ含める
+    if position != "none":
+        index = 0 if position == "head" else rows - 1
+        records[index]["メモ"] = "髙島屋①"
+    return pd.DataFrame(records).to_csv(index=False).encode("cp932")
+
+
+def previous_read(data, encodings=DEFAULT_ENCODINGS):
+    """以前の download_csv_from_drive と同じく候補ごとに全体を読み込む"""
+    attempts = 0
+    for encoding in encodings:
+        attempts += 1
+        try:
+            return pd.read_csv(io.BytesIO(data), encoding=encoding), attempts
+        except UnicodeDecodeError:
+            continue
+    raise ValueError("どの文字コードでも読み込めません")
+
+
+def detected_read(data, preferred=None):
+    frame, encoding, lossy = read_csv_bytes(data, preferred=preferred)
+    assert not lossy, encoding
+    return frame, encoding
+
+
+def timed(func, data):
+    """REPEAT 回実行して最短の時間（ミリ秒）と最後の結果を返す"""
+    best = None
+    for _ in range(REPEAT):
+        gc.collect()
+        started = time.perf_counter()
+        result = func(data)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--position", nargs="+", choices=POSITIONS,
+                        default=POSITIONS)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    results = []
+    for position in args.position:
+        for rows in args.rows:
+            print(f"{position}: {rows} 行 ...", file=sys.stderr)
+            data = kakeibo_csv(rows, position)
+            previous_ms, (previous, attempts) = timed(previous_read, data)
+            detected_ms, (detected, encoding) = timed(detected_read, data)
+            remembered_ms, _ = timed(
+                lambda data: detected_read(data, encoding), data
+            )
+            assert previous.equals(detected)
+            results.append({
+                "position": position,
+                "rows": rows,
+                "mb": round(len(data) / 2**20, 1),
+                "previous_ms": round(previous_ms, 1),
+                "previous_parses": attempts,
+                "encoding": encoding,
+                "detected_ms": round(detected_ms, 1),
+                "remembered_ms": round(remembered_ms, 1),
+                "speedup": round(previous_ms / detected_ms, 2),
+            })
+
+    frame = pd.DataFrame(results)
+    print(frame.to_string(index=False))
+    if args.json:
+        frame.to_json(args.json, orient="records", force_ascii=False,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""家計簿の複数月の読み込みのベンチマーク（テストではなく計測用のスクリプト）
+
+fake_drive のメモリ上の Drive の代替（1回の API 呼び出しに --latency 秒
+かかる）に月ごとの CSV を置き、app_kakeibo.py と同じ読み込み
+（fetch_csv_file: ダウンロード → 文字コード判定 → 読み込み）を
+kakeibo_data.load_in_parallel でまとめて行う。同時に読み込む数
+（--workers）ごとの所要時間を、1か月ずつ読んだときの最も遅い月・合計と
+比べる。ディスクのキャッシュは毎回空にする（ダウンロードする場合の時間）。
+
+    python benchmarks/bench_kakeibo_range.py
+    python benchmarks/bench_kakeibo_range.py --months 24 --rows 50000 --latency 0.5
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import streamlit as st
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app_kakeibo import fetch_csv_file  # noqa: E402
+from bench_encoding import kakeibo_csv  # noqa: E402
+from csv_cache import CsvFrameCache  # noqa: E402
+from csv_encoding import DEFAULT_ENCODINGS  # noqa: E402
+from drive_index import DriveFolderIndex  # noqa: E402
+from fake_drive import FakeDriveService  # noqa: E402
+from kakeibo_data import load_in_parallel  # noqa: E402
+
+DEFAULT_WORKERS = [1, 4, 12]
+CSV_PATTERN = "record{year_month}.csv"
+
+
+def use_unlimited_scheduler():
+    # API のレート制限で待たないよう、一時的な secrets.toml を使う
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_range_"),
+                        "secrets.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[SCHEDULER.DRIVE]\n"
+                "REQUESTS_PER_MINUTE = 1000000000\n"
+                "BURST = 1000000000\n")
+    st.config.set_option("secrets.files", [path])
+
+
+def seed(drive, months, rows):
+    folder_id = drive.add_folder("家計簿")
+    content = kakeibo_csv(rows, "none")
+    year_months = []
+    for i in range(months):
+        year_month = f"{2024 + i // 12}{i % 12 + 1:02d}"
+        drive.add_file(CSV_PATTERN.format(year_month=year_month), content,
+                       folder_id)
+        year_months.append(year_month)
+    index = DriveFolderIndex("家計簿", CSV_PATTERN)
+    files = index.files(drive)
+    return [(year_month, files[year_month]) for year_month in year_months]
+
+
+def timed_load(drive, items, workers):
+    """ディスクのキャッシュが空の状態で items をまとめて読み込む秒数"""
+    cache_dir = tempfile.mkdtemp(prefix="bench_range_cache_")
+    try:
+        cache = CsvFrameCache(cache_dir)
+
+        def load(file_info):
+            return fetch_csv_file(file_info, lambda: drive, cache,
+                                  DEFAULT_ENCODINGS, {})
+
+        started = time.perf_counter()
+        for _, _, error in load_in_parallel(items, load, workers):
+            if error is not None:
+                raise error
+        return time.perf_counter() - started
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--rows", type=int, default=10_000,
+                        help="1か月あたりの行数")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="API 呼び出し1回の待ち時間（秒）")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=DEFAULT_WORKERS)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    use_unlimited_scheduler()
+    drive = FakeDriveService(latency=args.latency)
+    items = seed(drive, args.months, args.rows)
+
+    single = [timed_load(drive, [item], 1) for item in items]
+    slowest = max(single)
+    print(f"1か月ずつ: 最も遅い月 {slowest:.2f}秒 / 合計 {sum(single):.2f}秒",
+          file=sys.stderr)
+
+    results = []
+    for workers in args.workers:
+        elapsed = timed_load(drive, items, workers)
+        results.append({
+            "months": args.months,
+            "rows": args.rows,
+            "latency": args.latency,
+            "workers": workers,
+            "total_s": round(elapsed, 2),
+            "slowest_month_s": round(slowest, 2),
+            "sum_of_months_s": round(sum(single), 2),
+            "vs_slowest": round(elapsed / slowest, 2),
+        })
+
+    frame = pd.DataFrame(results)
+    print(frame.to_string(index=False))
+    if args.json:
+        frame.to_json(args.json, orient="records", force_ascii=False,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
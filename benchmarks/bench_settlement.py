@@ -0,0 +1,131 @@
+"""精算計算のベンチマーク（テストではなく計測用のスクリプト）
+
+参加者数と行数を変えた支出一覧に対して、人ごとの合計（1回の groupby）と
+送金の組み合わせ（balances.minimal_transfers）の所要時間を計測する。
+比較のため、以前の人ごとに1回ずつ行を絞り込む集計の時間も表示する。
+
+参加者数ごとに、所要時間を行数の1次式（固定の時間 + 行数 × 傾き）に
+最小二乗法で当てはめた傾き（10万行あたりのミリ秒）と固定の時間も表示する。
+少ない行数では固定の時間が大半を占めるため、既定では傾きが支配的になる
+100万行以上で計測する。max_error_pct（当てはめからの最大のずれ）が
+小さければ、行数に対して線形に増えている。
+
+    python benchmarks/bench_settlement.py
+    python benchmarks/bench_settlement.py --rows 100000 1000000 --participants 2 50
+    python benchmarks/bench_settlement.py --json results.json
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from balances import (  # noqa: E402
+    minimal_transfers,
+    person_totals,
+    settlement_balances,
+)
+
+DEFAULT_ROWS = [1_000_000, 3_000_000, 10_000_000]
+DEFAULT_PARTICIPANTS = [2, 10, 100]
+REPEAT = 5
+
+
+def expense_frame(rows, participants):
+    """アプリの読み込み結果と同じ型（category / Int32）の支出一覧"""
+    rng = np.random.default_rng(0)
+    names = [f"P{i:03d}" for i in range(participants)]
+    return names, pd.DataFrame({
+        "Person": pd.Categorical.from_codes(
+            rng.integers(0, participants, rows), categories=names),
+        "Amount": pd.array(rng.integers(1, 100, rows) * 100, dtype="Int32"),
+    })
+
+
+def timed(func):
+    """REPEAT 回実行して最短の時間（ミリ秒）と最後の結果を返す"""
+    best = None
+    for _ in range(REPEAT):
+        gc.collect()
+        started = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def settle(frame, names):
+    totals = person_totals(frame)
+    return minimal_transfers(settlement_balances(totals, names))
+
+
+def masked_totals(frame, names):
+    # 以前の app.py と同じく、人ごとに全行を絞り込んで合計する
+    return {name: frame[frame["Person"] == name]["Amount"].sum()
+            for name in names}
+
+
+def linear_fit(results):
+    """参加者数ごとの settle_ms と行数の1次式への当てはめ"""
+    fits = []
+    for participants, group in results.groupby("participants"):
+        if len(group) < 2:
+            continue
+        rows = group["rows"].to_numpy(dtype=float)
+        settle_ms = group["settle_ms"].to_numpy(dtype=float)
+        slope, fixed_ms = np.polyfit(rows, settle_ms, 1)
+        predicted = slope * rows + fixed_ms
+        fits.append({
+            "participants": participants,
+            "ms_per_100k": round(slope * 100_000, 3),
+            "fixed_ms": round(fixed_ms, 2),
+            "max_error_pct": round(
+                float(np.max(np.abs(settle_ms - predicted) / settle_ms))
+                * 100, 1),
+        })
+    return pd.DataFrame(fits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--participants", type=int, nargs="+",
+                        default=DEFAULT_PARTICIPANTS)
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    results = []
+    for participants in args.participants:
+        for rows in args.rows:
+            print(f"{participants} 人: {rows} 行 ...", file=sys.stderr)
+            names, frame = expense_frame(rows, participants)
+            settle_ms, transfers = timed(lambda: settle(frame, names))
+            masked_ms, _ = timed(lambda: masked_totals(frame, names))
+            assert len(transfers) < participants
+            results.append({
+                "participants": participants,
+                "rows": rows,
+                "settle_ms": round(settle_ms, 2),
+                "masked_ms": round(masked_ms, 2),
+                "transfers": len(transfers),
+            })
+
+    frame = pd.DataFrame(results)
+    fits = linear_fit(frame)
+    print(frame.to_string(index=False))
+    if not fits.empty:
+        print()
+        print(fits.to_string(index=False))
+    if args.json:
+        frame.to_json(args.json, orient="records", force_ascii=False,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
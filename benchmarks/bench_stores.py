@@ -0,0 +1,175 @@
+"""保存先（table_store）ごとのベンチマーク（テストではなく計測用のスクリプト）
+
+sheets（fake_sheets のメモリ上の代替）/ csv / sqlite / memory に同じ操作を
+行い、行数ごとに所要時間を比べる。sheets は API 呼び出し回数も表示する。
+
+    python benchmarks/bench_stores.py
+    python benchmarks/bench_stores.py --rows 1000 100000 --backends csv sqlite
+    python benchmarks/bench_stores.py --latency 0.05 --json results.json
+
+操作:
+    seed     表全体を置き換えて rows 行を書き込む
+    cold     保持しているデータフレームを捨てて読み込む
+    warm     変更のない表を読み込む
+    append   1行ずつ APPENDS 回追加する（1回あたりの時間）
+    range    末尾 100 行を範囲指定で読む
+    batch    精算と同じ書き込み（2つの表への追加と1つの表の置き換え）
+"""
+import argparse
+import datetime
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import streamlit as st
+import streamlit.config
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_sheets import get_fake_client  # noqa: E402
+from sheet_schemas import Column, Schema  # noqa: E402
+from table_store import BACKENDS, get_table_store  # noqa: E402
+
+DEFAULT_ROWS = [100, 10_000, 100_000]
+APPENDS = 10
+SPREADSHEET = "bench_store"
+TABLES = {"expense": 0, "history": 1, "detail": "支出履歴"}
+EXPENSE_SCHEMA = Schema([
+    Column("Person", "category"),
+    Column("Date", "datetime"),
+    Column("Amount", "Int32"),
+    Column("Content", "category"),
+    Column("Place", "text", required=False),
+])
+HISTORY_SCHEMA = Schema([
+    Column("精算日", "datetime", required=False),
+    Column("支払者", "category", required=False),
+    Column("金額", "float", required=False),
+    Column("総支出", "Int64", required=False),
+])
+SCHEMAS = {"expense": EXPENSE_SCHEMA, "history": HISTORY_SCHEMA,
+           "detail": EXPENSE_SCHEMA}
+
+
+def use_secrets(directory, latency):
+    """一時的な secrets.toml を作り、Streamlit に読ませる"""
+    path = os.path.join(directory, "secrets.toml")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            "[SHEETS]\n"
+            'BACKEND = "fake"\n'
+            f"FAKE_LATENCY_SECONDS = {latency}\n"
+            # レート制限で待たされると計測にならないため、上限は十分に大きくする
+            "[SCHEDULER.SHEETS]\n"
+            "REQUESTS_PER_MINUTE = 1000000000\n"
+            "BURST = 1000000000\n"
+            "[STORAGE]\n"
+            f'DIR = "{os.path.join(directory, "storage")}"\n'
+        )
+    streamlit.config.set_option("secrets.files", [path])
+
+
+def expense_rows(count):
+    rng = random.Random(0)
+    end = datetime.date.today()
+    return [["A" if rng.random() < 0.5 else "B", str(day.date()),
+             rng.randrange(100, 10000, 100), rng.choice(["食費", "その他"]),
+             "店"]
+            for day in pd.date_range(end=end, periods=count, freq="D")]
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    return (time.perf_counter() - started) * 1000
+
+
+def run_backend(backend, rows, latency):
+    # 接続・キャッシュ・fake のデータを捨てて、起動直後と同じ状態から始める
+    st.cache_resource.clear()
+    get_fake_client(latency).add_spreadsheet(
+        SPREADSHEET, {"Sheet1": [], "Sheet2": [], "支出履歴": []}
+    )
+    store = get_table_store(SPREADSHEET, TABLES, _schemas=SCHEMAS,
+                            backend=backend)
+    header = EXPENSE_SCHEMA.names
+    data = expense_rows(rows)
+    settlement = [
+        ("append", "history", [HISTORY_SCHEMA.names,
+                               ["2024-01-01 12:00:00", "A", 100.0, 200]]),
+        ("append", "detail", [header] + data[:100]),
+        ("replace", "expense", [header]),
+    ]
+
+    def append_many():
+        for row in data[:APPENDS]:
+            store.append_rows("expense", [row])
+
+    steps = [
+        ("seed", lambda: store.replace("expense", [header] + data)),
+        ("cold", lambda: (store.invalidate(), store.read_frame("expense"))),
+        ("warm", lambda: store.read_frame("expense")),
+        ("append", append_many),
+        ("range", lambda: store.read_range("expense", rows - 98, rows + 1)),
+        ("batch", lambda: store.batch(settlement)),
+    ]
+    results = []
+    for step, func in steps:
+        gc.collect()
+        calls = get_fake_client(latency).total_calls()
+        wall_ms = timed(func)
+        if step == "append":
+            wall_ms /= APPENDS
+        results.append({
+            "backend": backend,
+            "rows": rows,
+            "step": step,
+            "wall_ms": round(wall_ms, 2),
+            "api_calls": (get_fake_client(latency).total_calls() - calls
+                          if backend == "sheets" else None),
+        })
+    frame = store.read_frame("expense")
+    assert len(frame) == 0, f"{backend}: 精算後の行数が {len(frame)} です"
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS,
+                        default=list(BACKENDS))
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="fake_sheets の API 呼び出し1回ごとの遅延（秒）")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    use_secrets(tempfile.mkdtemp(prefix="bench_stores_"), args.latency)
+    results = []
+    for backend in args.backends:
+        for rows in args.rows:
+            print(f"{backend}: {rows} 行 ...", file=sys.stderr)
+            results.extend(run_backend(backend, rows, args.latency))
+
+    frame = pd.DataFrame(results)
+    print(frame.pivot_table(index=["backend", "rows"], columns="step",
+                            values="wall_ms", sort=False)
+          [["seed", "cold", "warm", "append", "range", "batch"]]
+          .to_string())
+    sheets = frame[frame["backend"] == "sheets"]
+    if not sheets.empty:
+        print()
+        print("sheets の API 呼び出し回数")
+        print(sheets.pivot_table(index="rows", columns="step",
+                                 values="api_calls", sort=False).to_string())
+    if args.json:
+        frame.to_json(args.json, orient="records", force_ascii=False,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Drive からダウンロードした家計簿 CSV の読み込み結果のディスクキャッシュ
+
+ファイル ID と内容のハッシュ（md5Checksum、なければ modifiedTime）を
+キーにして、読み込んだデータフレームを Parquet で保存する。内容が
+変わっていない月はダウンロードせずにディスクから読む。
+"""
+import hashlib
+import os
+import threading
+
+import pandas as pd
+import streamlit as st
+
+from tracing import span
+
+CACHE_DIR = os.path.join(".cache", "kakeibo")
+# キャッシュ全体の上限（超えたら古く使われたものから削除）
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+SUFFIX = ".parquet"
+
+
+def cache_key(file_info):
+    """ファイル情報から内容ごとのキーを作る（版を判別できなければ None）"""
+    version = file_info.get("md5Checksum") or file_info.get("modifiedTime")
+    if not version:
+        return None
+    digest = hashlib.sha256(
+        f"{file_info['id']}:{version}".encode("utf-8")
+    ).hexdigest()
+    return f"{file_info['id']}.{digest[:32]}"
+
+
+class CsvFrameCache:
+    """データフレームを Parquet で保存するサイズ上限付き LRU キャッシュ"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + SUFFIX)
+
+    def get(self, file_info):
+        """キャッシュ済みならデータフレームを返す（なければ None）"""
+        key = cache_key(file_info)
+        if key is None:
+            return None
+        path = self._path(key)
+        try:
+            with span("csv_cache.read"):
+                frame = pd.read_parquet(path)
+        except (OSError, ValueError):
+            return None
+        # 最終利用日時を更新（LRU の順序に使う）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return frame
+
+    def put(self, file_info, frame):
+        """保存する（Parquet に書けない列がある場合は保存しない）"""
+        key = cache_key(file_info)
+        if key is None:
+            return False
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        # 一時ファイルはスレッドごとなので、書き込みは並列に行ってよい
+        try:
+            with span("csv_cache.write"):
+                frame.to_parquet(tmp_path)
+        except (ImportError, OSError, TypeError, ValueError,
+                NotImplementedError):
+            # pyarrow が扱えない混在型の列など（キャッシュは省略するだけ）
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._remove_old_versions(file_info["id"], key)
+            self._evict()
+        return True
+
+    def _remove_old_versions(self, file_id, key):
+        # 同じファイルの古い版はもう読まれない
+        for name in os.listdir(self.cache_dir):
+            if (name.startswith(f"{file_id}.") and name.endswith(SUFFIX)
+                    and name != key + SUFFIX):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                size = os.path.getsize(path)
+                used_at = os.path.getmtime(path)
+            except OSError:
+                continue
+            entries.append((used_at, size, path))
+            total += size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+@st.cache_resource(show_spinner=False)
+def get_csv_cache():
+    """プロセス全体で共有するキャッシュを返す"""
+    drive_config = st.secrets.get("DRIVE", {})
+    return CsvFrameCache(
+        drive_config.get("CSV_CACHE_DIR", CACHE_DIR),
+        drive_config.get("CSV_CACHE_MAX_BYTES", MAX_CACHE_BYTES),
+    )
@@ -0,0 +1,106 @@
+"""家計簿 CSV の文字コードの判定と読み込み（Streamlit に依存しない）
+
+文字コードの候補ごとに CSV 全体の読み込みを試すと、大きな Shift_JIS の
+ファイルでは失敗する読み込みを何度も繰り返すことになる。ここでは BOM と
+先頭の一部（ASCII だけの部分は飛ばす）のデコードで文字コードを決め、
+全体はその文字コードで1回だけデコードする。全体のデコードが実際に
+失敗したときだけ、読めなかった箇所も読める次の候補に切り替える。
+CSV の読み込みはデコード済みの文字列から1回だけ行う。
+"""
+import codecs
+import io
+import re
+
+import pandas as pd
+
+DEFAULT_ENCODINGS = ["utf-8", "shift_jis", "cp932", "iso-2022-jp"]
+# 判定に使う先頭部分のバイト数
+SAMPLE_BYTES = 64 * 1024
+# どの候補でも最後までデコードできず、読めた位置が同じ場合に優先する
+# 文字コード（Shift_JIS の上位互換で、家計簿アプリの CSV はほぼこれ）
+FALLBACK_ENCODING = "cp932"
+
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+_NON_ASCII = re.compile(rb"[\x80-\xff]")
+# ISO-2022-JP は 7bit なので、漢字への切り替え（ESC $ B など）で見分ける
+_ISO_2022_JP_ESCAPE = re.compile(rb"\x1b\$[@B]")
+
+
+def _decodes(sample, encoding):
+    # 末尾で多バイト文字が切れていてもエラーにしないよう逐次デコーダーを使う
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+        decoder.decode(sample, final=False)
+    except (UnicodeDecodeError, LookupError):
+        return False
+    return True
+
+
+def candidate_encodings(data, encodings=DEFAULT_ENCODINGS, preferred=None,
+                        sample_bytes=SAMPLE_BYTES):
+    """先頭部分をデコードできる文字コードの候補（試す順）
+
+    preferred（前回そのファイルで使えた文字コードなど）があれば最初に試す。
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return [encoding]
+    match = _NON_ASCII.search(data)
+    if match is None:
+        if _ISO_2022_JP_ESCAPE.search(data):
+            return ["iso-2022-jp"]
+        # ASCII だけなら UTF-8 として読める
+        return ["utf-8"]
+    # 直前までは ASCII なので、最初の非 ASCII バイトは文字の先頭になる
+    sample = data[match.start():match.start() + sample_bytes]
+    candidates = []
+    for encoding in ([preferred] if preferred else []) + list(encodings):
+        if encoding not in candidates and _decodes(sample, encoding):
+            candidates.append(encoding)
+    return candidates
+
+
+def _window(data, position, sample_bytes=SAMPLE_BYTES):
+    """position を含む行から始まる一部（次の候補を試すのに使う）"""
+    # 改行のバイトはどの候補でも多バイト文字の途中には現れない
+    start = data.rfind(b"\n", max(0, position - sample_bytes), position) + 1
+    return data[start:start + sample_bytes]
+
+
+def decode(data, encodings=DEFAULT_ENCODINGS, preferred=None):
+    """バイト列を (文字列, 文字コード, 欠損あり) にする
+
+    先頭部分をデコードできた最初の候補で全体をデコードする。途中で
+    読めない箇所があれば、その箇所もデコードできる次の候補で全体を
+    デコードし直す。どれも最後まで読めなければ、最も後ろまで読めた候補
+    （先頭部分も読めなければ FALLBACK_ENCODING）で読めない文字を
+    置き換えてデコードする（3つ目の値が True）。
+    """
+    samples = []
+    reached = None
+    for encoding in candidate_encodings(data, encodings, preferred):
+        if not all(_decodes(sample, encoding) for sample in samples):
+            continue
+        try:
+            return data.decode(encoding), encoding, False
+        except UnicodeDecodeError as error:
+            if (reached is None or error.start > reached[0]
+                    or (error.start == reached[0]
+                        and encoding == FALLBACK_ENCODING)):
+                reached = (error.start, encoding)
+            samples.append(_window(data, error.start))
+    fallback = reached[1] if reached else FALLBACK_ENCODING
+    return data.decode(fallback, errors="replace"), fallback, True
+
+
+def read_csv_bytes(data, encodings=DEFAULT_ENCODINGS, preferred=None):
+    """CSV のバイト列を読み込んで (データフレーム, 文字コード, 欠損あり) を返す
+
+    preferred（前回そのファイルで使えた文字コード）は最初の候補として試す。
+    """
+    text, encoding, lossy = decode(data, encodings, preferred)
+    return pd.read_csv(io.StringIO(text)), encoding, lossy
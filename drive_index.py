@@ -0,0 +1,149 @@
+"""Google Drive の家計簿フォルダの一覧（年月 → ファイル情報）
+
+月を切り替えるたびにファイル名で検索しないよう、フォルダ内のファイルを
+files.list（ページ送り）でまとめて取得し、ファイル名の形式
+（csv_filename_pattern）から年月を取り出して保持する。一覧は一定時間ごとに
+取り直し、それまでの月の検索はメモリ上で済ませる。
+"""
+import re
+import threading
+import time
+
+import streamlit as st
+
+from api_scheduler import scheduled
+from tracing import span
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+# 一覧を取り直すまでの時間（秒）。[DRIVE] INDEX_TTL_SECONDS で変更できる
+INDEX_TTL_SECONDS = 300
+# 見つかったフォルダの ID を覚えておく時間（秒）
+FOLDER_ID_TTL_SECONDS = 3600
+# files.list の1ページの件数（Drive API の上限）
+LIST_PAGE_SIZE = 1000
+FILE_FIELDS = "id, name, mimeType, modifiedTime, md5Checksum, size"
+
+
+def filename_regex(csv_pattern):
+    """"record{year_month}.csv" のような形式から年月を取り出す正規表現"""
+    prefix, _, suffix = csv_pattern.partition("{year_month}")
+    return re.compile(
+        f"^{re.escape(prefix)}(?P<year_month>\\d{{6}}){re.escape(suffix)}$"
+    )
+
+
+class DriveFolderIndex:
+    """1つのフォルダ内の CSV を年月で引けるようにした一覧"""
+
+    def __init__(self, folder_name, csv_pattern, csv_mime_types=(),
+                 ttl_seconds=INDEX_TTL_SECONDS):
+        self.folder_name = folder_name
+        self.csv_mime_types = tuple(csv_mime_types)
+        self.ttl_seconds = ttl_seconds
+        self._regex = filename_regex(csv_pattern)
+        self._lock = threading.Lock()
+        self._folder_id = None
+        self._folder_checked_at = 0.0
+        self._files = None
+        self._refreshed_at = 0.0
+        self.refresh_count = 0
+
+    def _find_folder_id(self, drive_service):
+        # フォルダの ID は一覧より長く使い回す
+        if (self._folder_id is not None
+                and time.time() - self._folder_checked_at
+                < FOLDER_ID_TTL_SECONDS):
+            return self._folder_id
+        folder_query = (f"name='{self.folder_name}' and "
+                        f"mimeType='{FOLDER_MIME_TYPE}'")
+        result = scheduled(
+            drive_service.files().list(
+                q=folder_query, pageSize=1, fields="files(id)"
+            ).execute,
+            api="drive",
+            coalesce_key=("files.list", folder_query),
+        )
+        folders = result.get("files", [])
+        # 見つからなかったことは覚えない（フォルダを共有した後に再試行できる）
+        self._folder_id = folders[0]["id"] if folders else None
+        self._folder_checked_at = time.time()
+        return self._folder_id
+
+    def _list_folder(self, drive_service, folder_id):
+        query = f"'{folder_id}' in parents and trashed=false"
+        files = []
+        page_token = None
+        while True:
+            result = scheduled(
+                drive_service.files().list(
+                    q=query,
+                    pageSize=LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
+                ).execute,
+                api="drive",
+                coalesce_key=("files.list", query, page_token),
+            )
+            files.extend(result.get("files", []))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                return files
+
+    def _by_year_month(self, files):
+        index = {}
+        for file in files:
+            match = self._regex.match(file.get("name", ""))
+            if not match:
+                continue
+            year_month = match.group("year_month")
+            current = index.get(year_month)
+            # 同じ年月のファイルが複数あれば CSV の mimeType・新しいものを優先する
+            if current is None or self._rank(file) > self._rank(current):
+                index[year_month] = file
+        return dict(sorted(index.items()))
+
+    def _rank(self, file):
+        return (file.get("mimeType") in self.csv_mime_types,
+                file.get("modifiedTime", ""))
+
+    def refresh(self, drive_service):
+        """フォルダの一覧を取り直す（フォルダがなければ None を返す）"""
+        with self._lock, span("drive.index"):
+            folder_id = self._find_folder_id(drive_service)
+            if folder_id is None:
+                self._files = None
+                return None
+            self._files = self._by_year_month(
+                self._list_folder(drive_service, folder_id)
+            )
+            self._refreshed_at = time.time()
+            self.refresh_count += 1
+            return self._files
+
+    def files(self, drive_service):
+        """{年月: ファイル情報}（期限内なら取り直さない）"""
+        with self._lock:
+            if (self._files is not None
+                    and time.time() - self._refreshed_at < self.ttl_seconds):
+                return self._files
+        return self.refresh(drive_service)
+
+    def lookup(self, year_month, drive_service):
+        """年月のファイル情報（なければ None）"""
+        files = self.files(drive_service)
+        return files.get(year_month) if files else None
+
+    @property
+    def refreshed_at(self):
+        return self._refreshed_at
+
+
+@st.cache_resource(show_spinner=False)
+def get_drive_folder_index(folder_name, csv_pattern, csv_mime_types=()):
+    """プロセス内のセッションで共有するフォルダの一覧を返す"""
+    drive_config = st.secrets.get("DRIVE", {})
+    return DriveFolderIndex(
+        folder_name, csv_pattern, csv_mime_types,
+        ttl_seconds=drive_config.get("INDEX_TTL_SECONDS", INDEX_TTL_SECONDS),
+    )
@@ -0,0 +1,210 @@
+"""オフライン動作確認用の Google Drive API の代替（プロセス内のメモリ上で動作）
+
+googleapiclient の drive v3 サービスのうち、app_kakeibo.py が使う
+files().list / files().get / files().get_media だけを再現する。
+get_media の結果は MediaIoBaseDownload でそのままダウンロードできる。
+fake_sheets と同じく API 呼び出し回数を数え、遅延やエラー応答を注入できる。
+"""
+import collections
+import datetime
+import hashlib
+import itertools
+import re
+import threading
+import time
+
+import httplib2
+import streamlit as st
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+
+_ids = itertools.count(1)
+
+# q パラメータのうち対応している条件
+_CONDITIONS = [
+    (re.compile(r"^name\s*=\s*'(.*)'$"),
+     lambda f, v: f["name"] == v),
+    (re.compile(r"^name\s+contains\s+'(.*)'$"),
+     lambda f, v: v in f["name"]),
+    (re.compile(r"^mimeType\s*=\s*'(.*)'$"),
+     lambda f, v: f["mimeType"] == v),
+    (re.compile(r"^'(.*)'\s+in\s+parents$"),
+     lambda f, v: v in f["parents"]),
+    (re.compile(r"^trashed\s*=\s*(true|false)$"),
+     lambda f, v: str(f["trashed"]).lower() == v),
+]
+
+
+def http_error(status, message="fake error"):
+    """指定したステータスコードの googleapiclient.errors.HttpError を作成"""
+    return HttpError(httplib2.Response({"status": status}),
+                     message.encode("utf-8"))
+
+
+def _matcher(query):
+    if not query:
+        return lambda f: True
+    tests = []
+    for clause in re.split(r"\s+and\s+", query.strip()):
+        for pattern, test in _CONDITIONS:
+            match = pattern.match(clause.strip())
+            if match:
+                value = match.group(1).replace("\\'", "'")
+                tests.append(lambda f, t=test, v=value: t(f, v))
+                break
+        else:
+            raise http_error(400, f"unsupported query: {clause}")
+    return lambda f: all(t(f) for t in tests)
+
+
+def _select(file, fields):
+    # fields="nextPageToken, files(id, name)" の files(...) 部分だけを見る
+    match = re.search(r"files\(([^)]*)\)", fields or "")
+    if not match:
+        return {k: file[k] for k in ("id", "name", "mimeType")}
+    names = [name.strip() for name in match.group(1).split(",")]
+    return {name: file[name] for name in names if name in file}
+
+
+class _FakeRequest:
+    def __init__(self, func):
+        self._func = func
+
+    def execute(self, num_retries=0):
+        return self._func()
+
+
+class _FakeHttp:
+    """MediaIoBaseDownload から呼ばれる httplib2.Http の代わり"""
+
+    def __init__(self, service, file_id):
+        self._service = service
+        self._file_id = file_id
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        self._service.api_call("files.get_media")
+        content = self._service.file(self._file_id)["content"]
+        total = len(content)
+        match = re.match(r"bytes=(\d+)-(\d+)", (headers or {}).get("range", ""))
+        start, end = (int(match.group(1)), int(match.group(2))) if match \
+            else (0, total - 1)
+        if total and start >= total:
+            return httplib2.Response(
+                {"status": 416, "content-range": f"bytes */{total}"}), b""
+        chunk = content[start:end + 1]
+        return httplib2.Response({
+            "status": 206,
+            "content-range": f"bytes {start}-{start + len(chunk) - 1}/{total}",
+        }), chunk
+
+
+class _FakeMediaRequest:
+    def __init__(self, service, file_id):
+        self.uri = f"fake://drive/files/{file_id}?alt=media"
+        self.headers = {}
+        self.http = _FakeHttp(service, file_id)
+
+
+class _FakeFiles:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, q=None, pageSize=100, pageToken=None, fields=None,
+             **kwargs):
+        return _FakeRequest(
+            lambda: self._service.list_files(q, pageSize, pageToken, fields)
+        )
+
+    def get(self, fileId, fields=None, **kwargs):
+        def get():
+            self._service.api_call("files.get")
+            return _select(self._service.file(fileId), fields)
+        return _FakeRequest(get)
+
+    def get_media(self, fileId, **kwargs):
+        return _FakeMediaRequest(self._service, fileId)
+
+
+class FakeDriveService:
+    """googleapiclient の drive v3 サービスの代わりに使うオブジェクト
+
+    latency: API 呼び出し1回ごとに待つ秒数
+    calls: API 呼び出しの種類ごとの回数
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._files = {}
+        self._failures = []
+        self._lock = threading.Lock()
+
+    def api_call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            failure = self._failures.pop(0) if self._failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if failure is not None:
+            raise http_error(failure)
+
+    def fail_next(self, count=1, status=429):
+        """次の count 回の API 呼び出しを指定ステータスのエラーにする"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def file(self, file_id):
+        if file_id not in self._files:
+            raise http_error(404, f"file not found: {file_id}")
+        return self._files[file_id]
+
+    def list_files(self, query, page_size, page_token, fields):
+        self.api_call("files.list")
+        matches = [f for f in self._files.values() if _matcher(query)(f)]
+        start = int(page_token or 0)
+        result = {"files": [_select(f, fields)
+                            for f in matches[start:start + page_size]]}
+        if start + page_size < len(matches):
+            result["nextPageToken"] = str(start + page_size)
+        return result
+
+    # ---- テストデータの投入用（API 呼び出しとしては数えない） ----
+
+    def _add(self, name, mime_type, parent_id, content=b""):
+        file_id = f"fake-file-{next(_ids)}"
+        self._files[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": mime_type,
+            "parents": [parent_id] if parent_id else [],
+            "trashed": False,
+            "content": content,
+            "size": str(len(content)),
+            "md5Checksum": hashlib.md5(content).hexdigest(),
+            "modifiedTime": datetime.datetime.now(
+                datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+        }
+        return file_id
+
+    def add_folder(self, name, parent_id=None):
+        return self._add(name, FOLDER_MIME_TYPE, parent_id)
+
+    def add_file(self, name, content, parent_id=None, mime_type="text/csv"):
+        """ファイルを追加する（同じフォルダの同名ファイルは置き換える）"""
+        for file_id, f in list(self._files.items()):
+            if f["name"] == name and parent_id in f["parents"]:
+                del self._files[file_id]
+        return self._add(name, mime_type, parent_id, content)
+
+
+@st.cache_resource(show_spinner=False)
+def get_fake_drive_service(latency=0.0):
+    """プロセス全体で共有する Drive の代替（ベンチマークから投入できるよう共有）"""
+    return FakeDriveService(latency=latency)
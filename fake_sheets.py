@@ -0,0 +1,314 @@
+"""オフライン動作確認用の Google Sheets の代替（プロセス内のメモリ上で動作）
+
+gspread の Client / Spreadsheet / Worksheet のうち、このリポジトリの
+アプリが使うメソッドだけを再現する。API 呼び出し回数を数え、遅延や
+エラー応答（429 など）を注入できるので、同期処理やリトライの確認にも使う。
+"""
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+
+import gspread
+import requests
+import streamlit as st
+from gspread.utils import a1_to_rowcol
+
+_ids = itertools.count(1)
+
+
+def _is_blank(value):
+    return value is None or value == ""
+
+
+def _trim(rows):
+    # API と同じく末尾の空セル・空行は返さない
+    trimmed = []
+    for row in rows:
+        row = list(row)
+        while row and _is_blank(row[-1]):
+            row.pop()
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+def _formatted(value):
+    if _is_blank(value):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _cell_value(cell):
+    entered = cell.get("userEnteredValue")
+    if not entered:
+        return ""
+    value = next(iter(entered.values()))
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _parse_range(range_name):
+    """'シート名'!A5:E 形式を (シート名, 開始行, 終了行) に分解（行は1始まり）"""
+    if "!" in range_name:
+        title, cells = range_name.rsplit("!", 1)
+    else:
+        title, cells = range_name, None
+    title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+    if not cells:
+        return title, 1, None
+    bounds = cells.split(":")
+    start_row = int(re.sub(r"[A-Z]", "", bounds[0]) or 1)
+    end_row = None
+    if len(bounds) > 1 and re.search(r"\d", bounds[1]):
+        end_row = int(re.sub(r"[A-Z]", "", bounds[1]))
+    return title, start_row, end_row
+
+
+def api_error(status, message="fake error"):
+    """指定したステータスコードの gspread.exceptions.APIError を作成"""
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(
+        {"error": {"code": status, "message": message, "status": "FAKE"}}
+    ).encode("utf-8")
+    return gspread.exceptions.APIError(response)
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, index):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.index = index
+        self.id = next(_ids)
+        self.rows = []
+
+    @property
+    def spreadsheet_id(self):
+        return self.spreadsheet.id
+
+    def _call(self, name):
+        self.spreadsheet.client.api_call(name)
+
+    def get_all_values(self, *args, **kwargs):
+        self._call("values.get")
+        return [[_formatted(v) for v in row] for row in _trim(self.rows)]
+
+    def get_all_records(self, *args, **kwargs):
+        self._call("values.get")
+        rows = _trim(self.rows)
+        if not rows:
+            return []
+        header = rows[0]
+        return [
+            dict(zip(header, row + [""] * (len(header) - len(row))))
+            for row in rows[1:]
+        ]
+
+    def get(self, range_name=None, *args, **kwargs):
+        self._call("values.get")
+        _, start_row, end_row = _parse_range(range_name or "A1")
+        return _trim(self.rows)[start_row - 1:end_row]
+
+    def row_values(self, row, *args, **kwargs):
+        self._call("values.get")
+        rows = _trim(self.rows)
+        if row > len(rows):
+            return []
+        return [_formatted(v) for v in rows[row - 1]]
+
+    def append_rows(self, values, *args, **kwargs):
+        self._call("values.append")
+        self._append(values)
+
+    def append_row(self, values, *args, **kwargs):
+        self._call("values.append")
+        self._append([values])
+
+    def _append(self, values):
+        self.rows = _trim(self.rows) + [list(row) for row in values]
+
+    def insert_row(self, values, index=1, *args, **kwargs):
+        self._call("batchUpdate")
+        self.rows.insert(index - 1, list(values))
+
+    def clear(self):
+        self._call("values.clear")
+        self.rows = []
+
+    def update(self, values=None, range_name=None, *args, **kwargs):
+        self._call("values.update")
+        start_row = 1
+        if range_name:
+            start_row = a1_to_rowcol(range_name.split(":")[0])[0]
+        while len(self.rows) < start_row - 1 + len(values):
+            self.rows.append([])
+        for offset, row in enumerate(values):
+            self.rows[start_row - 1 + offset] = list(row)
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+        self.id = f"fake-{next(_ids)}"
+        self._worksheets = []
+        self.add_worksheet("Sheet1", rows=1000, cols=26, _count=False)
+
+    @property
+    def sheet1(self):
+        return self.get_worksheet(0)
+
+    def worksheets(self):
+        self.client.api_call("get")
+        return list(self._worksheets)
+
+    def get_worksheet(self, index):
+        self.client.api_call("get")
+        if self.client.auto_create:
+            while len(self._worksheets) <= index:
+                self.add_worksheet(f"Sheet{len(self._worksheets) + 1}",
+                                   _count=False)
+        if index >= len(self._worksheets):
+            raise gspread.exceptions.WorksheetNotFound(index)
+        return self._worksheets[index]
+
+    def worksheet(self, title):
+        self.client.api_call("get")
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows=1000, cols=26, index=None,
+                      _count=True):
+        if _count:
+            self.client.api_call("batchUpdate")
+        worksheet = FakeWorksheet(self, title, len(self._worksheets))
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def _by_title(self, title):
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def values_batch_get(self, ranges, params=None):
+        self.client.api_call("values.batchGet")
+        value_ranges = []
+        for range_name in ranges:
+            title, start_row, end_row = _parse_range(range_name)
+            rows = _trim(self._by_title(title).rows)[start_row - 1:end_row]
+            value_range = {"range": range_name}
+            if rows:
+                value_range["values"] = rows
+            value_ranges.append(value_range)
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+    def batch_update(self, body):
+        self.client.api_call("batchUpdate")
+        by_id = {worksheet.id: worksheet for worksheet in self._worksheets}
+        # 実際の API と同じく、途中で失敗したら何も反映しない
+        staged = {sheet_id: [list(row) for row in worksheet.rows]
+                  for sheet_id, worksheet in by_id.items()}
+        for request in body["requests"]:
+            if "appendCells" in request:
+                append = request["appendCells"]
+                rows = _trim(staged[append["sheetId"]])
+                rows.extend([_cell_value(cell) for cell in row["values"]]
+                            for row in append["rows"])
+                staged[append["sheetId"]] = rows
+            elif "updateCells" in request:
+                update = request["updateCells"]
+                if "range" in update:
+                    grid = update["range"]
+                    rows = staged[grid["sheetId"]]
+                    start = grid.get("startRowIndex", 0)
+                    end = grid.get("endRowIndex", len(rows))
+                    for index in range(start, min(end, len(rows))):
+                        rows[index] = []
+                else:
+                    start = update["start"]
+                    rows = staged[start["sheetId"]]
+                    for offset, row in enumerate(update["rows"]):
+                        index = start["rowIndex"] + offset
+                        while len(rows) <= index:
+                            rows.append([])
+                        rows[index] = [_cell_value(c) for c in row["values"]]
+            else:
+                raise api_error(400, f"unsupported request: {request}")
+        for sheet_id, rows in staged.items():
+            by_id[sheet_id].rows = rows
+        return {"spreadsheetId": self.id, "replies": []}
+
+
+class FakeClient:
+    """gspread.Client の代わりに使うクライアント
+
+    latency: API 呼び出し1回ごとに待つ秒数
+    auto_create: インデックス指定で存在しないワークシートを自動で作成する
+    calls: API 呼び出しの種類ごとの回数
+    """
+
+    def __init__(self, latency=0.0, auto_create=False):
+        self.latency = latency
+        self.auto_create = auto_create
+        self.calls = collections.Counter()
+        self._spreadsheets = {}
+        self._failures = []
+        self._lock = threading.Lock()
+
+    def api_call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            failure = self._failures.pop(0) if self._failures else None
+        if self.latency:
+            time.sleep(self.latency)
+        if failure is not None:
+            raise api_error(failure)
+
+    def fail_next(self, count=1, status=429):
+        """次の count 回の API 呼び出しを指定ステータスのエラーにする"""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def open(self, title):
+        self.api_call("drive.files.list")
+        if title not in self._spreadsheets:
+            raise gspread.exceptions.SpreadsheetNotFound(title)
+        return self._spreadsheets[title]
+
+    def create(self, title):
+        self.api_call("drive.files.create")
+        spreadsheet = FakeSpreadsheet(self, title)
+        self._spreadsheets[title] = spreadsheet
+        return spreadsheet
+
+    def add_spreadsheet(self, title, worksheets):
+        """テストデータの投入用: {シート名: 2次元リスト} からスプレッドシートを作成
+
+        先頭のシートは sheet1 になる（API 呼び出しとしては数えない）。
+        """
+        spreadsheet = FakeSpreadsheet(self, title)
+        spreadsheet._worksheets = []
+        for sheet_title, rows in worksheets.items():
+            worksheet = spreadsheet.add_worksheet(sheet_title, _count=False)
+            worksheet.rows = [list(row) for row in rows]
+        self._spreadsheets[title] = spreadsheet
+        return spreadsheet
+
+
+@st.cache_resource(show_spinner=False)
+def get_fake_client(latency=0.0):
+    """プロセス全体で共有する Sheets の代替（ベンチマークから投入できるよう共有）"""
+    return FakeClient(latency=latency, auto_create=True)
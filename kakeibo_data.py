@@ -0,0 +1,146 @@
+"""家計簿の月ごとのデータをメモリに保持する（データフレームと集計結果）
+
+一度読み込んだ月は、再実行（集計する列の変更・集計実行など）のたびに
+ダウンロードやディスクのキャッシュを読み直さず、プロセス内のメモリから
+返す。Drive のファイルの内容が変わった場合（md5Checksum / modifiedTime
+が変わった場合）は保持しているデータを使わない。
+
+複数の月を表示するときは、まだ読み込んでいない月をスレッドプールで
+並列に読み込み（load_in_parallel）、年月の列を付けて1つにまとめる。
+"""
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from csv_cache import cache_key
+
+# メモリに保持する月数の上限（超えたら古く使われたものから捨てる）
+MAX_MONTHS = 24
+# 複数の月をまとめたデータを保持する件数
+MAX_RANGES = 4
+# 並列に読み込む月数の上限（1年分を一度に読む。[DRIVE] MAX_WORKERS で変更できる）
+MAX_WORKERS = 12
+# 複数の月をまとめたときに付ける列
+MONTH_COLUMN = "年月"
+
+
+def summarize_by(df, column):
+    """(収入の集計, 支出の集計) を返す（column ごとの金額の合計、多い順）"""
+    summaries = []
+    for kind in ("収入", "支出"):
+        summary = (df[df['収入/支出'] == kind].groupby(column)['金額']
+                   .sum().reset_index())
+        summaries.append(summary.sort_values('金額', ascending=False))
+    return tuple(summaries)
+
+
+def combine_frames(months):
+    """月ごとのデータフレームを、先頭に年月の列を付けて1つにする"""
+    frames = [month.frame.drop(columns=MONTH_COLUMN, errors="ignore")
+              for month in months]
+    frame = pd.concat(frames, ignore_index=True)
+    # 年月の順に並ぶようカテゴリ型にする
+    codes = np.repeat(np.arange(len(frames)), [len(part) for part in frames])
+    frame.insert(0, MONTH_COLUMN, pd.Categorical.from_codes(
+        codes, categories=[month.year_month for month in months]
+    ))
+    return frame
+
+
+def load_in_parallel(items, load, max_workers=MAX_WORKERS):
+    """(キー, 引数) の並びを load(引数) でスレッドプールから読み込む
+
+    読み込みが終わった順に (キー, 結果, 例外) を返すジェネレーター。load は
+    ワーカースレッドで動くので、Streamlit の表示（st.*）は呼ばないこと。
+    """
+    if not items:
+        return
+    workers = max(1, min(max_workers, len(items)))
+    with ThreadPoolExecutor(max_workers=workers,
+                            thread_name_prefix="kakeibo-load") as pool:
+        futures = {pool.submit(load, argument): key
+                   for key, argument in items}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield (futures[future],
+                   None if error is not None else future.result(), error)
+
+
+class MonthData:
+    """1か月分（または複数の月）のデータフレームと、集計する列ごとの集計結果"""
+
+    def __init__(self, year_month, frame, version):
+        self.year_month = year_month
+        self.frame = frame
+        self.version = version
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def summary(self, column):
+        """summarize_by の結果（列ごとに1回だけ計算する）"""
+        with self._lock:
+            if column not in self._summaries:
+                self._summaries[column] = summarize_by(self.frame, column)
+            return self._summaries[column]
+
+
+class MonthDataStore:
+    """年月 → MonthData（件数上限付きの LRU）"""
+
+    def __init__(self, max_months=MAX_MONTHS):
+        self.max_months = max_months
+        self._months = collections.OrderedDict()
+        self._ranges = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, year_month, file_info):
+        """保持している月のデータ（ファイルの内容が変わっていれば None）"""
+        version = cache_key(file_info)
+        with self._lock:
+            month = self._months.get(year_month)
+            # キーにファイル ID を含むので、別のファイルとも一致しない
+            if month is None or version is None or month.version != version:
+                self.misses += 1
+                return None
+            self._months.move_to_end(year_month)
+            self.hits += 1
+            return month
+
+    def put(self, year_month, file_info, frame):
+        month = MonthData(year_month, frame, cache_key(file_info))
+        with self._lock:
+            self._months[year_month] = month
+            self._months.move_to_end(year_month)
+            while len(self._months) > self.max_months:
+                self._months.popitem(last=False)
+        return month
+
+    def combine(self, months):
+        """複数の月をまとめた MonthData（同じ内容の組み合わせなら前回のもの）"""
+        key = tuple(month.year_month for month in months)
+        version = tuple(month.version for month in months)
+        with self._lock:
+            combined = self._ranges.get(key)
+            if combined is not None and combined.version == version:
+                self._ranges.move_to_end(key)
+                return combined
+        combined = MonthData(f"{key[0]}-{key[-1]}", combine_frames(months),
+                             version)
+        with self._lock:
+            self._ranges[key] = combined
+            self._ranges.move_to_end(key)
+            while len(self._ranges) > MAX_RANGES:
+                self._ranges.popitem(last=False)
+        return combined
+
+
+@st.cache_resource(show_spinner=False)
+def get_month_data_store():
+    """プロセス内のセッションで共有する月ごとのデータを返す"""
+    return MonthDataStore()
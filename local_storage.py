@@ -0,0 +1,372 @@
+"""app_local_save.py 用のローカル保存先
+
+ExpenseLog（既定）
+    支出の追加・精算を1行1イベントの JSON としてファイル末尾に追記する。
+    メモリ上の一覧は前回読んだ位置から先（他のセッションが書いた分を含む）
+    だけを読み足して更新するので、追加はファイルの大きさに関係なく一定時間で
+    済む。精算より前の行は不要になるため、一定数たまったら現在の一覧だけに
+    書き直す。
+
+ParquetExpenseStore（[LOCAL_STORAGE] BACKEND = "parquet"）
+    精算済みの分も含めた全履歴を月ごとに分割した Parquet に保存し、
+    メモリマップで必要な列だけを読む。複数年分の合計も列の走査だけで求まる。
+
+TableExpenseStore（[LOCAL_STORAGE] BACKEND = "csv" / "sqlite" / "memory" /
+"sheets"）
+    table_store の共通の保存先の表に保存する。
+
+どちらも書き込みはロックファイルで排他する（fcntl がない環境では同じ
+プロセス内だけで排他する）。
+"""
+import glob
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import streamlit as st
+from pyarrow import fs
+
+from balances import BALANCE_SHEET, BALANCE_TABLE
+from sheet_schemas import Column, Schema
+from table_store import FileLock, get_table_store
+
+COLUMNS = ["Person", "Date", "Amount"]
+# 精算済みで不要になった行がこの数を超えたら書き直す
+COMPACT_THRESHOLD = 1000
+# Parquet の月ごとの追記ファイルがこの数を超えたら1ファイルにまとめる
+COMPACT_PARTS = 20
+
+# table_store の保存先を使うときの表の列
+TABLE_SCHEMA = Schema([
+    Column("Person"),
+    Column("Date"),
+    Column("Amount", "Int64"),
+])
+TABLE_BACKENDS = ("csv", "sqlite", "memory", "sheets")
+# table_store の保存先の名前（Sheets ではスプレッドシート名）
+TABLE_STORE_NAME = "household_data"
+# secrets.toml で参加者を設定していない場合の名前
+DEFAULT_PARTICIPANTS = ("たく", "めい")
+
+PARQUET_SCHEMA = pa.schema([
+    ("Person", pa.string()),
+    ("Date", pa.date32()),
+    ("Amount", pa.int64()),
+    # 記録した時刻（ナノ秒）。精算の区切りと並び順に使う
+    ("recorded_at", pa.int64()),
+])
+
+
+class ExpenseLog:
+    """支出イベントのログと、最後の精算以降の支出一覧
+
+    1行のイベントは {"type": "expense", "Person": ..., "Date": ...,
+    "Amount": ...} か {"type": "settle", "at": ...}。
+    """
+
+    def __init__(self, path, compact_threshold=COMPACT_THRESHOLD,
+                 legacy_csv=None):
+        self.path = path
+        self.compact_threshold = compact_threshold
+        self._lock = FileLock(path + ".lock")
+        self._reset()
+        if legacy_csv and not os.path.exists(path) \
+                and os.path.exists(legacy_csv):
+            self._import_csv(legacy_csv)
+
+    def _reset(self):
+        self._inode = None
+        self._offset = 0
+        self._rows = []
+        self._dead_lines = 0
+        self._frame = None
+
+    def _import_csv(self, csv_path):
+        # 以前の CSV 保存形式から移行する
+        data = pd.read_csv(csv_path)
+        events = [{"type": "expense", **{col: row[col] for col in COLUMNS}}
+                  for row in data.to_dict("records")]
+        with self._lock.hold(exclusive=True):
+            if not os.path.exists(self.path):
+                self._write_file(events)
+
+    # ---- 読み込み ----
+
+    def _apply(self, event):
+        if event.get("type") == "settle":
+            self._dead_lines += len(self._rows) + 1
+            self._rows = []
+        else:
+            self._rows.append([event.get(col) for col in COLUMNS])
+        self._frame = None
+
+    def _read_tail(self):
+        """前回読んだ位置から先だけを読み、一覧に反映する"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return
+        # 他のプロセスが書き直した場合は最初から読み直す
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._reset()
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        # 書き込み途中の最終行は次回に読む
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+        self._offset += end
+
+    def frame(self):
+        """最後の精算以降の支出一覧を返す"""
+        with self._lock.hold(exclusive=False):
+            self._read_tail()
+            if self._frame is None:
+                frame = pd.DataFrame(self._rows, columns=COLUMNS)
+                frame["Amount"] = pd.to_numeric(frame["Amount"])
+                self._frame = frame
+            return self._frame
+
+    # ---- 書き込み ----
+
+    def _append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self._lock.hold(exclusive=True):
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._read_tail()
+            if self._dead_lines >= self.compact_threshold:
+                self._compact()
+
+    def add_expense(self, person, date, amount):
+        self._append({"type": "expense", "Person": person,
+                      "Date": str(date), "Amount": int(amount)})
+
+    def settle(self):
+        """精算の区切りを記録する（それまでの支出は一覧から消える）"""
+        self._append({"type": "settle", "at": time.time()})
+
+    def _write_file(self, events):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def _compact(self):
+        # 排他ロックを持った状態で呼ぶこと
+        self._read_tail()
+        events = [{"type": "expense", **dict(zip(COLUMNS, row))}
+                  for row in self._rows]
+        self._write_file(events)
+        self._reset()
+        self._read_tail()
+
+    def compact(self):
+        """精算済みの行を取り除き、現在の一覧だけのファイルに書き直す"""
+        with self._lock.hold(exclusive=True):
+            self._compact()
+
+
+class ParquetExpenseStore:
+    """月ごとに分割した Parquet に全履歴を保存する保存先
+
+    root/month=YYYY-MM/*.parquet に支出を保存する。追加は1件ごとに小さな
+    ファイルを書き、月ごとのファイルが増えたら1つにまとめる。
+    精算は root/_state.json に精算時刻を記録するだけで、行は消さない。
+    """
+
+    def __init__(self, root, compact_parts=COMPACT_PARTS):
+        self.root = root
+        self.compact_parts = compact_parts
+        os.makedirs(root, exist_ok=True)
+        self._lock = FileLock(os.path.join(root, ".lock"))
+        self._state_path = os.path.join(root, "_state.json")
+        self._filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._cache = None
+
+    # ---- 読み込み ----
+
+    def _part_files(self):
+        return sorted(glob.glob(os.path.join(self.root, "month=*",
+                                             "*.parquet")))
+
+    def _dataset(self):
+        return ds.dataset(self.root, schema=PARQUET_SCHEMA, format="parquet",
+                          filesystem=self._filesystem, partitioning="hive")
+
+    def settled_at(self):
+        try:
+            with open(self._state_path, encoding="utf-8") as f:
+                return json.load(f)["settled_at"]
+        except FileNotFoundError:
+            return 0
+
+    def frame(self):
+        """最後の精算以降の支出一覧を返す"""
+        with self._lock.hold(exclusive=False):
+            files = self._part_files()
+            version = (tuple((path, os.path.getmtime(path))
+                             for path in files), self.settled_at())
+            if self._cache is not None and self._cache[0] == version:
+                return self._cache[1]
+            table = self._dataset().to_table(
+                columns=COLUMNS + ["recorded_at"],
+                filter=pc.field("recorded_at") > version[1],
+            )
+        table = table.sort_by("recorded_at").drop_columns(["recorded_at"])
+        frame = table.to_pandas()
+        self._cache = (version, frame)
+        return frame
+
+    def totals(self):
+        """全履歴の人ごとの合計金額（Person と Amount の列だけを読む）"""
+        with self._lock.hold(exclusive=False):
+            table = self._dataset().to_table(columns=["Person", "Amount"])
+        summary = table.group_by("Person").aggregate([("Amount", "sum")])
+        return summary.rename_columns(["Person", "Amount"]).to_pandas()
+
+    # ---- 書き込み ----
+
+    def _write(self, table, month_dir, prefix):
+        os.makedirs(month_dir, exist_ok=True)
+        path = os.path.join(month_dir, f"{prefix}-{time.time_ns()}-"
+                                       f"{uuid.uuid4().hex[:8]}.parquet")
+        # 書き込み途中のファイルを読まないよう、隠しファイルに書いてから置き換える
+        temp_path = os.path.join(month_dir, "." + os.path.basename(path))
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def write_rows(self, rows):
+        """[(Person, Date, Amount, recorded_at), ...] を月ごとに書き込む"""
+        table = pa.Table.from_pylist(
+            [dict(zip(PARQUET_SCHEMA.names, row)) for row in rows],
+            schema=PARQUET_SCHEMA,
+        )
+        months = pc.strftime(table["Date"], format="%Y-%m")
+        with self._lock.hold(exclusive=True):
+            for month in pc.unique(months).to_pylist():
+                month_dir = os.path.join(self.root, f"month={month}")
+                self._write(table.filter(pc.equal(months, month)),
+                            month_dir, "part")
+                if len(glob.glob(os.path.join(month_dir, "*.parquet"))) \
+                        > self.compact_parts:
+                    self._compact_month(month_dir)
+
+    def add_expense(self, person, date, amount):
+        self.write_rows([(person, pd.Timestamp(date).date(), int(amount),
+                          time.time_ns())])
+
+    def settle(self, at=None):
+        """精算時刻を記録する（それ以前の支出は一覧に出なくなる）
+
+        at は記録時刻（ナノ秒）で、省略時は現在時刻。
+        """
+        temp_path = self._state_path + ".tmp"
+        with self._lock.hold(exclusive=True):
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"settled_at": time.time_ns() if at is None
+                           else at}, f)
+            os.replace(temp_path, self._state_path)
+
+    def _compact_month(self, month_dir):
+        # 排他ロックを持った状態で呼ぶこと
+        parts = sorted(glob.glob(os.path.join(month_dir, "*.parquet")))
+        if len(parts) < 2:
+            return
+        table = pa.concat_tables(
+            pq.read_table(path, schema=PARQUET_SCHEMA) for path in parts
+        ).sort_by("recorded_at")
+        self._write(table, month_dir, "data")
+        for path in parts:
+            os.remove(path)
+
+    def compact(self):
+        """すべての月の追記ファイルをそれぞれ1つにまとめる"""
+        with self._lock.hold(exclusive=True):
+            for month_dir in glob.glob(os.path.join(self.root, "month=*")):
+                self._compact_month(month_dir)
+
+
+class TableExpenseStore:
+    """table_store の表を使う保存先（精算では表をヘッダーだけに置き換える）"""
+
+    def __init__(self, store, name="expense"):
+        self.store = store
+        self.name = name
+
+    def frame(self):
+        """最後の精算以降の支出一覧を返す"""
+        return self.store.read_frame(self.name)
+
+    def add_expense(self, person, date, amount):
+        rows = [[person, str(date), int(amount)]]
+        if not self.store.has_header(self.name):
+            rows.insert(0, COLUMNS)
+        self.store.append_rows(self.name, rows)
+
+    def settle(self):
+        """支出一覧をヘッダーだけにする"""
+        self.store.replace(self.name, [COLUMNS])
+
+
+def load_local_config():
+    """secrets.toml の [LOCAL_STORAGE]（secrets.toml がなくても動くようにする）"""
+    try:
+        return dict(st.secrets.get("LOCAL_STORAGE", {}))
+    except FileNotFoundError:
+        return {}
+
+
+def load_participants():
+    """精算の参加者（app.py と同じく [PARTICIPANTS] か NAME1 と NAME2）
+
+    secrets.toml がない場合や名前の設定がない場合は DEFAULT_PARTICIPANTS。
+    """
+    try:
+        if "PARTICIPANTS" in st.secrets:
+            return list(st.secrets.PARTICIPANTS)
+        if "NAME1" in st.secrets and "NAME2" in st.secrets:
+            return [st.secrets.NAME1, st.secrets.NAME2]
+    except FileNotFoundError:
+        pass
+    return list(DEFAULT_PARTICIPANTS)
+
+
+@st.cache_resource(show_spinner=False)
+def get_expense_log(path, legacy_csv=None):
+    """プロセス内のセッションで共有するログを返す"""
+    return ExpenseLog(path, legacy_csv=legacy_csv)
+
+
+@st.cache_resource(show_spinner=False)
+def get_parquet_store(root):
+    """プロセス内のセッションで共有する Parquet の保存先を返す"""
+    return ParquetExpenseStore(root)
+
+
+def get_table_expense_store(backend, name=TABLE_STORE_NAME):
+    """table_store の保存先（プロセス内で共有）を使う保存先を返す
+
+    保存先には人ごとの合計の表（balances.BALANCE_TABLE）も置く。
+    """
+    store = get_table_store(name, {"expense": 0,
+                                   BALANCE_TABLE: BALANCE_SHEET},
+                            _schemas={"expense": TABLE_SCHEMA},
+                            create_missing=True, backend=backend)
+    return TableExpenseStore(store)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+app_local_save.py のデータを Parquet 形式の保存先に移行するユーティリティ
+
+使用方法：
+1. python migrate_local_data.py を実行
+   （household_data.csv か household_data.jsonl の内容を household_data/ に書き込む）
+   jsonl は精算済みの行も移行し、最後の精算の区切りを引き継ぐ
+   （ログを書き直したときに取り除かれた精算済みの行は残っていない）
+2. secrets.toml に以下を追加してアプリを再起動
+   [LOCAL_STORAGE]
+   BACKEND = "parquet"
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+
+from local_storage import COLUMNS, ParquetExpenseStore
+
+
+def read_log(path):
+    """追記専用ログの全支出と、最後の精算より前の行数を返す"""
+    rows = []
+    settled = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event.get("type") == "settle":
+                settled = len(rows)
+            else:
+                rows.append([event.get(col) for col in COLUMNS])
+    return pd.DataFrame(rows, columns=COLUMNS), settled
+
+
+def read_source(path):
+    """移行元の支出一覧（Person, Date, Amount）と精算済みの行数を読み込む"""
+    if path.endswith(".jsonl"):
+        return read_log(path)
+    return pd.read_csv(path)[COLUMNS], 0
+
+
+def migrate(source, target):
+    store = ParquetExpenseStore(target)
+    if store.frame().shape[0] or store.settled_at():
+        print(f"⚠️  {target} にはすでにデータがあります。移行を中止しました。")
+        return 1
+
+    data, settled = read_source(source)
+    # 元のファイルの並び順を保つよう、記録時刻を1ナノ秒ずつずらす
+    start = time.time_ns()
+    rows = [
+        (row.Person, pd.Timestamp(row.Date).date(), int(row.Amount), start + i)
+        for i, row in enumerate(data.itertuples(index=False))
+    ]
+    if rows:
+        store.write_rows(rows)
+    if settled:
+        # 精算済みの最後の行の記録時刻を精算時刻にする
+        store.settle(at=start + settled - 1)
+    store.compact()
+
+    print(f"{source} から {len(rows)} 件（うち精算済み {settled} 件）を"
+          f" {target} に移行しました。")
+    print()
+    print("secrets.tomlに以下を追加してください:")
+    print("[LOCAL_STORAGE]")
+    print('BACKEND = "parquet"')
+    if target != "household_data":
+        print(f'PATH = "{target}"')
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--source",
+        help="移行元（household_data.csv または household_data.jsonl）。"
+             "省略時は存在するほう（両方あれば jsonl）",
+    )
+    parser.add_argument("--target", default="household_data",
+                        help="移行先のディレクトリ（既定: household_data）")
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        source = next((path for path in ("household_data.jsonl",
+                                         "household_data.csv")
+                       if os.path.exists(path)), None)
+    if source is None or not os.path.exists(source):
+        print("移行元のファイルが見つかりません。")
+        return 1
+    return migrate(source, args.target)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
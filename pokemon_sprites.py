@@ -0,0 +1,195 @@
+"""精算履歴タブに表示するポケモン画像の取得とキャッシュ
+
+PokeAPI へのアクセスはすべてバックグラウンドで行い、画面の描画では
+ディスクに保存済みのデータだけを使う。API が遅い・つながらない場合でも
+ページの表示は待たされない。
+"""
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+
+POKEAPI_BASE_URL = "https://pokeapi.co/api/v2"
+CACHE_DIR = os.path.join(".cache", "pokemon")
+# キャッシュ全体の上限（超えたら古く使われたものから削除）
+MAX_CACHE_BYTES = 20 * 1024 * 1024
+# (接続, 読み込み) のタイムアウト秒数
+REQUEST_TIMEOUT = (3.05, 5)
+MAX_POKEMON_ID = 800
+
+
+class PokemonCache:
+    """メタデータ(JSON)と画像をディスクに保存するサイズ上限付き LRU キャッシュ"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _meta_path(self, pokemon_id):
+        return os.path.join(self.cache_dir, f"{pokemon_id}.json")
+
+    def _image_path(self, pokemon_id):
+        return os.path.join(self.cache_dir, f"{pokemon_id}.img")
+
+    def cached_ids(self):
+        return [int(name[:-5]) for name in os.listdir(self.cache_dir)
+                if name.endswith(".json")]
+
+    def contains(self, pokemon_id):
+        return os.path.exists(self._meta_path(pokemon_id))
+
+    def get(self, pokemon_id):
+        """キャッシュ済みなら {"id", "name", "image"} を返す（なければ None）"""
+        meta_path = self._meta_path(pokemon_id)
+        image_path = self._image_path(pokemon_id)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                pokemon = json.load(f)
+            with open(image_path, "rb") as f:
+                pokemon["image"] = f.read()
+        except (OSError, ValueError):
+            return None
+        # 最終利用日時を更新（LRU の順序に使う）
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        return pokemon
+
+    def put(self, pokemon_id, name, image):
+        with self._lock:
+            # 画像を先に書き、メタデータの存在をもって完了とみなす
+            self._write_atomic(self._image_path(pokemon_id), image)
+            meta = json.dumps({"id": pokemon_id, "name": name},
+                              ensure_ascii=False).encode("utf-8")
+            self._write_atomic(self._meta_path(pokemon_id), meta)
+            self._evict()
+
+    def _write_atomic(self, path, content):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for pokemon_id in self.cached_ids():
+            paths = [self._meta_path(pokemon_id), self._image_path(pokemon_id)]
+            try:
+                size = sum(os.path.getsize(p) for p in paths)
+                used_at = os.path.getmtime(paths[0])
+            except OSError:
+                continue
+            entries.append((used_at, size, paths))
+            total += size
+        for _, size, paths in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+class PokemonLoader:
+    """PokeAPI からの取得をバックグラウンドで行うローダー"""
+
+    def __init__(self, cache, base_url=POKEAPI_BASE_URL,
+                 timeout=REQUEST_TIMEOUT, max_id=MAX_POKEMON_ID):
+        self.cache = cache
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_id = max_id
+        # 接続を使い回すためのセッション
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._next_id = None
+        self._pending = {}
+
+    def fetch(self, pokemon_id):
+        """ポケモン1匹分のデータと画像を取得してキャッシュに保存"""
+        response = self.session.get(f"{self.base_url}/pokemon/{pokemon_id}",
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        response_sp = self.session.get(data["species"]["url"],
+                                       timeout=self.timeout)
+        response_sp.raise_for_status()
+        name = response_sp.json()["names"][0]["name"]
+
+        sprites = data["sprites"]
+        image_url = (sprites["other"]["showdown"]["front_default"]
+                     or sprites["front_default"])
+        response_img = self.session.get(image_url, timeout=self.timeout)
+        response_img.raise_for_status()
+        self.cache.put(pokemon_id, name, response_img.content)
+
+    def _fetch_quietly(self, pokemon_id):
+        try:
+            self.fetch(pokemon_id)
+        except (requests.RequestException, KeyError, TypeError, ValueError):
+            # 取得できなくても表示側はキャッシュ済みのものを使う
+            pass
+        finally:
+            with self._lock:
+                self._pending.pop(pokemon_id, None)
+
+    def prefetch(self, pokemon_id):
+        """未取得のポケモンをバックグラウンドで取得する"""
+        with self._lock:
+            if pokemon_id in self._pending:
+                return
+            if self.cache.contains(pokemon_id):
+                return
+            self._pending[pokemon_id] = self._executor.submit(
+                self._fetch_quietly, pokemon_id
+            )
+
+    def random_pokemon(self):
+        """すぐに表示できるポケモンを返し、次の1匹を先読みする
+
+        先読みが終わっていればそれを、まだならキャッシュ済みの中から
+        ランダムに返す。何もキャッシュされていなければ None。
+        """
+        pokemon = None
+        if self._next_id is not None:
+            pokemon = self.cache.get(self._next_id)
+        if pokemon is None:
+            cached_ids = self.cache.cached_ids()
+            if cached_ids:
+                pokemon = self.cache.get(random.choice(cached_ids))
+
+        # 先読み中でなければ（表示済み・失敗・未選択）次の1匹を選び直す
+        with self._lock:
+            pending = self._next_id in self._pending
+        if not pending:
+            self._next_id = random.randint(1, self.max_id)
+        self.prefetch(self._next_id)
+        return pokemon
+
+
+@st.cache_resource(show_spinner=False)
+def get_pokemon_loader():
+    """プロセス全体で共有するローダーを返す"""
+    pokemon_config = st.secrets.get("POKEMON", {})
+    cache = PokemonCache(
+        pokemon_config.get("CACHE_DIR", CACHE_DIR),
+        pokemon_config.get("MAX_CACHE_BYTES", MAX_CACHE_BYTES),
+    )
+    return PokemonLoader(
+        cache, base_url=pokemon_config.get("BASE_URL", POKEAPI_BASE_URL)
+    )
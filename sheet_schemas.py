@@ -0,0 +1,175 @@
+"""ワークシートのスキーマ（列名と型）と型付きの読み書き
+
+Sheets から受け取った2次元リストを列ごとに変換し、日付は datetime64、
+金額は整数、分類は category 型のデータフレームにする。辞書のリストから
+作る場合に比べて作成が速く、メモリも少なくて済む。
+書き込むときは Schema.rows() でシートに書く値（日付は文字列）に戻す。
+"""
+import pandas as pd
+import streamlit as st
+from pandas.api.types import union_categoricals
+
+# スプレッドシートの日付シリアル値の起点
+SERIAL_ORIGIN = pd.Timestamp("1899-12-30")
+
+
+class SchemaError(ValueError):
+    """シートのヘッダーがスキーマと一致しない"""
+
+
+def _is_serial(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _to_datetime(values):
+    series = pd.Series(values, dtype=object)
+    result = pd.to_datetime(series, errors="coerce", format="ISO8601")
+    # ISO 8601 で読めなかったものだけを個別に扱う
+    failed = result.isna() & (series != "")
+    if failed.any():
+        rest = series[failed]
+        # 手入力された日付は UNFORMATTED_VALUE ではシリアル値で返る
+        serial = rest.map(_is_serial).astype(bool)
+        if serial.any():
+            result[rest.index[serial]] = SERIAL_ORIGIN + pd.to_timedelta(
+                rest[serial].astype(float), unit="D"
+            )
+        # 2024/1/5 などの書式は1件ずつ解釈する
+        text = rest[~serial]
+        if not text.empty:
+            result[text.index] = pd.to_datetime(
+                text.astype(str), errors="coerce", format="mixed"
+            )
+    return result
+
+
+def _to_number(values):
+    # 空文字は欠損になる
+    return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+
+
+class Column:
+    """スキーマの1列
+
+    dtype は "datetime" / "Int32" / "Int64" / "float" / "category" / "text"。
+    required=False の列はシートになくてもエラーにしない。
+    date_format は書き込み時の日付の書式。
+    """
+
+    def __init__(self, name, dtype="text", required=True,
+                 date_format="%Y-%m-%d"):
+        self.name = name
+        self.dtype = dtype
+        self.required = required
+        self.date_format = date_format
+
+    def convert(self, values):
+        if self.dtype == "datetime":
+            return _to_datetime(values)
+        if self.dtype in ("Int32", "Int64"):
+            return _to_number(values).round().astype(self.dtype)
+        if self.dtype == "float":
+            return _to_number(values).astype("float64")
+        if self.dtype == "category":
+            return pd.Series(values, dtype=object).astype("category")
+        return pd.Series(values, dtype=str)
+
+    def serialize(self, series):
+        """シートに書く値のリストに戻す（欠損は None）"""
+        if self.dtype == "datetime" and \
+                pd.api.types.is_datetime64_any_dtype(series):
+            text = series.dt.strftime(self.date_format)
+            return [None if pd.isna(v) else v for v in text]
+        return [None if pd.isna(v) else v for v in series.astype(object)]
+
+
+class Schema:
+    """ワークシート1枚分の列の定義"""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self._by_name = {column.name: column for column in self.columns}
+
+    @property
+    def names(self):
+        return [column.name for column in self.columns]
+
+    def validate(self, header):
+        missing = [column.name for column in self.columns
+                   if column.required and column.name not in header]
+        if missing:
+            raise SchemaError(
+                f"シートに必要な列がありません: {', '.join(missing)}"
+                f"（ヘッダー: {', '.join(map(str, header))}）"
+            )
+
+    def empty(self):
+        return self.frame([self.names])
+
+    def frame(self, values):
+        """1行目をヘッダーとして2次元リストから型付きのデータフレームを作成"""
+        if not values:
+            return self.empty()
+        header = [str(name) for name in values[0]]
+        self.validate(header)
+        width = len(header)
+        rows = values[1:]
+        # 末尾の空セルはAPIから返されないため空文字で埋める
+        if any(len(row) != width for row in rows):
+            rows = [list(row[:width]) + [""] * (width - len(row))
+                    for row in rows]
+        columns = list(zip(*rows)) if rows else [()] * width
+        data = {}
+        for i, (name, column_values) in enumerate(zip(header, columns)):
+            column = self._by_name.get(name)
+            data[i] = (column.convert(column_values) if column
+                       else pd.Series(column_values, dtype=object))
+        frame = pd.DataFrame(data)
+        frame.columns = header
+        return frame
+
+    def rows(self, frame):
+        """データフレームをシートに書く行（2次元リスト）に戻す"""
+        columns = []
+        for name in frame.columns:
+            column = self._by_name.get(name, Column(name))
+            columns.append(column.serialize(frame[name]))
+        return [list(row) for row in zip(*columns)]
+
+    def concat(self, frames):
+        """型を保ったまま縦に連結する（category は分類の和集合をとる）"""
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return self.empty()
+        if len(frames) == 1:
+            return frames[0]
+        result = pd.concat(frames, ignore_index=True)
+        for name in result.columns:
+            column = self._by_name.get(name)
+            if column is None or column.dtype != "category":
+                continue
+            parts = [frame[name] for frame in frames if name in frame]
+            if len(parts) == len(frames) and all(
+                    isinstance(part.dtype, pd.CategoricalDtype)
+                    for part in parts):
+                result[name] = pd.Series(
+                    union_categoricals(parts, ignore_order=True),
+                    index=result.index,
+                )
+        return result
+
+
+def memory_report(frames):
+    """{名前: データフレーム} の行数と使用メモリを表にする"""
+    return pd.DataFrame([
+        {"シート": name,
+         "行数": len(frame),
+         "メモリ (KB)": round(frame.memory_usage(deep=True).sum() / 1024, 1)}
+        for name, frame in frames.items()
+    ])
+
+
+def show_memory_report(frames):
+    """サイドバーに読み込み済みデータの使用メモリを表示する"""
+    with st.sidebar.expander("データのメモリ"):
+        st.dataframe(memory_report(frames), hide_index=True)
@@ -0,0 +1,230 @@
+"""ワークシートの読み込み結果をプロセス内でキャッシュするレイヤー
+
+Streamlit は入力のたびにスクリプト全体を再実行するため、読み込み結果を
+TTL 付きで保持し、このアプリが書き込んだときだけ明示的に破棄する。
+"""
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from gspread.utils import rowcol_to_a1
+
+from sheets_client import frame_from_values
+
+# secrets.toml の [CACHE] TTL_SECONDS で変更可
+DEFAULT_TTL_SECONDS = 300
+# ヘッダーがまだ分からないときに読む列の範囲
+DEFAULT_LAST_COLUMN = "Z"
+
+
+def worksheet_key(worksheet):
+    """キャッシュのキー（スプレッドシートID, ワークシートID）を返す"""
+    return (worksheet.spreadsheet_id, worksheet.id)
+
+
+class TailFrame:
+    """行が増える一方のシートを、未取得の末尾だけ読み足して保持する
+
+    synced_rows はヘッダーを含めて取り込み済みのシート上の行数。
+    schema を渡すと読み足した行も同じ型で連結する。
+    """
+
+    def __init__(self, schema=None):
+        self.schema = schema
+        self.header = None
+        self.frame = schema.empty() if schema is not None else pd.DataFrame()
+        self.synced_rows = 0
+        self._lock = threading.Lock()
+
+    def next_range(self):
+        """まだ取り込んでいない行の A1 範囲を返す"""
+        with self._lock:
+            start_row = self.synced_rows + 1
+            if self.header:
+                last_column = rowcol_to_a1(1, len(self.header))[:-1]
+            else:
+                last_column = DEFAULT_LAST_COLUMN
+            return start_row, f"A{start_row}:{last_column}"
+
+    def merge(self, start_row, values):
+        """next_range() の範囲で取得した値を取り込み、全体のデータフレームを返す
+
+        他のセッションが先に同じ範囲を取り込んでいた場合は何もしない。
+        """
+        with self._lock:
+            if start_row != self.synced_rows + 1 or not values:
+                return self.frame
+            if self.header is None:
+                self.frame = frame_from_values(values, self.schema)
+                self.header = values[0]
+            else:
+                new_frame = frame_from_values([self.header] + values,
+                                              self.schema)
+                if self.schema is not None:
+                    self.frame = self.schema.concat([self.frame, new_frame])
+                else:
+                    self.frame = pd.concat([self.frame, new_frame],
+                                           ignore_index=True)
+            self.synced_rows += len(values)
+            return self.frame
+
+
+class FrameCache:
+    """キーごとにデータフレームを保持する TTL 付きキャッシュ
+
+    返すデータフレームは共有されるため、呼び出し側で破壊的に変更しないこと。
+    読み込みの途中で破棄・書き込みがあったキーは、その読み込み結果を
+    保存しない（書き込み前の値が TTL の間残らないようにする）。
+    """
+
+    def __init__(self, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        # ヘッダー行があると確認済みのキー（データの破棄とは独立に保持）
+        self._header_keys = set()
+        # 差分読み込みするシートの取り込み状態
+        self._tails = {}
+        # キーごとの破棄・書き込みの回数（全体の破棄は _epoch）
+        self._generations = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _fresh_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, frame = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        return frame
+
+    def _generation(self, key):
+        return (self._epoch, self._generations.get(key, 0))
+
+    def _changed(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _put_loaded(self, key, frame, generation):
+        # 読み込みを始めてから破棄・書き込みがあれば保存しない
+        with self._lock:
+            if self._generation(key) == generation:
+                self._entries[key] = (time.monotonic(), frame)
+
+    def get(self, key, loader):
+        """キャッシュがあれば返し、なければ loader() の結果を保存して返す"""
+        with self._lock:
+            frame = self._fresh_entry(key)
+            if frame is not None:
+                self.hits += 1
+                return frame
+            self.misses += 1
+            generation = self._generation(key)
+        frame = loader()
+        self._put_loaded(key, frame, generation)
+        return frame
+
+    def get_many(self, keys, loader):
+        """複数キーをまとめて取得する
+
+        キャッシュにないキーだけを loader(missing_keys) でまとめて読み込む。
+        loader は {キー: データフレーム} を返すこと。
+        """
+        frames = {}
+        generations = {}
+        with self._lock:
+            for key in keys:
+                frame = self._fresh_entry(key)
+                if frame is None:
+                    self.misses += 1
+                    generations[key] = self._generation(key)
+                else:
+                    self.hits += 1
+                    frames[key] = frame
+        missing = [key for key in keys if key not in frames]
+        if missing:
+            for key, frame in loader(missing).items():
+                self._put_loaded(key, frame, generations[key])
+                frames[key] = frame
+        return frames
+
+    def put(self, key, frame):
+        """書き込んだ内容で置き換える（実行中の読み込みの結果は保存しない）"""
+        with self._lock:
+            self._changed(key)
+            self._entries[key] = (time.monotonic(), frame)
+
+    def update(self, key, func):
+        """キャッシュ済みのデータフレームに func を適用して置き換える
+
+        キャッシュがない場合は何もしない（次回の読み込みで取得される）。
+        """
+        with self._lock:
+            self._changed(key)
+            frame = self._fresh_entry(key)
+            if frame is None:
+                return None
+            stored_at, _ = self._entries[key]
+            frame = func(frame)
+            self._entries[key] = (stored_at, frame)
+            return frame
+
+    def tail(self, key, schema=None):
+        """差分読み込み用の TailFrame を返す（なければ作成）"""
+        with self._lock:
+            tail = self._tails.get(key)
+            if tail is None:
+                tail = self._tails[key] = TailFrame(schema)
+            return tail
+
+    def peek(self, key):
+        """キャッシュ済みのデータフレームを返す（なければ None、統計は数えない）"""
+        with self._lock:
+            return self._fresh_entry(key)
+
+    def invalidate(self, key=None):
+        """指定キー（省略時はすべて）のキャッシュを破棄する
+
+        キー指定の場合、差分読み込みの状態は残るので次回は末尾だけを読む。
+        すべて破棄した場合は差分読み込みの状態もリセットする。
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._tails.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(key, None)
+                self._changed(key)
+            self.invalidations += 1
+
+    def header_present(self, key):
+        with self._lock:
+            return key in self._header_keys
+
+    def mark_header(self, key, present=True):
+        with self._lock:
+            if present:
+                self._header_keys.add(key)
+            else:
+                self._header_keys.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
+
+
+@st.cache_resource(show_spinner=False)
+def get_frame_cache():
+    """プロセス全体で共有するキャッシュを返す"""
+    cache_config = st.secrets.get("CACHE", {})
+    return FrameCache(cache_config.get("TTL_SECONDS", DEFAULT_TTL_SECONDS))
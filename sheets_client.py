@@ -0,0 +1,357 @@
+"""Google Sheets 接続の共有レイヤー
+
+プロセス内で gspread クライアントを 1 つだけ生成し、HTTP セッション・
+アクセストークン・スプレッドシート／ワークシートのハンドルを再利用する。
+Streamlit の再実行ごとに認証やファイル名検索が走らないようにするためのもの。
+"""
+import datetime
+import numbers
+import threading
+
+import gspread
+import pandas as pd
+import streamlit as st
+from google.auth.transport.requests import Request
+from gspread.utils import absolute_range_name
+from oauth2client.service_account import ServiceAccountCredentials
+
+from api_scheduler import scheduled
+from tracing import span
+
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
+
+# アクセストークンの有効期限がこの秒数以内に迫ったら事前に更新する
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+
+def _utcnow():
+    # google-auth の expiry は tz なしの UTC で保持されている
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class SheetsConnection:
+    """認証済みクライアントとシートのハンドルを保持する接続クラス"""
+
+    def __init__(self, credentials=None,
+                 refresh_margin_seconds=TOKEN_REFRESH_MARGIN_SECONDS,
+                 client=None, create_missing=False):
+        # client を渡した場合（fake_sheets など）はトークンを管理しない
+        self._manage_token = client is None
+        # 存在しないスプレッドシートを開こうとしたときに作成するか
+        self._create_missing = create_missing
+        self._client = client or gspread.authorize(credentials)
+        self._refresh_margin = datetime.timedelta(
+            seconds=refresh_margin_seconds
+        )
+        self._lock = threading.RLock()
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self.token_refresh_count = 0
+
+    @property
+    def client(self):
+        """トークンの期限を確認したうえで gspread クライアントを返す"""
+        self._refresh_token_if_needed()
+        return self._client
+
+    def _token_is_fresh(self, auth):
+        if not auth.token or auth.expiry is None:
+            return False
+        return auth.expiry - _utcnow() > self._refresh_margin
+
+    def _refresh_token_if_needed(self):
+        if not self._manage_token:
+            return
+        http_client = self._client.http_client
+        if self._token_is_fresh(http_client.auth):
+            return
+        with self._lock:
+            # 他のスレッドが先に更新していれば何もしない
+            if self._token_is_fresh(http_client.auth):
+                return
+            with span("oauth.refresh"):
+                http_client.auth.refresh(Request(http_client.session))
+            self.token_refresh_count += 1
+
+    def spreadsheet(self, sheet_name, create=False):
+        """名前でスプレッドシートを開く（2回目以降はキャッシュを返す）
+
+        create=True なら存在しない場合に作成する。
+        """
+        with self._lock:
+            spreadsheet = self._spreadsheets.get(sheet_name)
+            if spreadsheet is None:
+                try:
+                    spreadsheet = scheduled(self.client.open, sheet_name)
+                except gspread.SpreadsheetNotFound:
+                    if not (create or self._create_missing):
+                        raise
+                    spreadsheet = scheduled(self.client.create, sheet_name,
+                                            idempotent=False)
+                self._spreadsheets[sheet_name] = spreadsheet
+            return spreadsheet
+
+    def worksheet(self, sheet_name, key=0, create=False):
+        """ワークシートを取得する
+
+        key が int ならインデックス、str ならシート名として扱う。
+        シート名で指定したワークシートが存在しない場合は作成する。
+        create=True ならスプレッドシートがない場合も作成する。
+        """
+        cache_key = (sheet_name, key)
+        with self._lock:
+            worksheet = self._worksheets.get(cache_key)
+            if worksheet is not None:
+                self._refresh_token_if_needed()
+                return worksheet
+
+            spreadsheet = self.spreadsheet(sheet_name, create=create)
+            self._refresh_token_if_needed()
+            if isinstance(key, int):
+                worksheet = scheduled(spreadsheet.get_worksheet, key)
+            else:
+                try:
+                    worksheet = scheduled(spreadsheet.worksheet, key)
+                except gspread.exceptions.WorksheetNotFound:
+                    worksheet = scheduled(
+                        spreadsheet.add_worksheet, title=key, rows=1000,
+                        cols=20, idempotent=False,
+                    )
+            self._worksheets[cache_key] = worksheet
+            return worksheet
+
+    def forget(self, sheet_name):
+        """スプレッドシートに紐づくハンドルを破棄する（シート構成の変更時など）"""
+        with self._lock:
+            self._spreadsheets.pop(sheet_name, None)
+            for cache_key in [k for k in self._worksheets
+                              if k[0] == sheet_name]:
+                del self._worksheets[cache_key]
+
+
+_write_generations = {}
+_write_generations_lock = threading.Lock()
+
+
+def mark_written(spreadsheet_id):
+    """書き込みが終わった（失敗を含む）ことを記録する
+
+    これより前に始まった読み込みは、書き込み前の値を返すことがあるため、
+    以降の読み込みはそれと1回にまとめない。
+    """
+    with _write_generations_lock:
+        _write_generations[spreadsheet_id] = (
+            _write_generations.get(spreadsheet_id, 0) + 1)
+
+
+def write_generation(spreadsheet_id):
+    with _write_generations_lock:
+        return _write_generations.get(spreadsheet_id, 0)
+
+
+def batch_get_values(worksheets, ranges=None):
+    """同じスプレッドシート内の複数ワークシートの値を1回のAPI呼び出しで取得
+
+    ranges にはワークシートごとの A1 範囲（None ならシート全体）を指定する。
+    数値は数値のまま受け取るため UNFORMATTED_VALUE で取得する。
+    """
+    spreadsheet = worksheets[0].spreadsheet
+    if ranges is None:
+        ranges = [None] * len(worksheets)
+    ranges = [absolute_range_name(ws.title, range_name)
+              for ws, range_name in zip(worksheets, ranges)]
+    response = scheduled(
+        spreadsheet.values_batch_get,
+        ranges,
+        params={"valueRenderOption": "UNFORMATTED_VALUE"},
+        # 同じ範囲の同時読み込み（複数セッション・ミラーの同期）は1回にまとめる
+        # （書き込みをまたいだ読み込みはまとめない）
+        coalesce_key=("values.batchGet", spreadsheet.id,
+                      write_generation(spreadsheet.id), tuple(ranges)),
+    )
+    return [value_range.get("values", [])
+            for value_range in response.get("valueRanges", [])]
+
+
+def frame_from_values(values, schema=None):
+    """1行目をヘッダーとして2次元リストからデータフレームを作成
+
+    schema（sheet_schemas.Schema）を渡すと列ごとに型を変換する。
+    """
+    if schema is not None:
+        return schema.frame(values)
+    if not values:
+        return pd.DataFrame()
+    header = values[0]
+    width = len(header)
+    # 末尾の空セルはAPIから返されないため空文字で埋める
+    rows = [row[:width] + [""] * (width - len(row)) for row in values[1:]]
+    return pd.DataFrame(rows, columns=header)
+
+
+def _cell_data(value):
+    # RAW 書き込みと同じく、文字列は文字列のまま・数値は数値として書き込む
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, numbers.Number):
+        return {"userEnteredValue": {"numberValue": float(value)}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+
+def _row_data(values):
+    return {"values": [_cell_data(value) for value in values]}
+
+
+def append_cells_request(worksheet, rows):
+    """batchUpdate 用: データのある最終行の後ろに行を追加するリクエスト"""
+    return {
+        "appendCells": {
+            "sheetId": worksheet.id,
+            "rows": [_row_data(row) for row in rows],
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+def update_rows_request(worksheet, row_index, rows):
+    """batchUpdate 用: 指定行（0始まり）から rows で上書きするリクエスト"""
+    return {
+        "updateCells": {
+            "start": {"sheetId": worksheet.id, "rowIndex": row_index,
+                      "columnIndex": 0},
+            "rows": [_row_data(row) for row in rows],
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+def clear_rows_request(worksheet, start_row_index):
+    """batchUpdate 用: 指定行（0始まり）以降の値を消去するリクエスト"""
+    return {
+        "updateCells": {
+            "range": {"sheetId": worksheet.id,
+                      "startRowIndex": start_row_index},
+            "fields": "userEnteredValue",
+        }
+    }
+
+
+def write_requests(writes):
+    """書き込み操作の一覧を batchUpdate 用のリクエストに変換
+
+    writes は (操作, ワークシート, 行の2次元リスト) のリスト。
+    操作は "append"（末尾に追加）か "replace"（シート全体を置き換え）。
+    """
+    requests = []
+    for op, worksheet, rows in writes:
+        if op == "replace":
+            requests.append(clear_rows_request(worksheet, 0))
+            if rows:
+                requests.append(update_rows_request(worksheet, 0, rows))
+        elif op == "append":
+            if rows:
+                requests.append(append_cells_request(worksheet, rows))
+        else:
+            raise ValueError(f"未対応の書き込み操作です: {op}")
+    return requests
+
+
+def execute_writes(writes):
+    """書き込み操作をまとめて1回の batchUpdate で実行する
+
+    batchUpdate はすべて反映されるか何も反映されないかのどちらかになる。
+    行の追加（appendCells）を含む場合は、再送すると行が重複するため
+    自動では再試行しない（appends_applied で反映済みかを確かめる）。
+    """
+    requests = write_requests(writes)
+    if not requests:
+        return
+    spreadsheet = writes[0][1].spreadsheet
+    try:
+        scheduled(spreadsheet.batch_update, {"requests": requests},
+                  idempotent=not any(op == "append" and rows
+                                     for op, _, rows in writes))
+    finally:
+        mark_written(spreadsheet.id)
+
+
+def _blank(value):
+    return (value is None or value == ""
+            or (not isinstance(value, str) and pd.isna(value)))
+
+
+def _same_cell(expected, actual):
+    if _blank(expected) or _blank(actual):
+        return _blank(expected) and _blank(actual)
+    if (isinstance(expected, numbers.Number)
+            and isinstance(actual, numbers.Number)):
+        return float(expected) == float(actual)
+    return str(expected) == str(actual)
+
+
+def _same_rows(expected, actual):
+    if len(expected) != len(actual):
+        return False
+    for expected_row, actual_row in zip(expected, actual):
+        width = max(len(expected_row), len(actual_row))
+        expected_row = list(expected_row) + [""] * (width - len(expected_row))
+        actual_row = list(actual_row) + [""] * (width - len(actual_row))
+        if not all(map(_same_cell, expected_row, actual_row)):
+            return False
+    return True
+
+
+def appends_applied(writes):
+    """writes の追加行が、すでに各シートの末尾にあるかを確かめる
+
+    タイムアウトや 5xx で結果が分からなかった追加を送り直す前に使う。
+    A 列に値のある最終行までを末尾とみなす。
+    """
+    appended = {}
+    worksheets = {}
+    for op, worksheet, rows in writes:
+        if op == "append" and rows:
+            appended.setdefault(worksheet.id, []).extend(list(row)
+                                                         for row in rows)
+            worksheets[worksheet.id] = worksheet
+    if not appended:
+        return False
+    sheets = list(worksheets.values())
+    columns = batch_get_values(sheets, ["A:A"] * len(sheets))
+    ranges = []
+    for worksheet, column in zip(sheets, columns):
+        rows = appended[worksheet.id]
+        if len(column) < len(rows):
+            return False
+        ranges.append(f"A{len(column) - len(rows) + 1}:ZZ{len(column)}")
+    tails = batch_get_values(sheets, ranges)
+    return all(_same_rows(appended[worksheet.id], tail)
+               for worksheet, tail in zip(sheets, tails))
+
+
+def load_service_account_credentials():
+    """secrets.toml のサービスアカウント情報から認証情報を作成"""
+    google_credentials = st.secrets["GOOGLE_CREDENTIALS"]
+    return ServiceAccountCredentials.from_json_keyfile_dict(
+        google_credentials, SCOPE
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheets_connection():
+    """プロセス全体で共有する Google Sheets 接続を返す
+
+    secrets.toml の [SHEETS] BACKEND = "fake" でオフライン用の代替を使う。
+    """
+    sheets_config = st.secrets.get("SHEETS", {})
+    if sheets_config.get("BACKEND") == "fake":
+        from fake_sheets import get_fake_client
+
+        client = get_fake_client(sheets_config.get("FAKE_LATENCY_SECONDS", 0.0))
+        return SheetsConnection(client=client, create_missing=True)
+    return SheetsConnection(load_service_account_credentials())
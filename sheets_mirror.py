@@ -0,0 +1,519 @@
+"""Google Sheets のローカル SQLite ミラー
+
+読み込みはすべてローカルの SQLite から行い、書き込みはローカルに即時反映
+したうえで送信待ち（outbox）に積む。バックグラウンドのスレッドが送信待ちを
+まとめて1回の batchUpdate で Sheets に反映し、失敗したら間隔を空けて再送する。
+再送しても反映できない書き込み（範囲の誤り・削除されたシートなどの 4xx）は
+後続の書き込みを止めないよう dead_letter に移し、画面に表示する。
+スプレッドシート1つにつき SQLite ファイルを1つ使う。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from api_scheduler import is_rejected, is_retryable
+from sheets_cache import TailFrame
+from sheets_client import appends_applied, batch_get_values, execute_writes
+
+MIRROR_DIR = ".cache"
+# Sheets 側の変更を取り込み直す間隔（秒）
+REFRESH_SECONDS = 300
+# 送信待ちを確認する間隔（秒）
+FLUSH_INTERVAL_SECONDS = 1.0
+# 1回の batchUpdate で送る送信待ちの最大件数
+FLUSH_BATCH_SIZE = 50
+# 再送間隔の上限（秒）
+MAX_BACKOFF_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet TEXT NOT NULL,
+    row_no INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (sheet, row_no)
+);
+CREATE TABLE IF NOT EXISTS sheet_meta (
+    sheet TEXT PRIMARY KEY,
+    hydrated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    writes TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    writes TEXT NOT NULL,
+    error TEXT NOT NULL,
+    failed_at REAL NOT NULL
+);
+"""
+
+
+class SheetsMirror:
+    """1つのスプレッドシートのワークシートを SQLite に保持するミラー
+
+    ワークシートはタイトルで識別する。書き込みは execute_writes と同じ
+    (操作, ワークシート, 行) 形式で受け付ける。データフレームはシートごとに
+    TailFrame で保持し、追加した行だけを連結する。tail に指定したシート
+    （行が増える一方の履歴）は、取り込み直すときも未取得の末尾だけを読む。
+    """
+
+    def __init__(self, db_path, refresh_seconds=REFRESH_SECONDS,
+                 flush_interval=FLUSH_INTERVAL_SECONDS,
+                 batch_size=FLUSH_BATCH_SIZE):
+        self.refresh_seconds = refresh_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._db = sqlite3.connect(db_path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+        # Sheets との同期（送信待ちの反映と取り込み）は同時に1つだけ行う
+        self._sync_lock = threading.RLock()
+        self._worksheets = {}
+        self._versions = {}
+        self._frames = {}
+        self._schemas = {}
+        self._tail_titles = set()
+        # 書き込みを捨てたため、Sheets の内容で全体を取り込み直すシート
+        self._resync_titles = set()
+        # 送信したが反映されたか分からない（タイムアウト・5xx）送信待ちの ID
+        self._unconfirmed = set()
+        self._wakeup = threading.Event()
+        self._retry_at = 0.0
+        self.synced_count = 0
+        self.retry_count = 0
+        self.last_error = None
+        self._worker = threading.Thread(target=self._run, daemon=True,
+                                        name="sheets-mirror")
+        self._worker.start()
+
+    # ---- 読み込み ----
+
+    def _register(self, worksheet):
+        with self._lock:
+            self._worksheets[worksheet.title] = worksheet
+
+    def _hydrated_titles(self):
+        rows = self._db.execute("SELECT sheet FROM sheet_meta").fetchall()
+        return {row[0] for row in rows}
+
+    def load(self, sheets, schemas=None, tail=()):
+        """{名前: ワークシート} を受け取り {名前: データフレーム} を返す
+
+        初めて読むワークシートだけは Sheets から1回の batchGet で取り込む。
+        schemas に {名前: スキーマ} を渡すとその型でデータフレームを作る。
+        tail に指定した名前のシートは、取り込み直すときに末尾だけを読む。
+        """
+        schemas = schemas or {}
+        with self._lock:
+            for name, worksheet in sheets.items():
+                self._worksheets[worksheet.title] = worksheet
+                self._schemas[worksheet.title] = schemas.get(name)
+                if name in tail:
+                    self._tail_titles.add(worksheet.title)
+            hydrated = self._hydrated_titles()
+        missing = [ws for ws in sheets.values() if ws.title not in hydrated]
+        if missing:
+            self._hydrate(missing)
+        return {name: self._tail(ws.title).frame
+                for name, ws in sheets.items()}
+
+    def _tail(self, title):
+        """シートのデータフレームを保持する TailFrame（なければ SQLite から作る）"""
+        with self._lock:
+            schema = self._schemas.get(title)
+            tail = self._frames.get(title)
+            if tail is not None and tail.schema is schema:
+                return tail
+            rows = self._db.execute(
+                "SELECT data FROM sheet_rows WHERE sheet = ? ORDER BY row_no",
+                (title,),
+            ).fetchall()
+            tail = TailFrame(schema)
+            tail.merge(1, [json.loads(row[0]) for row in rows])
+            self._frames[title] = tail
+            return tail
+
+    def _append_to_frame(self, title, next_row, rows):
+        # 保持しているデータフレームに追加した行だけを連結する
+        tail = self._frames.get(title)
+        if tail is None:
+            return
+        if tail.synced_rows != next_row:
+            del self._frames[title]
+            return
+        tail.merge(next_row + 1, rows)
+
+    def _bump(self, title):
+        self._versions[title] = self._versions.get(title, 0) + 1
+
+    def _hydrate(self, worksheets):
+        """Sheets の内容でローカルを置き換える
+
+        送信待ちがあるシートや、取得中にローカルへ書き込まれたシートは除く。
+        """
+        with self._sync_lock:
+            with self._lock:
+                versions = {ws.title: self._versions.get(ws.title, 0)
+                            for ws in worksheets}
+            values = batch_get_values(worksheets)
+            now = time.time()
+            with self._lock:
+                pending = self._pending_titles()
+                replaced = []
+                self._db.execute("BEGIN")
+                try:
+                    for worksheet, rows in zip(worksheets, values):
+                        title = worksheet.title
+                        if (title in pending or self._versions.get(title, 0)
+                                != versions[title]):
+                            continue
+                        self._replace_rows(title, rows)
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO sheet_meta VALUES (?, ?)",
+                            (title, now),
+                        )
+                        replaced.append(title)
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                self._db.execute("COMMIT")
+                for title in replaced:
+                    self._bump(title)
+                    self._frames.pop(title, None)
+                    self._resync_titles.discard(title)
+
+    def _hydrate_tail(self, worksheet):
+        """行が増える一方のシートの、未取得の末尾の行だけを取り込む"""
+        title = worksheet.title
+        with self._sync_lock:
+            tail = self._tail(title)
+            with self._lock:
+                version = self._versions.get(title, 0)
+            start_row, range_name = tail.next_range()
+            values = batch_get_values([worksheet], [range_name])[0]
+            with self._lock:
+                if (title in self._pending_titles()
+                        or self._versions.get(title, 0) != version
+                        or self._frames.get(title) is not tail):
+                    return
+                self._db.execute("BEGIN")
+                try:
+                    self._insert_rows(title, start_row - 1, values)
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sheet_meta VALUES (?, ?)",
+                        (title, time.time()),
+                    )
+                except BaseException:
+                    self._db.execute("ROLLBACK")
+                    raise
+                self._db.execute("COMMIT")
+                if values:
+                    self._bump(title)
+                    tail.merge(start_row, values)
+
+    def has_header(self, worksheet):
+        # まだ取り込んでいないシートは、ローカルが空でも Sheets にはヘッダーがありうる
+        self._register(worksheet)
+        with self._lock:
+            hydrated = worksheet.title in self._hydrated_titles()
+        if not hydrated:
+            self._hydrate([worksheet])
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM sheet_rows WHERE sheet = ? AND row_no = 0",
+                (worksheet.title,),
+            ).fetchone()
+            return row is not None
+
+    # ---- 書き込み ----
+
+    def _replace_rows(self, title, rows):
+        self._db.execute("DELETE FROM sheet_rows WHERE sheet = ?", (title,))
+        self._insert_rows(title, 0, rows)
+
+    def _insert_rows(self, title, start, rows):
+        self._db.executemany(
+            "INSERT INTO sheet_rows VALUES (?, ?, ?)",
+            [(title, start + i,
+              json.dumps(row, ensure_ascii=False, default=json_default))
+             for i, row in enumerate(rows)],
+        )
+
+    def commit(self, writes):
+        """書き込みをローカルに反映して送信待ちに積む（Sheets への反映は非同期）"""
+        for _, worksheet, _ in writes:
+            self._register(worksheet)
+        payload = [(op, worksheet.title, [list(row) for row in rows])
+                   for op, worksheet, rows in writes]
+        with self._lock:
+            applied = []
+            self._db.execute("BEGIN")
+            try:
+                for op, title, rows in payload:
+                    if op == "replace":
+                        self._replace_rows(title, rows)
+                        applied.append((title, None, rows))
+                    else:
+                        next_row = self._db.execute(
+                            "SELECT COALESCE(MAX(row_no) + 1, 0) "
+                            "FROM sheet_rows WHERE sheet = ?", (title,),
+                        ).fetchone()[0]
+                        self._insert_rows(title, next_row, rows)
+                        applied.append((title, next_row, rows))
+                self._db.execute(
+                    "INSERT INTO outbox (writes) VALUES (?)",
+                    (json.dumps(payload, ensure_ascii=False,
+                                default=json_default),),
+                )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            # データフレームはコミットできた書き込みだけで更新する
+            for title, next_row, rows in applied:
+                self._bump(title)
+                if next_row is None:
+                    self._frames.pop(title, None)
+                else:
+                    self._append_to_frame(title, next_row, rows)
+        self._wakeup.set()
+
+    def pending_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def _pending_titles(self):
+        titles = set()
+        for (writes,) in self._db.execute("SELECT writes FROM outbox"):
+            titles.update(title for _, title, _ in json.loads(writes))
+        return titles
+
+    # ---- バックグラウンド同期 ----
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if time.monotonic() < self._retry_at:
+                continue
+            try:
+                self.flush()
+                self._refresh_stale()
+            except Exception as e:
+                # 次の周期で再試行する（送信待ちは残っている）
+                self.last_error = str(e)
+
+    def flush(self):
+        """送信待ちをまとめて1回の batchUpdate で Sheets に反映する
+
+        batchUpdate はすべて反映されるか何も反映されないかのどちらかなので、
+        再送しても直らないエラーのときは1件ずつ送り直し、反映できない
+        書き込みだけを dead_letter に移す。
+        """
+        with self._sync_lock:
+            with self._lock:
+                entries = self._db.execute(
+                    "SELECT id, writes, attempts FROM outbox "
+                    "ORDER BY id LIMIT ?", (self.batch_size,),
+                ).fetchall()
+                worksheets = dict(self._worksheets)
+            batch = []
+            for entry_id, payload, attempts in entries:
+                entry_writes = json.loads(payload)
+                # 登録前のワークシートがあれば、順序を守るためそこで止める
+                if any(title not in worksheets for _, title, _ in entry_writes):
+                    break
+                batch.append((entry_id, attempts, entry_writes))
+            if not batch:
+                return 0
+
+            # 前回結果が分からなかった送信は、追加した行がすでにあれば送り直さない
+            unconfirmed = [entry for entry in batch
+                           if entry[0] in self._unconfirmed]
+            if unconfirmed:
+                self._unconfirmed.clear()
+                if appends_applied(self._sheet_writes(unconfirmed,
+                                                      worksheets)):
+                    self._sent(unconfirmed)
+                    batch = batch[len(unconfirmed):]
+                    if not batch:
+                        return len(unconfirmed)
+
+            try:
+                self._send(batch, worksheets)
+            except Exception as e:
+                if is_retryable(e) or len(batch) == 1:
+                    return self._failed(batch, e)
+                # どの書き込みが反映できないのかを1件ずつ送って確かめる
+                sent = 0
+                for entry in batch:
+                    try:
+                        self._send([entry], worksheets)
+                    except Exception as entry_error:
+                        if is_retryable(entry_error):
+                            self._failed([entry], entry_error)
+                            return sent
+                        self._dead_letter(entry, entry_error)
+                    else:
+                        sent += 1
+                return sent
+            return len(batch)
+
+    def _sheet_writes(self, batch, worksheets):
+        return [(op, worksheets[title], rows)
+                for _, _, entry_writes in batch
+                for op, title, rows in entry_writes]
+
+    def _send(self, batch, worksheets):
+        execute_writes(self._sheet_writes(batch, worksheets))
+        self._sent(batch)
+
+    def _sent(self, batch):
+        with self._lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?",
+                                 [(entry_id,) for entry_id, _, _ in batch])
+        self.synced_count += len(batch)
+        self.last_error = None
+
+    def _failed(self, batch, error):
+        """再送できるエラー（または1件だけの送信の失敗）の記録"""
+        if not is_retryable(error):
+            self._dead_letter(batch[0], error)
+            return 0
+        if not is_rejected(error) and any(
+                op == "append" for _, _, entry_writes in batch
+                for op, _, _ in entry_writes):
+            self._unconfirmed.update(entry_id for entry_id, _, _ in batch)
+        attempts = batch[0][1] + 1
+        with self._lock:
+            self._db.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? "
+                "WHERE id = ?", [(str(error), entry_id)
+                                 for entry_id, _, _ in batch],
+            )
+        self.retry_count += 1
+        self.last_error = str(error)
+        self._retry_at = (time.monotonic()
+                          + min(MAX_BACKOFF_SECONDS, 2 ** attempts))
+        return 0
+
+    def _dead_letter(self, entry, error):
+        """反映できない書き込みを送信待ちから外し、シートを取り込み直す"""
+        entry_id, _, entry_writes = entry
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute(
+                    "INSERT INTO dead_letter VALUES (?, ?, ?, ?)",
+                    (entry_id, json.dumps(entry_writes, ensure_ascii=False),
+                     str(error), time.time()),
+                )
+                self._db.execute("DELETE FROM outbox WHERE id = ?",
+                                 (entry_id,))
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+            # ローカルにだけある書き込みを Sheets の内容で置き換える
+            self._resync_titles.update(
+                title for _, title, _ in entry_writes)
+        self.last_error = str(error)
+
+    def _refresh_stale(self):
+        """一定時間たったワークシートを Sheets の内容で取り込み直す
+
+        tail のシートは未取得の末尾の行だけを読む。
+        """
+        threshold = time.time() - self.refresh_seconds
+        with self._lock:
+            stale = {row[0] for row in self._db.execute(
+                "SELECT sheet FROM sheet_meta WHERE hydrated_at < ?",
+                (threshold,),
+            )}
+            resync = set(self._resync_titles)
+            full = [ws for title, ws in self._worksheets.items()
+                    if title in resync
+                    or (title in stale and title not in self._tail_titles)]
+            tails = [ws for title, ws in self._worksheets.items()
+                     if title in stale and title in self._tail_titles
+                     and title not in resync]
+        if full:
+            self._hydrate(full)
+        for worksheet in tails:
+            self._hydrate_tail(worksheet)
+
+    def dead_letters(self):
+        """反映できなかった書き込みの [(シート名の一覧, エラー, 時刻)]"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT writes, error, failed_at FROM dead_letter ORDER BY id"
+            ).fetchall()
+        return [(sorted({title for _, title, _ in json.loads(writes)}),
+                 error, failed_at) for writes, error, failed_at in rows]
+
+    def stats(self):
+        with self._lock:
+            failed = self._db.execute(
+                "SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return {
+            "pending": self.pending_count(),
+            "synced": self.synced_count,
+            "retries": self.retry_count,
+            "failed": failed,
+            "last_error": self.last_error,
+        }
+
+
+def json_default(value):
+    """json.dumps の default。numpy の数値型などを JSON に変換する"""
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def sync_mode_enabled():
+    """secrets.toml の [SYNC] MODE = "mirror" のときミラーを使う"""
+    return st.secrets.get("SYNC", {}).get("MODE") == "mirror"
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheets_mirror(spreadsheet_name):
+    """スプレッドシートごとにプロセス全体で共有するミラーを返す"""
+    sync_config = st.secrets.get("SYNC", {})
+    mirror_dir = sync_config.get("DIR", MIRROR_DIR)
+    os.makedirs(mirror_dir, exist_ok=True)
+    return SheetsMirror(
+        os.path.join(mirror_dir, f"mirror_{spreadsheet_name}.sqlite3"),
+        refresh_seconds=sync_config.get("REFRESH_SECONDS", REFRESH_SECONDS),
+    )
+
+
+def show_sync_status(spreadsheet_name):
+    """サイドバーに未同期件数を表示する"""
+    mirror = get_sheets_mirror(spreadsheet_name)
+    stats = mirror.stats()
+    if stats["pending"]:
+        st.sidebar.warning(f"未同期の書き込み: {stats['pending']}件")
+    else:
+        st.sidebar.caption("Google Sheets と同期済み")
+    if stats["failed"]:
+        st.sidebar.error(
+            f"Google Sheets に反映できなかった書き込み: {stats['failed']}件"
+            "（再送しても反映できないため送信を取りやめました）"
+        )
+        with st.sidebar.expander("反映できなかった書き込み"):
+            for titles, error, failed_at in mirror.dead_letters():
+                failed = time.strftime("%Y-%m-%d %H:%M",
+                                       time.localtime(failed_at))
+                st.write(f"{failed} {', '.join(titles)}: {error}")
+    elif stats["last_error"]:
+        st.sidebar.caption(f"同期エラー（再試行します）: {stats['last_error']}")
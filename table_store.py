@@ -0,0 +1,615 @@
+"""表（ワークシート）単位の保存先の共通インターフェース
+
+アプリは表を名前で読み書きし、実際の保存先は secrets.toml の
+[STORAGE] BACKEND で切り替える。
+
+- "sheets"（既定）: Google Sheets（キャッシュ・差分読み込み・ミラーを含む）
+- "csv": 表ごとの CSV ファイル
+- "sqlite": 1つの SQLite ファイル
+- "memory": プロセス内のメモリ（動作確認・ベンチマーク用）
+
+値はシートと同じく1行目をヘッダーとする2次元リストで受け渡す。
+書き込みは (操作, 表の名前, 行) の形式で、操作は "append"（末尾に追加）か
+"replace"（全体を置き換え）。ヘッダーのない表に追加する場合は、呼び出し側が
+ヘッダー行を先頭に付ける（has_header で確認できる）。
+"""
+import contextlib
+import csv
+import itertools
+import json
+import os
+import sqlite3
+import threading
+
+import gspread
+import pandas as pd
+import streamlit as st
+
+from api_scheduler import is_rejected, is_retryable, scheduled
+from sheet_schemas import show_memory_report
+from sheets_cache import DEFAULT_LAST_COLUMN, get_frame_cache, worksheet_key
+from sheets_client import (
+    appends_applied,
+    batch_get_values,
+    execute_writes,
+    frame_from_values,
+    get_sheets_connection,
+    mark_written,
+)
+from sheets_mirror import (
+    get_sheets_mirror,
+    json_default,
+    show_sync_status,
+    sync_mode_enabled,
+)
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+BACKENDS = ("sheets", "csv", "sqlite", "memory")
+# 保存先との通信・ファイルの入出力で起きるエラー（requests の例外は OSError）
+# シートの列がスキーマと合わない SchemaError は含めない
+STORAGE_ERRORS = (OSError, sqlite3.Error, gspread.exceptions.GSpreadException)
+# csv / sqlite のファイルを置くディレクトリ（[STORAGE] DIR で変更可）
+STORAGE_DIR = ".cache/storage"
+
+
+class FileLock:
+    """ロックファイルによるプロセス間の排他（同じプロセス内はスレッドロック）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+
+    @contextlib.contextmanager
+    def hold(self, exclusive):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path, "a") as lock_file:
+                fcntl.flock(lock_file,
+                            fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class TableStore:
+    """保存先の基底クラス
+
+    実装ごとに read_values / read_range / _write を定義する。
+    読み込んだデータフレームは表の版（version）ごとに保持し、このプロセスが
+    追加した行は読み直さずに連結する。返すデータフレームは共有されるため、
+    呼び出し側で破壊的に変更しないこと。
+    """
+
+    name = "table"
+
+    def __init__(self, schemas=None):
+        self.schemas = dict(schemas or {})
+        self._lock = threading.RLock()
+        self._versions = {}
+        # 表の名前 -> (版, データフレーム, ヘッダー行 or None)
+        self._frames = {}
+
+    # ---- 実装ごとに定義する ----
+
+    def read_values(self, names):
+        """{表の名前: 2次元リスト} をまとめて読み込む"""
+        raise NotImplementedError
+
+    def read_range(self, name, start_row, end_row=None):
+        """start_row 行目から end_row 行目（1始まり・両端を含む）を読み込む"""
+        raise NotImplementedError
+
+    def _write(self, writes):
+        raise NotImplementedError
+
+    def version(self, name):
+        """表の版（このプロセス以外からの書き込みも反映できる実装は上書きする）"""
+        return self._versions.get(name, 0)
+
+    # ---- 共通の処理 ----
+
+    def _to_frame(self, name, values):
+        return frame_from_values(values, self.schemas.get(name))
+
+    def _fresh_entry(self, name):
+        entry = self._frames.get(name)
+        if entry is not None and entry[0] == self.version(name):
+            return entry
+        return None
+
+    def read_frames(self, names):
+        """{表の名前: データフレーム} を返す（変更のない表は読み直さない）"""
+        with self._lock:
+            frames = {}
+            missing = []
+            for name in names:
+                entry = self._fresh_entry(name)
+                if entry is None:
+                    missing.append(name)
+                else:
+                    frames[name] = entry[1]
+            if missing:
+                versions = {name: self.version(name) for name in missing}
+                for name, values in self.read_values(missing).items():
+                    frame = self._to_frame(name, values)
+                    header = values[0] if values else None
+                    self._frames[name] = (versions[name], frame, header)
+                    frames[name] = frame
+            return {name: frames[name] for name in names}
+
+    def read_frame(self, name):
+        return self.read_frames([name])[name]
+
+    def has_header(self, name):
+        with self._lock:
+            entry = self._fresh_entry(name)
+            if entry is not None:
+                return entry[2] is not None
+        return bool(self.read_range(name, 1, 1))
+
+    def append_rows(self, name, rows):
+        self.batch([("append", name, rows)])
+
+    def replace(self, name, rows):
+        self.batch([("replace", name, rows)])
+
+    def batch(self, writes):
+        """書き込みをまとめて実行し、保持しているデータフレームにも反映する"""
+        with self._lock:
+            entries = {name: self._fresh_entry(name) for _, name, _ in writes}
+            self._write(writes)
+            for op, name, rows in writes:
+                self._versions[name] = self._versions.get(name, 0) + 1
+                entries[name] = self._applied(entries[name], op, name, rows)
+            for name, entry in entries.items():
+                if entry is None:
+                    self._frames.pop(name, None)
+                else:
+                    self._frames[name] = (self.version(name),) + entry[1:]
+
+    def _applied(self, entry, op, name, rows):
+        if op == "replace":
+            return (None, self._to_frame(name, rows),
+                    list(rows[0]) if rows else None)
+        if op != "append":
+            raise ValueError(f"未対応の書き込み操作です: {op}")
+        if entry is None or not rows:
+            return entry
+        _, frame, header = entry
+        if header is None:
+            # ヘッダーのない表では最初の行がヘッダーになる
+            header, rows = list(rows[0]), rows[1:]
+        new_frame = self._to_frame(name, [header] + list(rows))
+        schema = self.schemas.get(name)
+        if schema is not None:
+            frame = schema.concat([frame, new_frame])
+        else:
+            frame = pd.concat([frame, new_frame], ignore_index=True)
+        return (None, frame, header)
+
+    def cached_frames(self):
+        with self._lock:
+            return {name: entry[1] for name, entry in self._frames.items()}
+
+    def invalidate(self):
+        """保持しているデータフレームを破棄する（次回は読み直す）"""
+        with self._lock:
+            self._frames.clear()
+
+    def show_status(self):
+        """サイドバーに保存先と読み込み済みデータの使用メモリを表示する"""
+        st.sidebar.caption(f"保存先: {self.name}")
+        show_memory_report(self.cached_frames())
+
+
+class MemoryStore(TableStore):
+    """プロセス内のメモリに保持する保存先"""
+
+    name = "memory"
+
+    def __init__(self, schemas=None):
+        super().__init__(schemas)
+        self._tables = {}
+
+    def read_values(self, names):
+        with self._lock:
+            return {name: [list(row) for row in self._tables.get(name, [])]
+                    for name in names}
+
+    def read_range(self, name, start_row, end_row=None):
+        with self._lock:
+            rows = self._tables.get(name, [])
+            return [list(row) for row in rows[start_row - 1:end_row]]
+
+    def _write(self, writes):
+        for op, name, rows in writes:
+            rows = [list(row) for row in rows]
+            if op == "replace":
+                self._tables[name] = rows
+            else:
+                self._tables.setdefault(name, []).extend(rows)
+
+
+class CsvStore(TableStore):
+    """表ごとに1つの CSV ファイルに保存する保存先
+
+    追加はファイル末尾への追記で、置き換えは一時ファイルに書いてから入れ替える。
+    複数の表にまたがる batch は表ごとに順に書くため、途中で失敗すると
+    それまでの書き込みだけが反映される。
+    """
+
+    name = "csv"
+
+    def __init__(self, directory, schemas=None):
+        super().__init__(schemas)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(directory, ".lock"))
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.csv")
+
+    def version(self, name):
+        # 他のプロセスが書き込んだ場合も変わるよう、ファイルの更新時刻と大きさを使う
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _read_rows(self, name, start_row=1, end_row=None):
+        try:
+            with open(self.path(name), newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                return [row for row in
+                        itertools.islice(reader, start_row - 1, end_row)]
+        except FileNotFoundError:
+            return []
+
+    def read_values(self, names):
+        with self._file_lock.hold(exclusive=False):
+            return {name: self._read_rows(name) for name in names}
+
+    def read_range(self, name, start_row, end_row=None):
+        with self._file_lock.hold(exclusive=False):
+            return self._read_rows(name, start_row, end_row)
+
+    def _write(self, writes):
+        with self._file_lock.hold(exclusive=True):
+            for op, name, rows in writes:
+                if op == "replace":
+                    temp_path = f"{self.path(name)}.{os.getpid()}.tmp"
+                    with open(temp_path, "w", newline="",
+                              encoding="utf-8") as f:
+                        csv.writer(f).writerows(rows)
+                    os.replace(temp_path, self.path(name))
+                else:
+                    with open(self.path(name), "a", newline="",
+                              encoding="utf-8") as f:
+                        csv.writer(f).writerows(rows)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS table_rows (
+    name TEXT NOT NULL,
+    row_no INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, row_no)
+);
+"""
+
+
+class SqliteStore(TableStore):
+    """1つの SQLite ファイルに保存する保存先（batch は1つのトランザクション）"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path, schemas=None):
+        super().__init__(schemas)
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SQLITE_SCHEMA)
+
+    def version(self, name):
+        # data_version は他の接続がコミットしたときに変わる
+        data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        return (data_version, self._versions.get(name, 0))
+
+    def _select(self, name, start_row=1, end_row=None):
+        rows = self._db.execute(
+            "SELECT data FROM table_rows WHERE name = ? AND row_no >= ? "
+            "AND row_no <= ? ORDER BY row_no",
+            (name, start_row - 1,
+             end_row - 1 if end_row is not None else 2**62),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def read_values(self, names):
+        with self._lock:
+            return {name: self._select(name) for name in names}
+
+    def read_range(self, name, start_row, end_row=None):
+        with self._lock:
+            return self._select(name, start_row, end_row)
+
+    def _write(self, writes):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for op, name, rows in writes:
+                if op == "replace":
+                    self._db.execute("DELETE FROM table_rows WHERE name = ?",
+                                     (name,))
+                    start = 0
+                else:
+                    start = self._db.execute(
+                        "SELECT COALESCE(MAX(row_no) + 1, 0) FROM table_rows "
+                        "WHERE name = ?", (name,),
+                    ).fetchone()[0]
+                self._db.executemany(
+                    "INSERT INTO table_rows VALUES (?, ?, ?)",
+                    [(name, start + i, json.dumps(list(row), ensure_ascii=False,
+                                                 default=json_default))
+                     for i, row in enumerate(rows)],
+                )
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+
+class SheetsStore(TableStore):
+    """Google Sheets の1つのスプレッドシートを保存先とする
+
+    tables は {表の名前: ワークシートのインデックスかシート名}。
+    読み込み結果は FrameCache（TTL 付き）に保持し、tail_tables の表は
+    未取得の末尾の行だけを読み足す。[SYNC] MODE = "mirror" のときは
+    ローカルの SQLite ミラーを読み書きし、Sheets へは裏で反映する。
+    """
+
+    name = "sheets"
+
+    def __init__(self, spreadsheet_name, tables, schemas=None, tail_tables=(),
+                 create_missing=False):
+        super().__init__(schemas)
+        self.spreadsheet_name = spreadsheet_name
+        self.tables = dict(tables)
+        self.tail_tables = set(tail_tables)
+        self.create_missing = create_missing
+
+    def worksheet(self, name):
+        connection = get_sheets_connection()
+        key = self.tables[name]
+        if not isinstance(key, int):
+            # シート名のワークシートは作成すると末尾に追加されるため、
+            # インデックスで指定した表を先に取得して位置を確定させておく
+            # （取得したワークシートは接続が保持するので2回目以降は呼ばない）
+            for other in self.tables.values():
+                if isinstance(other, int):
+                    connection.worksheet(self.spreadsheet_name, other,
+                                         create=self.create_missing)
+        return connection.worksheet(self.spreadsheet_name, key,
+                                    create=self.create_missing)
+
+    def _mirror(self):
+        if sync_mode_enabled():
+            return get_sheets_mirror(self.spreadsheet_name)
+        return None
+
+    # ---- 読み込み ----
+
+    def read_values(self, names):
+        values = batch_get_values([self.worksheet(name) for name in names])
+        return dict(zip(names, values))
+
+    def read_range(self, name, start_row, end_row=None):
+        range_name = (f"A{start_row}:{DEFAULT_LAST_COLUMN}"
+                      f"{end_row if end_row is not None else ''}")
+        return batch_get_values([self.worksheet(name)], [range_name])[0]
+
+    def read_frames(self, names):
+        sheets = {name: self.worksheet(name) for name in names}
+        mirror = self._mirror()
+        if mirror is not None:
+            with span("mirror.load"):
+                return mirror.load(sheets, self.schemas,
+                                   tail=self.tail_tables)
+        return self._load_cached(sheets)
+
+    def _load_cached(self, sheets):
+        # キャッシュにないシートだけを values:batchGet 1回で取得する
+        # tail_tables のシートは増える一方なので、未取得の末尾の行だけを読む
+        keys = {name: worksheet_key(ws) for name, ws in sheets.items()}
+        worksheets = {worksheet_key(ws): ws for ws in sheets.values()}
+        tail_keys = {keys[name] for name in sheets if name in self.tail_tables}
+        key_schemas = {keys[name]: self.schemas[name] for name in sheets
+                       if name in self.schemas}
+        cache = get_frame_cache()
+
+        def fetch(missing_keys):
+            ranges = {}
+            for key in missing_keys:
+                if key in tail_keys:
+                    ranges[key] = cache.tail(
+                        key, key_schemas.get(key)).next_range()
+            values = batch_get_values(
+                [worksheets[key] for key in missing_keys],
+                [ranges[key][1] if key in ranges else None
+                 for key in missing_keys],
+            )
+            frames = {}
+            for key, v in zip(missing_keys, values):
+                if key in ranges:
+                    tail = cache.tail(key)
+                    frames[key] = tail.merge(ranges[key][0], v)
+                    if tail.header:
+                        cache.mark_header(key)
+                else:
+                    if v:
+                        cache.mark_header(key)
+                    frames[key] = frame_from_values(v, key_schemas.get(key))
+            return frames
+
+        frames = cache.get_many(list(keys.values()), fetch)
+        return {name: frames[key] for name, key in keys.items()}
+
+    def has_header(self, name):
+        # 読むのは1行目だけで、あると分かったシートは以降APIで確認しない
+        worksheet = self.worksheet(name)
+        mirror = self._mirror()
+        if mirror is not None:
+            return mirror.has_header(worksheet)
+        cache = get_frame_cache()
+        key = worksheet_key(worksheet)
+        if cache.header_present(key):
+            return True
+        if scheduled(worksheet.row_values, 1,
+                     coalesce_key=("row_values", key, 1)):
+            cache.mark_header(key)
+            return True
+        return False
+
+    # ---- 書き込み ----
+
+    def batch(self, writes):
+        """書き込みを実行する
+
+        1件の追加は values.append、それ以外は1回の batchUpdate
+        （すべて反映されるか何も反映されないかのどちらか）で書き込む。
+        """
+        sheet_writes = [(op, self.worksheet(name), rows)
+                        for op, name, rows in writes]
+        mirror = self._mirror()
+        if mirror is not None:
+            mirror.commit(sheet_writes)
+            return
+
+        cache = get_frame_cache()
+        if len(writes) == 1 and writes[0][0] == "append":
+            _, name, rows = writes[0]
+            _, worksheet, _ = sheet_writes[0]
+            key = worksheet_key(worksheet)
+            data_rows = rows if cache.header_present(key) else rows[1:]
+
+            def append_rows():
+                try:
+                    # 再送すると行が重複するため、429 以外では再試行しない
+                    scheduled(worksheet.append_rows, rows, idempotent=False)
+                finally:
+                    mark_written(worksheet.spreadsheet_id)
+
+            self._checked_write(sheet_writes, append_rows)
+            cache.mark_header(key)
+            # 再読み込みせずにキャッシュ側へも同じ行を追加する
+            schema = self.schemas.get(name)
+
+            def append(frame):
+                new_frame = frame_from_values(
+                    [list(frame.columns)] + list(data_rows), schema)
+                if schema is not None:
+                    return schema.concat([frame, new_frame])
+                return pd.concat([frame, new_frame], ignore_index=True)
+
+            if data_rows:
+                cache.update(key, append)
+            return
+
+        self._checked_write(sheet_writes, lambda: execute_writes(sheet_writes))
+        for (op, name, rows), (_, worksheet, _) in zip(writes, sheet_writes):
+            key = worksheet_key(worksheet)
+            if op == "replace":
+                cache.put(key, frame_from_values(rows, self.schemas.get(name)))
+            else:
+                cache.invalidate(key)
+            if rows:
+                cache.mark_header(key)
+
+    def _checked_write(self, sheet_writes, write):
+        """write() を実行する
+
+        タイムアウトや 5xx で反映されたか分からない場合は、追加した行が
+        シートの末尾にあるかを確かめ、あれば成功として扱う。
+        """
+        try:
+            write()
+        except Exception as e:
+            if (is_retryable(e) and not is_rejected(e)
+                    and appends_applied(sheet_writes)):
+                return
+            # 一部でも反映されているかもしれないので次回は読み直す
+            cache = get_frame_cache()
+            for _, worksheet, _ in sheet_writes:
+                cache.invalidate(worksheet_key(worksheet))
+            raise
+
+    def cached_frames(self):
+        cache = get_frame_cache()
+        frames = {name: cache.peek(worksheet_key(self.worksheet(name)))
+                  for name in self.tables}
+        return {name: frame for name, frame in frames.items()
+                if frame is not None}
+
+    def invalidate(self):
+        cache = get_frame_cache()
+        for name in self.tables:
+            cache.invalidate(worksheet_key(self.worksheet(name)))
+
+    def show_status(self):
+        if self._mirror() is not None:
+            show_sync_status(self.spreadsheet_name)
+            return
+        cache = get_frame_cache()
+        with st.sidebar.expander("キャッシュ状況"):
+            stats = cache.stats()
+            st.write(
+                f"ヒット: {stats['hits']} / ミス: {stats['misses']} / "
+                f"破棄: {stats['invalidations']}（TTL {cache.ttl_seconds}秒）"
+            )
+            if st.button("キャッシュをクリア"):
+                cache.invalidate()
+                st.rerun()
+        show_memory_report(self.cached_frames())
+
+
+def load_storage_config():
+    """secrets.toml の [STORAGE]（secrets.toml がなくても動くようにする）"""
+    try:
+        return dict(st.secrets.get("STORAGE", {}))
+    except FileNotFoundError:
+        return {}
+
+
+@st.cache_resource(show_spinner=False)
+def get_table_store(spreadsheet_name, tables, _schemas=None, tail_tables=(),
+                    create_missing=False, backend=None):
+    """スプレッドシート（表のまとまり）ごとにプロセス全体で共有する保存先を返す
+
+    tables は {表の名前: ワークシートのインデックスかシート名}（Sheets 用）。
+    backend を省略すると [STORAGE] BACKEND（既定は "sheets"）を使う。
+    """
+    config = load_storage_config()
+    backend = backend or config.get("BACKEND", "sheets")
+    directory = config.get("DIR", STORAGE_DIR)
+    if backend == "sheets":
+        return SheetsStore(spreadsheet_name, tables, _schemas,
+                           tail_tables=tail_tables,
+                           create_missing=create_missing)
+    if backend == "csv":
+        return CsvStore(os.path.join(directory, spreadsheet_name), _schemas)
+    if backend == "sqlite":
+        os.makedirs(directory, exist_ok=True)
+        return SqliteStore(
+            os.path.join(directory, f"{spreadsheet_name}.sqlite3"), _schemas
+        )
+    if backend == "memory":
+        return MemoryStore(_schemas)
+    raise ValueError(f"未対応の保存先です: {backend}（{', '.join(BACKENDS)}）")
@@ -0,0 +1,30 @@
+"""テスト共通の設定
+
+リポジトリ直下のモジュールを import できるようにし、secrets.toml の代わりに
+一時的な設定（Sheets はメモリ上の代替、API のレート制限なし）を使う。
+"""
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECRETS = """\
+[SHEETS]
+BACKEND = "fake"
+
+[SCHEDULER.SHEETS]
+REQUESTS_PER_MINUTE = 1000000000
+BURST = 1000000000
+"""
+
+
+@pytest.fixture(scope="session", autouse=True)
+def secrets_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("secrets") / "secrets.toml"
+    path.write_text(SECRETS, encoding="utf-8")
+    st.config.set_option("secrets.files", [str(path)])
+    return path
@@ -0,0 +1,59 @@
+import pytest
+
+from api_scheduler import RequestScheduler
+from fake_sheets import FakeClient, api_error
+from sheets_client import appends_applied, mark_written, write_generation
+
+
+def failing(statuses):
+    """statuses の順にエラーを出し、そのあとは成功する関数と呼び出し回数"""
+    calls = []
+
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(statuses):
+            raise api_error(statuses[len(calls) - 1], "error")
+        return "ok"
+    return func, calls
+
+
+@pytest.fixture
+def scheduler():
+    return RequestScheduler(10**9, 10**9, max_retries=3, base_delay=0.0)
+
+
+def test_idempotent_call_retries_server_errors(scheduler):
+    func, calls = failing([503, 500])
+    assert scheduler.call(func) == "ok"
+    assert len(calls) == 3
+    assert scheduler.metrics["retried"] == 2
+
+
+def test_append_is_not_retried_after_server_error(scheduler):
+    func, calls = failing([503])
+    with pytest.raises(Exception):
+        scheduler.call(func, idempotent=False)
+    assert len(calls) == 1
+
+
+def test_append_is_retried_when_rejected(scheduler):
+    func, calls = failing([429])
+    assert scheduler.call(func, idempotent=False) == "ok"
+    assert len(calls) == 2
+
+
+def test_appends_applied_checks_sheet_tail():
+    spreadsheet = FakeClient().add_spreadsheet("test", {
+        "expense": [["Person", "Amount"], ["A", 100], ["B", 200]],
+    })
+    worksheet = spreadsheet.worksheet("expense")
+
+    assert appends_applied([("append", worksheet, [["B", 200]])])
+    assert not appends_applied([("append", worksheet, [["C", 300]])])
+    assert not appends_applied([("replace", worksheet, [["B", 200]])])
+
+
+def test_write_generation_changes_after_write():
+    before = write_generation("spreadsheet-id")
+    mark_written("spreadsheet-id")
+    assert write_generation("spreadsheet-id") != before
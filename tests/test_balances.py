@@ -0,0 +1,169 @@
+import pandas as pd
+import pytest
+
+from balances import (
+    BalanceLedger,
+    RunningBalance,
+    StoreBalanceLedger,
+    minimal_transfers,
+    person_totals,
+    settlement_balances,
+)
+from table_store import CsvStore
+
+COLUMNS = {"person_column": "Person", "amount_column": "Amount",
+           "category_column": "Content"}
+
+
+def expenses(*rows):
+    return pd.DataFrame(list(rows), columns=["Person", "Amount", "Content"])
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return BalanceLedger(str(tmp_path / "balances.json"))
+
+
+def test_person_totals_with_category_dtype():
+    frame = expenses(("A", 100, "食費"), ("B", 200, "食費"), ("A", 50, "その他"))
+    frame["Person"] = frame["Person"].astype("category")
+    assert person_totals(frame).to_dict() == {"A": 150.0, "B": 200.0}
+
+
+def test_running_balance_adds_only_new_rows():
+    balance = RunningBalance(**COLUMNS)
+    frame = expenses(("A", 100, "食費"), ("B", 200, "その他"))
+    balance.add_frame(frame)
+    frame = pd.concat([frame, expenses(("A", 50, "その他"))],
+                      ignore_index=True)
+
+    hashes = balance.row_hashes(frame)
+    assert balance.matches(hashes)
+    balance.add_frame(frame, start=balance.rows, hashes=hashes)
+    assert balance.totals == {"A": 150, "B": 200}
+    assert balance.subtotals == {"A": {"食費": 100, "その他": 50},
+                                 "B": {"その他": 200}}
+
+
+def test_ledger_sync_is_incremental_and_persistent(ledger, tmp_path):
+    frame = expenses(("A", 100, "食費"))
+    ledger.sync("expense", frame, **COLUMNS)
+    frame = pd.concat([frame, expenses(("B", 300, "食費"))],
+                      ignore_index=True)
+    balance = ledger.sync("expense", frame, **COLUMNS)
+    assert balance.rows == 2
+    assert balance.totals == {"A": 100, "B": 300}
+
+    reloaded = BalanceLedger(str(tmp_path / "balances.json"))
+    assert reloaded.sync("expense", frame, **COLUMNS).totals == balance.totals
+
+
+def test_ledger_recomputes_when_list_was_replaced(ledger):
+    ledger.sync("expense", expenses(("A", 100, "食費"), ("B", 200, "食費")),
+                **COLUMNS)
+    # 精算でクリアされたあとに追加された一覧
+    balance = ledger.sync("expense", expenses(("B", 50, "食費")), **COLUMNS)
+    assert balance.totals == {"B": 50}
+
+
+def test_ledger_recomputes_when_an_earlier_row_was_edited(ledger):
+    ledger.sync("expense", expenses(("A", 100, "食費"), ("B", 200, "食費")),
+                **COLUMNS)
+    # 最後の行はそのままで、途中の行だけが変わり、1行増えた一覧
+    edited = expenses(("A", 400, "食費"), ("B", 200, "食費"),
+                      ("B", 50, "その他"))
+    balance = ledger.sync("expense", edited, **COLUMNS)
+    assert balance.totals == {"A": 400, "B": 250}
+
+
+def test_ledger_skips_unchanged_frame(ledger, monkeypatch):
+    frame = expenses(("A", 100, "食費"))
+    balance = ledger.sync("expense", frame, **COLUMNS)
+
+    def fail(frame):
+        raise AssertionError("同じデータフレームを照合し直した")
+
+    monkeypatch.setattr(balance, "row_hashes", fail)
+    assert ledger.sync("expense", frame, **COLUMNS) is balance
+
+
+def test_verify_fixes_tampered_totals(ledger):
+    frame = expenses(("A", 100, "食費"), ("B", 200, "食費"))
+    balance = ledger.sync("expense", frame, **COLUMNS)
+    balance.totals["A"] = 0
+
+    assert ledger.verify("expense", frame, **COLUMNS) == ["A"]
+    assert balance.totals == {"A": 100, "B": 200}
+    assert ledger.verify("expense", frame, **COLUMNS) == []
+
+
+def test_store_ledger_is_shared_through_the_store(tmp_path):
+    store = CsvStore(str(tmp_path / "store"))
+    frame = expenses(("A", 100, "食費"), ("B", 300, "食費"))
+    StoreBalanceLedger(store).sync("expense", frame, **COLUMNS)
+
+    # 別のプロセス（同じ保存先を使う別のインスタンス）から読む
+    other = StoreBalanceLedger(CsvStore(str(tmp_path / "store")))
+    balance = other._balance("expense", **COLUMNS)
+    assert balance.rows == 2
+    assert balance.matches(balance.row_hashes(frame))
+    assert other.sync("expense", frame, **COLUMNS).totals == {"A": 100,
+                                                              "B": 300}
+
+
+def test_store_ledger_ignores_stale_saved_totals(tmp_path):
+    store = CsvStore(str(tmp_path / "store"))
+    StoreBalanceLedger(store).sync(
+        "expense", expenses(("A", 100, "食費"), ("B", 300, "食費")), **COLUMNS)
+    # 合計を保存したあとで、一覧だけが書き換えられた
+    edited = expenses(("A", 100, "食費"), ("B", 30, "食費"))
+    balance = StoreBalanceLedger(store).sync("expense", edited, **COLUMNS)
+    assert balance.totals == {"A": 100, "B": 30}
+
+
+def test_two_people_settle_in_one_transfer():
+    balances = settlement_balances({"A": 1000, "B": 100}, ["A", "B"])
+    assert minimal_transfers(balances) == [("B", "A", 450)]
+
+
+def test_uneven_split_is_rounded_to_whole_yen():
+    balances = settlement_balances({"A": 1000}, ["A", "B", "C"])
+    assert balances.sum() == 0
+    transfers = minimal_transfers(balances)
+    assert transfers == [("B", "A", 334), ("C", "A", 333)]
+    assert all(isinstance(amount, int) for _, _, amount in transfers)
+    assert sum(amount for _, _, amount in transfers) == 1000 - 333
+
+
+def test_remainder_goes_to_the_largest_debtor():
+    balances = settlement_balances({"A": 100, "B": 100, "C": 101},
+                                   ["A", "B", "C"])
+    assert balances.to_dict() == {"A": -1, "B": 0, "C": 1}
+    assert minimal_transfers(balances) == [("A", "C", 1)]
+
+
+def test_non_participant_spending_is_shared():
+    balances = settlement_balances({"A": 300, "X": 300}, ["A", "B"])
+    assert balances.to_dict() == {"A": 100, "B": -200, "X": 100}
+    assert sorted(minimal_transfers(balances)) == [("B", "A", 100),
+                                                   ("B", "X", 100)]
+
+
+def test_transfers_use_at_most_n_minus_one_payments():
+    totals = {"A": 700, "B": 0, "C": 250, "D": 50}
+    transfers = minimal_transfers(settlement_balances(totals, list(totals)))
+    assert len(transfers) <= len(totals) - 1
+    received = {}
+    for payer, payee, amount in transfers:
+        received[payee] = received.get(payee, 0) + amount
+        received[payer] = received.get(payer, 0) - amount
+    assert received == {"A": 450, "B": -250, "D": -200}
+
+
+def test_settlement_returns_integer_total():
+    balance = RunningBalance(**COLUMNS)
+    balance.add_frame(expenses(("A", 1000, "食費"), ("B", 1, "食費")))
+    transfers, total = balance.settlement(["A", "B", "C"])
+    assert total == 1001
+    # 1001 / 3 の端数 2円は、支払いの最も多い C が負担する
+    assert transfers == [("C", "A", 335), ("B", "A", 332)]
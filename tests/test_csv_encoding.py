@@ -0,0 +1,86 @@
+import codecs
+
+import pandas as pd
+import pytest
+
+from csv_encoding import (
+    SAMPLE_BYTES,
+    candidate_encodings,
+    decode,
+    read_csv_bytes,
+)
+
+TEXT = "日付,内容,金額\n2024/01/05,スーパー①,1200\n"
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "cp932", "iso-2022-jp"])
+def test_decode_detects_encoding(encoding):
+    text = TEXT if encoding == "cp932" else TEXT.replace("①", "")
+    data = text.encode(encoding)
+    assert decode(data) == (text, encoding, False)
+
+
+def test_decode_bom():
+    data = codecs.BOM_UTF8 + TEXT.encode("utf-8")
+    assert decode(data) == (TEXT, "utf-8-sig", False)
+
+
+def test_ascii_only_is_utf8():
+    assert candidate_encodings(b"date,amount\n1,2\n") == ["utf-8"]
+
+
+def test_nec_special_characters_need_cp932():
+    # ① は Shift_JIS にはなく cp932 の拡張文字
+    data = TEXT.encode("cp932")
+    assert "shift_jis" in candidate_encodings(data[:20])
+    assert decode(data)[1] == "cp932"
+
+
+def test_switches_encoding_when_full_decode_fails():
+    # 先頭部分は Shift_JIS でも読めるが、後ろに cp932 にしかない文字がある
+    plain = TEXT.replace("①", "")
+    data = plain.encode("cp932") * 3000 + TEXT.encode("cp932")
+    assert candidate_encodings(data)[0] == "shift_jis"
+    assert decode(data) == (plain * 3000 + TEXT, "cp932", False)
+
+
+def test_read_csv_bytes_parses_once(monkeypatch):
+    calls = []
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, "read_csv",
+                        lambda *args: calls.append(args) or read_csv(*args))
+    data = TEXT.replace("①", "").encode("utf-8")
+    assert read_csv_bytes(data, preferred="cp932")[1] == "utf-8"
+    assert len(calls) == 1
+
+
+def test_error_after_sample_falls_back_to_candidate():
+    # 判定に使う先頭部分（SAMPLE_BYTES）より後ろに読めないバイトがある
+    data = TEXT.encode("cp932") * 3000 + b"\x85\x20" + TEXT.encode("cp932")
+    assert len(data) > SAMPLE_BYTES
+    text, encoding, lossy = decode(data)
+    assert (encoding, lossy) == ("cp932", True)
+    assert text.count("\ufffd") == 1
+    assert text.endswith(TEXT)
+
+
+def test_undecodable_sample_falls_back_to_cp932():
+    data = b"\x85\x20" + TEXT.encode("cp932")
+    text, encoding, lossy = decode(data)
+    assert (encoding, lossy) == ("cp932", True)
+    assert text.endswith(TEXT)
+
+
+def test_read_csv_bytes_uses_preferred_encoding():
+    data = TEXT.encode("cp932")
+    frame, encoding, lossy = read_csv_bytes(data, preferred="cp932")
+    assert (encoding, lossy) == ("cp932", False)
+    assert frame.columns.tolist() == ["日付", "内容", "金額"]
+    assert frame["金額"].tolist() == [1200]
+
+
+def test_read_csv_bytes_redetects_wrong_preferred_encoding():
+    data = TEXT.replace("①", "").encode("utf-8")
+    frame, encoding, _ = read_csv_bytes(data, preferred="cp932")
+    assert encoding == "utf-8"
+    assert frame["内容"].tolist() == ["スーパー"]
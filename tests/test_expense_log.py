@@ -0,0 +1,77 @@
+import datetime
+
+import pytest
+
+from local_storage import ExpenseLog
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "household_data.jsonl")
+
+
+def rows(log):
+    return log.frame().values.tolist()
+
+
+def test_add_and_settle(path):
+    log = ExpenseLog(path)
+    log.add_expense("A", datetime.date(2024, 1, 5), 100)
+    log.add_expense("B", datetime.date(2024, 1, 6), 200)
+    assert rows(log) == [["A", "2024-01-05", 100], ["B", "2024-01-06", 200]]
+
+    log.settle()
+    assert rows(log) == []
+    log.add_expense("A", datetime.date(2024, 2, 1), 50)
+    assert rows(log) == [["A", "2024-02-01", 50]]
+
+
+def test_reads_only_the_new_tail(path):
+    log = ExpenseLog(path)
+    other = ExpenseLog(path)
+    log.add_expense("A", "2024-01-05", 100)
+    assert rows(other) == [["A", "2024-01-05", 100]]
+    offset = other._offset
+
+    log.add_expense("B", "2024-01-06", 200)
+    assert rows(other)[-1] == ["B", "2024-01-06", 200]
+    assert other._offset > offset
+
+
+def test_incomplete_last_line_is_read_later(path):
+    log = ExpenseLog(path)
+    log.add_expense("A", "2024-01-05", 100)
+    line = '{"type": "expense", "Person": "B", "Date": "2024-01-06", ' \
+           '"Amount": 200}\n'
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[:20])
+    assert len(rows(log)) == 1
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line[20:])
+    assert rows(log)[-1] == ["B", "2024-01-06", 200]
+
+
+def test_compaction_drops_settled_lines(path):
+    log = ExpenseLog(path, compact_threshold=3)
+    other = ExpenseLog(path)
+    log.add_expense("A", "2024-01-05", 100)
+    log.add_expense("B", "2024-01-06", 200)
+    assert len(rows(other)) == 2
+
+    log.settle()
+    log.add_expense("A", "2024-02-01", 50)
+
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+    assert rows(log) == [["A", "2024-02-01", 50]]
+    # 書き直されたファイルは、別のインスタンスでも最初から読み直す
+    assert rows(other) == [["A", "2024-02-01", 50]]
+
+
+def test_imports_legacy_csv(tmp_path, path):
+    legacy = tmp_path / "household_data.csv"
+    legacy.write_text("Person,Date,Amount\nA,2024-01-05,100\n",
+                      encoding="utf-8")
+    log = ExpenseLog(path, legacy_csv=str(legacy))
+    assert rows(log) == [["A", "2024-01-05", 100]]
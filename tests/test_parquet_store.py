@@ -0,0 +1,124 @@
+import datetime
+import glob
+import json
+import os
+
+import pytest
+
+import migrate_local_data
+from local_storage import ParquetExpenseStore
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / "household_data")
+
+
+def rows(store):
+    return [[person, str(date), amount]
+            for person, date, amount in store.frame().values.tolist()]
+
+
+def part_files(root, month):
+    return glob.glob(os.path.join(root, f"month={month}", "*.parquet"))
+
+
+def test_add_and_read_back(root):
+    store = ParquetExpenseStore(root)
+    store.add_expense("A", datetime.date(2024, 1, 5), 100)
+    store.add_expense("B", "2024-02-01", 200)
+    assert rows(store) == [["A", "2024-01-05", 100], ["B", "2024-02-01", 200]]
+    assert sorted(os.path.basename(path) for path in
+                  glob.glob(os.path.join(root, "month=*"))) == [
+        "month=2024-01", "month=2024-02"]
+
+    # 別のインスタンス（別のプロセス）からも同じ一覧が読める
+    assert rows(ParquetExpenseStore(root)) == rows(store)
+
+
+def test_settle_hides_earlier_rows_but_keeps_totals(root):
+    store = ParquetExpenseStore(root)
+    store.add_expense("A", "2024-01-05", 100)
+    store.add_expense("B", "2024-01-06", 200)
+    store.settle()
+    assert rows(store) == []
+
+    store.add_expense("A", "2024-01-07", 50)
+    assert rows(store) == [["A", "2024-01-07", 50]]
+    # 精算済みの行も消えずに残り、全履歴の合計に入る
+    totals = dict(store.totals().values.tolist())
+    assert totals == {"A": 150, "B": 200}
+
+
+def test_settle_at_cutoff(root):
+    store = ParquetExpenseStore(root)
+    store.write_rows([("A", datetime.date(2024, 1, 5), 100, 10),
+                      ("B", datetime.date(2024, 1, 6), 200, 20)])
+    # 区切りの時刻ちょうどに記録した行は精算済み
+    store.settle(at=10)
+    assert rows(store) == [["B", "2024-01-06", 200]]
+
+
+def test_parts_are_compacted_per_month(root):
+    store = ParquetExpenseStore(root, compact_parts=3)
+    for day in range(1, 5):
+        store.add_expense("A", f"2024-01-{day:02d}", day)
+    store.add_expense("B", "2024-02-01", 10)
+
+    # 4つ目の追加で1月は1つのファイルにまとめられる
+    assert len(part_files(root, "2024-01")) == 1
+    assert len(part_files(root, "2024-02")) == 1
+    assert [row[2] for row in rows(store)] == [1, 2, 3, 4, 10]
+
+    store.add_expense("B", "2024-02-02", 20)
+    store.compact()
+    assert len(part_files(root, "2024-02")) == 1
+    assert [row[2] for row in rows(store)] == [1, 2, 3, 4, 10, 20]
+
+
+def write_log(path, events):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+def expense(person, date, amount):
+    return {"type": "expense", "Person": person, "Date": date,
+            "Amount": amount}
+
+
+def test_migrate_log_keeps_settled_rows(tmp_path, root):
+    log = str(tmp_path / "household_data.jsonl")
+    write_log(log, [
+        expense("A", "2024-01-05", 100),
+        expense("B", "2024-01-06", 200),
+        {"type": "settle"},
+        expense("A", "2024-02-01", 50),
+    ])
+    data, settled = migrate_local_data.read_log(log)
+    assert settled == 2
+    assert len(data) == 3
+
+    assert migrate_local_data.migrate(log, root) == 0
+    store = ParquetExpenseStore(root)
+    # 区切りより後の行だけが一覧に出て、精算済みの行は合計に残る
+    assert rows(store) == [["A", "2024-02-01", 50]]
+    assert dict(store.totals().values.tolist()) == {"A": 150, "B": 200}
+
+
+def test_migrate_log_settled_at_the_end(tmp_path, root):
+    log = str(tmp_path / "household_data.jsonl")
+    write_log(log, [expense("A", "2024-01-05", 100), {"type": "settle"}])
+    assert migrate_local_data.migrate(log, root) == 0
+    store = ParquetExpenseStore(root)
+    assert rows(store) == []
+    assert store.settled_at() > 0
+
+
+def test_migrate_refuses_existing_target(tmp_path, root):
+    log = str(tmp_path / "household_data.jsonl")
+    write_log(log, [expense("A", "2024-01-05", 100)])
+    ParquetExpenseStore(root).add_expense("B", "2024-01-06", 200)
+
+    assert migrate_local_data.migrate(log, root) == 1
+    assert rows(ParquetExpenseStore(root)) == [["B", "2024-01-06", 200]]
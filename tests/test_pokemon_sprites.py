@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pokemon_sprites import PokemonCache, PokemonLoader
+
+IMAGE = b"\x89PNG" + b"\x00" * 96
+
+
+class FakePokeApi(ThreadingHTTPServer):
+    """PokeAPI の代わりにポケモン・種族・画像を返すローカルのサーバー"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakePokeApiHandler)
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+        self.paths = []
+        # 応答までに待つ秒数（タイムアウトの確認用）
+        self.delay = 0.0
+
+
+class FakePokeApiHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.paths.append(self.path)
+        time.sleep(server.delay)
+        match = re.fullmatch(r"/api/v2/(pokemon|pokemon-species)/(\d+)",
+                             self.path)
+        if match and match[1] == "pokemon":
+            pokemon_id = match[2]
+            self._send_json({
+                "species": {"url": f"{server.base_url}/api/v2/"
+                                   f"pokemon-species/{pokemon_id}"},
+                "sprites": {"other": {"showdown": {"front_default": None}},
+                            "front_default": f"{server.base_url}/sprites/"
+                                             f"{pokemon_id}.png"},
+            })
+        elif match:
+            self._send_json({"names": [{"name": f"ポケモン{match[2]}"}]})
+        elif re.fullmatch(r"/sprites/\d+\.png", self.path):
+            self._send(IMAGE, "image/png")
+        else:
+            self.send_error(404)
+
+    def _send_json(self, data):
+        self._send(json.dumps(data).encode("utf-8"), "application/json")
+
+    def _send(self, body, content_type):
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            # タイムアウトしたクライアントが先に切断した場合
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def pokeapi():
+    server = FakePokeApi()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PokemonCache(str(tmp_path / "pokemon"))
+
+
+def make_loader(cache, base_url, timeout=(1, 1)):
+    return PokemonLoader(cache, base_url=f"{base_url}/api/v2",
+                         timeout=timeout, max_id=1)
+
+
+def wait_for_prefetch(loader):
+    for future in list(loader._pending.values()):
+        future.result(timeout=10)
+
+
+def test_fetch_saves_name_and_image(pokeapi, cache):
+    make_loader(cache, pokeapi.base_url).fetch(25)
+    assert cache.get(25) == {"id": 25, "name": "ポケモン25", "image": IMAGE}
+    assert pokeapi.paths == ["/api/v2/pokemon/25",
+                             "/api/v2/pokemon-species/25",
+                             "/sprites/25.png"]
+
+
+def test_random_pokemon_prefetches_then_uses_cache(pokeapi, cache):
+    loader = make_loader(cache, pokeapi.base_url)
+    # 最初はキャッシュが空なので何も表示せず、裏で取得する
+    assert loader.random_pokemon() is None
+    wait_for_prefetch(loader)
+    assert len(pokeapi.paths) == 3
+
+    assert loader.random_pokemon()["name"] == "ポケモン1"
+    wait_for_prefetch(loader)
+    # キャッシュ済みなので取得し直さない
+    assert len(pokeapi.paths) == 3
+
+
+def test_cache_evicts_least_recently_used(pokeapi, tmp_path):
+    cache = PokemonCache(str(tmp_path / "pokemon"), max_bytes=300)
+    loader = make_loader(cache, pokeapi.base_url)
+    loader.fetch(1)
+    loader.fetch(2)
+    # 1 のほうが古いが、表示したことで最近使ったものになる
+    old = time.time() - 60
+    os.utime(cache._meta_path(1), (old, old))
+    os.utime(cache._meta_path(2), (old + 1, old + 1))
+    assert cache.get(1) is not None
+
+    loader.fetch(3)
+    assert sorted(cache.cached_ids()) == [1, 3]
+
+
+def test_unreachable_api_does_not_block(cache):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    loader = make_loader(cache, base_url)
+
+    assert loader.random_pokemon() is None
+    wait_for_prefetch(loader)
+    assert loader._pending == {}
+    assert cache.cached_ids() == []
+
+
+def test_timeout_returns_none_without_waiting(pokeapi, cache):
+    pokeapi.delay = 1.0
+    loader = make_loader(cache, pokeapi.base_url, timeout=(0.2, 0.2))
+
+    started = time.perf_counter()
+    assert loader.random_pokemon() is None
+    # 描画は取得を待たない
+    assert time.perf_counter() - started < pokeapi.delay / 2
+
+    wait_for_prefetch(loader)
+    assert loader._pending == {}
+    assert cache.cached_ids() == []
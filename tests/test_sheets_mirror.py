@@ -0,0 +1,128 @@
+import pytest
+
+import sheets_mirror
+from fake_sheets import FakeClient, api_error
+from sheets_mirror import SheetsMirror
+
+
+@pytest.fixture
+def sheets():
+    spreadsheet = FakeClient().add_spreadsheet("test", {
+        "expense": [["Person", "Amount"], ["A", 100]],
+        "history": [["Person", "Amount"]],
+    })
+    return {name: spreadsheet.worksheet(name)
+            for name in ("expense", "history")}
+
+
+@pytest.fixture
+def mirror(tmp_path, sheets):
+    mirror = SheetsMirror(str(tmp_path / "mirror.sqlite3"),
+                          flush_interval=3600, refresh_seconds=3600)
+    mirror.load(sheets, tail={"history"})
+    # バックグラウンドの同期と競合しないよう、テスト中は同期のロックを持つ
+    with mirror._sync_lock:
+        yield mirror
+
+
+def test_commit_is_local_until_flush(mirror, sheets):
+    mirror.commit([("append", sheets["expense"], [["B", 200]])])
+
+    frame = mirror.load({"expense": sheets["expense"]})["expense"]
+    assert frame.values.tolist() == [["A", 100], ["B", 200]]
+    assert mirror.pending_count() == 1
+    assert sheets["expense"].rows == [["Person", "Amount"], ["A", 100]]
+
+    assert mirror.flush() == 1
+    assert mirror.pending_count() == 0
+    assert sheets["expense"].rows[-1] == ["B", 200]
+
+
+def test_commit_appends_to_cached_frame(mirror, sheets):
+    before = mirror._tail("expense")
+    mirror.commit([("append", sheets["expense"], [["B", 200]])])
+    assert mirror._tail("expense") is before
+    assert len(before.frame) == 2
+
+
+def test_commit_rolls_back_on_error(mirror, sheets, monkeypatch):
+    def fail(title, start, rows):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(mirror, "_insert_rows", fail)
+    with pytest.raises(RuntimeError):
+        mirror.commit([
+            ("replace", sheets["history"], [["Person", "Amount"]]),
+            ("append", sheets["expense"], [["B", 200]]),
+        ])
+
+    assert not mirror._db.in_transaction
+    assert mirror.pending_count() == 0
+    frame = mirror.load({"expense": sheets["expense"]})["expense"]
+    assert frame.values.tolist() == [["A", 100]]
+
+
+def test_flush_dead_letters_rejected_write(mirror, sheets, monkeypatch):
+    execute_writes = sheets_mirror.execute_writes
+
+    def reject_bad_rows(writes):
+        if any(rows and rows[0][0] == "BAD" for _, _, rows in writes):
+            raise api_error(400, "Unable to parse range")
+        return execute_writes(writes)
+
+    monkeypatch.setattr(sheets_mirror, "execute_writes", reject_bad_rows)
+    for person in ("B", "BAD", "C"):
+        mirror.commit([("append", sheets["expense"], [[person, 1]])])
+
+    assert mirror.flush() == 2
+    assert [row[0] for row in sheets["expense"].rows] == [
+        "Person", "A", "B", "C"]
+    assert mirror.pending_count() == 0
+    assert mirror.stats()["failed"] == 1
+    [(titles, error, _)] = mirror.dead_letters()
+    assert titles == ["expense"]
+    assert "Unable to parse range" in error
+
+
+def test_flush_keeps_retryable_failure_pending(mirror, sheets, monkeypatch):
+    def unavailable(writes):
+        raise api_error(503, "unavailable")
+
+    monkeypatch.setattr(sheets_mirror, "execute_writes", unavailable)
+    mirror.commit([("replace", sheets["expense"], [["Person", "Amount"]])])
+
+    assert mirror.flush() == 0
+    assert mirror.pending_count() == 1
+    assert mirror.stats()["failed"] == 0
+
+
+def test_refresh_reads_only_new_history_rows(mirror, sheets):
+    sheets["history"].rows.append(["A", 300])
+    mirror._db.execute("UPDATE sheet_meta SET hydrated_at = 0")
+    tail = mirror._tail("history")
+
+    mirror._refresh_stale()
+
+    assert mirror._tail("history") is tail
+    assert tail.frame.values.tolist() == [["A", 300]]
+
+
+def test_flush_does_not_resend_applied_append(mirror, sheets, monkeypatch):
+    execute_writes = sheets_mirror.execute_writes
+    failures = [api_error(503, "backend error")]
+
+    def applied_then_failed(writes):
+        # 反映されたあとで応答がエラーになる場合
+        execute_writes(writes)
+        if failures:
+            raise failures.pop()
+
+    monkeypatch.setattr(sheets_mirror, "execute_writes", applied_then_failed)
+    mirror.commit([("append", sheets["expense"], [["B", 200]])])
+
+    assert mirror.flush() == 0
+    assert mirror.pending_count() == 1
+    assert mirror.flush() == 1
+    assert mirror.pending_count() == 0
+    assert sheets["expense"].rows == [
+        ["Person", "Amount"], ["A", 100], ["B", 200]]
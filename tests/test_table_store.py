@@ -0,0 +1,101 @@
+import pytest
+
+from sheet_schemas import Column, Schema
+from table_store import CsvStore, MemoryStore, SheetsStore, SqliteStore
+
+SCHEMAS = {
+    "expense": Schema([Column("Person"), Column("Amount", "Int64")]),
+    "history": Schema([Column("Person"), Column("Amount", "Int64")]),
+}
+HEADER = ["Person", "Amount"]
+
+
+def make_store(backend, tmp_path, name="store"):
+    if backend == "memory":
+        return MemoryStore(SCHEMAS)
+    if backend == "csv":
+        return CsvStore(str(tmp_path / name), SCHEMAS)
+    if backend == "sqlite":
+        return SqliteStore(str(tmp_path / f"{name}.sqlite3"), SCHEMAS)
+    # スプレッドシートはプロセス内で共有されるため、テストごとに名前を変える
+    return SheetsStore(f"{tmp_path.name}-{name}",
+                       {"expense": "expense", "history": "history"},
+                       SCHEMAS, create_missing=True)
+
+
+@pytest.fixture(params=["memory", "csv", "sqlite", "sheets"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def store(backend, tmp_path):
+    return make_store(backend, tmp_path)
+
+
+def values(frame):
+    return frame.values.tolist()
+
+
+def test_append_adds_header_once(store):
+    assert not store.has_header("expense")
+    store.append_rows("expense", [HEADER, ["A", 100]])
+    assert store.has_header("expense")
+    store.append_rows("expense", [["B", 200]])
+
+    frame = store.read_frame("expense")
+    assert list(frame.columns) == HEADER
+    assert str(frame["Amount"].dtype) == "Int64"
+    assert values(frame) == [["A", 100], ["B", 200]]
+    # CSV は値を文字列のまま返す
+    [row] = store.read_range("expense", 3, 3)
+    assert [str(value) for value in row] == ["B", "200"]
+
+
+def test_replace(store):
+    store.append_rows("expense", [HEADER, ["A", 100], ["B", 200]])
+    store.read_frame("expense")
+    store.replace("expense", [HEADER, ["C", 300]])
+    assert values(store.read_frame("expense")) == [["C", 300]]
+
+    store.replace("expense", [HEADER])
+    assert store.read_frame("expense").empty
+    assert store.has_header("expense")
+
+
+def test_batch_writes_every_table(store):
+    store.append_rows("expense", [HEADER, ["A", 100]])
+    store.batch([
+        ("append", "history", [HEADER, ["A", 100]]),
+        ("replace", "expense", [HEADER]),
+    ])
+    frames = store.read_frames(["expense", "history"])
+    assert frames["expense"].empty
+    assert values(frames["history"]) == [["A", 100]]
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite"])
+def test_sees_writes_from_another_instance(backend, tmp_path):
+    store = make_store(backend, tmp_path)
+    other = make_store(backend, tmp_path)
+    store.append_rows("expense", [HEADER, ["A", 100]])
+    assert values(other.read_frame("expense")) == [["A", 100]]
+
+    other.append_rows("expense", [["B", 200]])
+    assert values(store.read_frame("expense")) == [["A", 100], ["B", 200]]
+
+
+def test_sqlite_batch_rolls_back(tmp_path):
+    store = make_store("sqlite", tmp_path)
+    store.append_rows("expense", [HEADER, ["A", 100]])
+    store.read_frame("expense")
+
+    with pytest.raises(TypeError):
+        store.batch([
+            ("replace", "expense", [HEADER]),
+            ("append", "history", [HEADER, None]),
+        ])
+
+    assert not store._db.in_transaction
+    assert store.read_values(["history"]) == {"history": []}
+    assert values(store.read_frame("expense")) == [["A", 100]]
@@ -0,0 +1,194 @@
+"""再実行ごとの処理時間の計測
+
+外部呼び出し（認証・Sheets / Drive API）や主な描画処理を span で囲み、
+Streamlit の再実行1回分の内訳を記録する。プロセス全体では処理ごとの
+直近の所要時間を保持し、p50 / p95 を表示できる。
+
+管理者用の表示は secrets.toml の [TRACING] ADMIN_KEY を設定し、
+URL に ?admin=<ADMIN_KEY> を付けたときだけ出す。
+JSONL_PATH を設定すると再実行ごとの記録をファイルに追記する。
+"""
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# 処理ごとに保持する直近の計測数
+STATS_WINDOW = 200
+
+_local = threading.local()
+_file_lock = threading.Lock()
+
+
+class Trace:
+    """再実行1回分の span の記録"""
+
+    def __init__(self, page):
+        self.page = page
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.depth = 0
+        self.total_ms = None
+
+
+class SpanStats:
+    """処理ごとの直近の所要時間（ミリ秒）"""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=window)
+        )
+        self._lock = threading.Lock()
+
+    def add(self, name, duration_ms):
+        with self._lock:
+            self._samples[name].append(duration_ms)
+
+    def table(self):
+        with self._lock:
+            samples = {name: list(values)
+                       for name, values in self._samples.items()}
+        rows = []
+        for name, values in sorted(samples.items()):
+            series = pd.Series(values)
+            rows.append({
+                "処理": name,
+                "回数": len(values),
+                "p50 (ms)": round(series.quantile(0.5), 1),
+                "p95 (ms)": round(series.quantile(0.95), 1),
+            })
+        return pd.DataFrame(rows)
+
+
+# バックグラウンドのスレッドでの計測も集計するためプロセス全体で共有する
+span_stats = SpanStats()
+
+
+def begin_rerun(page):
+    """スクリプトの先頭で呼び、この再実行の記録を始める"""
+    _local.trace = Trace(page)
+
+
+@contextlib.contextmanager
+def span(name):
+    """with 文で囲んだ処理の所要時間を記録する"""
+    trace = getattr(_local, "trace", None)
+    start = time.perf_counter()
+    record = None
+    if trace is not None:
+        # 開始順に並ぶよう、開始時点で記録を追加しておく
+        record = {
+            "name": name,
+            "start_ms": round((start - trace.origin) * 1000, 1),
+            "duration_ms": None,
+            "depth": trace.depth,
+        }
+        trace.spans.append(record)
+        trace.depth += 1
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        span_stats.add(name, duration_ms)
+        if record is not None:
+            trace.depth -= 1
+            record["duration_ms"] = round(duration_ms, 1)
+
+
+def traced(name=None):
+    """関数全体を span で囲むデコレーター"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _is_fragment_rerun():
+    """フラグメントだけの再実行中か（スクリプトの先頭は実行されていない）"""
+    ctx = get_script_run_ctx()
+    return bool(ctx is not None and ctx.fragment_ids_this_run)
+
+
+def traced_fragment(page, name=None):
+    """st.fragment の代わりに使い、フラグメントの処理時間も記録する
+
+    スクリプト全体の再実行では、その記録の中の span として計測する。
+    フラグメントだけの再実行では begin_rerun が呼ばれないため、
+    "<page>:<name>" の再実行として記録を始めて終える（フラグメントの中から
+    サイドバーには書けないので、内訳は次の全体の再実行で表示される）。
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def body(*args, **kwargs):
+            if not _is_fragment_rerun():
+                with span(span_name):
+                    return func(*args, **kwargs)
+            begin_rerun(f"{page}:{span_name}")
+            try:
+                with span(span_name):
+                    return func(*args, **kwargs)
+            finally:
+                end_rerun()
+        return st.fragment(body)
+    return decorator
+
+
+def end_rerun():
+    """この再実行の記録を終え、必要なら JSONL に追記して返す"""
+    trace = getattr(_local, "trace", None)
+    _local.trace = None
+    if trace is None:
+        return None
+    trace.total_ms = round((time.perf_counter() - trace.origin) * 1000, 1)
+    span_stats.add(f"rerun:{trace.page}", trace.total_ms)
+
+    path = st.secrets.get("TRACING", {}).get("JSONL_PATH")
+    if path:
+        record = {
+            "page": trace.page,
+            "started_at": trace.started_at,
+            "total_ms": trace.total_ms,
+            "spans": trace.spans,
+        }
+        with _file_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return trace
+
+
+def is_admin():
+    admin_key = st.secrets.get("TRACING", {}).get("ADMIN_KEY")
+    return bool(admin_key) and st.query_params.get("admin") == admin_key
+
+
+def show_timing_panel():
+    """スクリプトの末尾で呼び、管理者には処理時間の内訳を表示する"""
+    trace = end_rerun()
+    if trace is None or not is_admin():
+        return
+    with st.sidebar.expander("処理時間"):
+        st.write(f"今回の再実行: {trace.total_ms:.0f} ms")
+        st.dataframe(
+            pd.DataFrame([
+                {"処理": "　" * s["depth"] + s["name"],
+                 "開始 (ms)": s["start_ms"],
+                 "所要 (ms)": s["duration_ms"]}
+                for s in trace.spans
+            ]),
+            hide_index=True,
+        )
+        st.write("直近の所要時間")
+        st.dataframe(span_stats.table(), hide_index=True)